@@ -1,11 +1,11 @@
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import os
 import re
-import requests
 from typing import Optional
 from dcicutils.es_utils import create_es_client
 from dcicutils import ff_utils
-from chalicelib_fourfront.checks.helpers import wrangler_utils
+from chalicelib_fourfront.checks.helpers import cache_utils, link_utils, wrangler_utils
 from chalicelib_fourfront.checks.helpers.es_utils import get_es_metadata
 # Use confchecks to import decorators object and its methods for each check module
 # rather than importing check_function, action_function, CheckResult, ActionResult
@@ -418,8 +418,13 @@ def page_children_routes(connection, **kwargs):
     return check
 
 
-@check_function()
+@check_function(cache_days=7)
 def check_help_page_urls(connection, **kwargs):
+    """
+    Checks the links in help and resources static sections. Each distinct url
+    is requested once, concurrently with a few requests per host at a time.
+    Working links are not requested again for cache_days.
+    """
     check = CheckResult(connection, 'check_help_page_urls')
     server = connection.ff_keys['server']
     help_results = ff_utils.search_metadata(
@@ -435,8 +440,8 @@ def check_help_page_urls(connection, **kwargs):
     sections_w_broken_links = {}
     addl_exceptions = {}
     timeouts = {}
+    urls_by_section = {}
     for result in results:
-        broken_links = []
         body = result.get('body', '')
         urls = []
         if result.get('options', {}).get('filetype') == 'md':
@@ -451,6 +456,7 @@ def check_help_page_urls(connection, **kwargs):
                 body = body[:body.index(link)] + body[body.index(link)+len(link):]
         # looks for links starting with http (full) or / (relative) inside parentheses or brackets
         urls += re.findall(r'[\(\[=]["]*(http[^\s\)\]"]+|/[^\s\)\]"]+)[\)\]"]', body)
+        section_urls = urls_by_section[result['@id']] = []
         for url in urls:
             if url.startswith('mailto'):
                 continue
@@ -463,31 +469,38 @@ def check_help_page_urls(connection, **kwargs):
                 url = server.rstrip('/') + url
             if url.startswith(server.rstrip('/') + '/search/') or url.startswith(server.rstrip('/') + '/browse/'):
                 continue
-            try:
-                headers = {
-                    'User-Agent': (
-                        'Mozilla/5.0 (Macintosh; Intel Mac OS X 13_3_1) '
-                        'AppleWebKit/537.36 (KHTML, like Gecko) '
-                        'Chrome/124.0.0.0 Safari/537.36'
-                    )   
-                }
-                request = requests.get(url.replace('&amp;', '&'), timeout=2, headers=headers)
-                if request.status_code == 403 and 'doi.org' in url:
-                    # requests to doi.org that get redirected to biorxiv fail with 403
-                    addl_exceptions.setdefault(result['@id'], {})
-                    addl_exceptions[result['@id']][url] = str(403)
-                elif request.status_code not in [200, 412]:
-                    broken_links.append((url, request.status_code))
-            except requests.exceptions.Timeout:
-                timeouts.setdefault(result['@id'], [])
-                timeouts[result['@id']].append(url)
-            except requests.exceptions.SSLError:
+            section_urls.append(url)
+
+    # request every url once, except for working links checked by recent runs
+    latest = check.get_latest_result() or {}
+    cache = link_utils.LinkCache((latest.get('full_output') or {}).get('checked urls'),
+                                 ttl_days=kwargs.get('cache_days') or 0)
+    all_urls = [url for urls in urls_by_section.values() for url in urls]
+    to_request = [url for url in dict.fromkeys(all_urls) if cache.get(url) is None]
+    requested = link_utils.check_urls([url.replace('&amp;', '&') for url in to_request])
+    url_results = {url: requested[url.replace('&amp;', '&')] for url in to_request}
+    cache.update(url_results)
+
+    for section, urls in urls_by_section.items():
+        broken_links = []
+        for url in urls:
+            url_result = url_results.get(url) or cache.get(url)
+            if 'timeout' in url_result:
+                timeouts.setdefault(section, [])
+                timeouts[section].append(url)
+            elif 'ssl_error' in url_result:
                 continue
-            except Exception as e:
-                addl_exceptions.setdefault(result['@id'], {})
-                addl_exceptions[result['@id']][url] = str(e)
+            elif 'error' in url_result:
+                addl_exceptions.setdefault(section, {})
+                addl_exceptions[section][url] = url_result['error']
+            elif url_result['status'] == 403 and 'doi.org' in url:
+                # requests to doi.org that get redirected to biorxiv fail with 403
+                addl_exceptions.setdefault(section, {})
+                addl_exceptions[section][url] = str(403)
+            elif url_result['status'] not in link_utils.OK_STATUS:
+                broken_links.append((url, url_result['status']))
         if broken_links:
-            sections_w_broken_links[result['@id']] = broken_links
+            sections_w_broken_links[section] = broken_links
     if sections_w_broken_links:
         check.status = 'WARN'
         check.summary = 'Broken links found'
@@ -500,7 +513,8 @@ def check_help_page_urls(connection, **kwargs):
     check.full_output = {
         'broken links': sections_w_broken_links,
         'timed out requests': timeouts,
-        'additional exceptions': addl_exceptions
+        'additional exceptions': addl_exceptions,
+        'checked urls': cache.to_dict()
     }
     return check
 
@@ -595,10 +609,35 @@ def get_items_with_ignore_tags(key):
     return [item.get('uuid') for item in res]
 
 
-@check_function(id_list=None, last_mod_date=None, run_for_all=False)
+def _get_modified_uuids(connection, since):
+    """ uuids of all items (including deleted ones) modified since the given date """
+    query = 'search/?type=Item&last_modified.date_modified.from={}&field=uuid'.format(since)
+    delquery = query + '&status=deleted&status=replaced&status=obsolete'
+    res = ff_utils.search_metadata(query, key=connection.ff_keys)
+    res.extend(ff_utils.search_metadata(delquery, key=connection.ff_keys))
+    return set(item.get('uuid') for item in res)
+
+
+def _get_status_table(connection, table_days):
+    """ uuid -> [status, item_type] of the items checked by previous runs. Items modified
+        since the table was saved are removed, and the whole table is rebuilt every table_days """
+    now = datetime.datetime.utcnow()
+    table = cache_utils.get_cache(connection, 'check_status_mismatch', 'status_table')
+    if not table.get('created') or table['created'] < (now - datetime.timedelta(days=table_days)).isoformat():
+        table = {'created': now.isoformat(), 'items': {}}
+    elif table.get('date'):
+        for uuid in _get_modified_uuids(connection, table['date']):
+            table['items'].pop(uuid, None)
+    table['date'] = now.strftime('%Y-%m-%d %H:%M')
+    return table
+
+
+@check_function(id_list=None, last_mod_date=None, run_for_all=False, table_days=7)
 def check_status_mismatch(connection, **kwargs):
     # embedded sub items should have an equal or greater level
     # than that of the item in which they are embedded
+    # statuses of linked items are kept across runs in a table (see _get_status_table)
+    # and linked items are fetched in chunks while the next ExperimentSets are processed
     check = CheckResult(connection, 'check_status_mismatch')
     # if true will run on all replicate sets
     run_for_all = kwargs['run_for_all']
@@ -629,7 +668,6 @@ def check_status_mismatch(connection, **kwargs):
 
 
     MIN_CHUNK_SIZE = 200
-    id2links = {}
     id2status = {}
     id2item = {}
     stati2search = ['released', 'released_to_project']
@@ -649,61 +687,76 @@ def check_status_mismatch(connection, **kwargs):
         itemres = ff_utils.search_metadata(item_search, key=connection.ff_keys, page_limit=500)
         itemids = [item.get('uuid') for item in itemres]
 
+    status_table = _get_status_table(connection, kwargs.get('table_days') or 0)
+    linked_statuses = status_table['items']
     tagged2ignore = []
     checked_tags = False
     es_items = get_es_metadata(itemids, key=connection.ff_keys, chunk_size=200, is_generator=True)
 
-    for es_item in es_items:
-        if not checked_tags:
-            tagged2ignore = get_items_with_ignore_tags(connection.ff_keys)
-            checked_tags = True  # only do this once if at all
-        label = es_item.get('embedded').get('display_title')
-        desc = es_item.get('object').get('description')
-        lab = es_item.get('embedded').get('lab').get('display_title')
-        status = es_item.get('properties').get('status', 'in review by lab')
-        opfs = _get_all_other_processed_files(es_item)
-        id2links[es_item.get('uuid')] = [li.get('uuid') for li in es_item.get('linked_uuids_embedded')]
-        id2status[es_item.get('uuid')] = STATUS_LEVEL.get(status)
-        id2item[es_item.get('uuid')] = {'label': label, 'status': status, 'lab': lab,
-                                        'description': desc, 'to_ignore': list(set(opfs)) + tagged2ignore}
-
     mismatches = {}
-    linked2get = {}
-    for i, iid in enumerate(itemids):
-        linkedids = id2links.get(iid)
-        if not linkedids:  # item with no link
-            continue
-        istatus = id2status.get(iid)
-        for lid in linkedids:
-            lstatus = id2status.get(lid)
-            if not lstatus:  # add to list to get
-                linked2get.setdefault(lid, []).append(iid)
-            elif lstatus < istatus:  # status mismatch for an item we've seen before
-                ignore = id2item.get(iid).get('to_ignore')
-                if ignore is not None and lid in ignore:
-                    continue
-                else:
-                    mismatches.setdefault(iid, []).append(lid)
-
-        if len(linked2get) > MIN_CHUNK_SIZE or i + 1 == len(itemids):  # only query es when we have more than a set number of ids (500)
-            linked2chk = get_es_metadata(list(linked2get.keys()), key=connection.ff_keys,
-                                         chunk_size=200, is_generator=True)
-            for litem in linked2chk:
-                luuid = litem.get('uuid')
-                listatus = litem.get('properties').get('status', 'in review by lab')
-                llabel = litem.get('item_type')
-                lstatus = STATUS_LEVEL.get(listatus)
-                # add info to tracking dict
-                id2status[luuid] = lstatus
-                id2item[luuid] = {'label': llabel, 'status': listatus}
-                for lfid in set(linked2get[luuid]):
-                    # check to see if the linked item is something to ignore for that item
-                    ignore = id2item[lfid].get('to_ignore')
-                    if ignore is not None and luuid in ignore:
-                        continue
-                    elif lstatus < id2status[lfid]:  # status mismatch so add to report
-                        mismatches.setdefault(lfid, []).append(luuid)
-            linked2get = {}  # reset the linked id dict
+    linked2get = {}  # linked uuid -> uuids of the items it is linked from
+    requested = set()
+    to_request = []
+
+    def fetch_linked(lids):
+        linked = get_es_metadata(lids, key=connection.ff_keys, chunk_size=200,
+                                 sources=['uuid', 'item_type', 'properties.status'])
+        return [(li.get('uuid'), li.get('properties', {}).get('status', 'in review by lab'), li.get('item_type'))
+                for li in linked]
+
+    def compare(iid, lid):
+        lstatus = STATUS_LEVEL.get(linked_statuses[lid][0])
+        if lstatus is None or lstatus >= id2status[iid]:
+            return
+        # check to see if the linked item is something to ignore for that item
+        ignore = id2item[iid].get('to_ignore')
+        if ignore is not None and lid in ignore:
+            return
+        mismatches.setdefault(iid, []).append(lid)
+
+    def add_fetched(future):
+        for luuid, listatus, llabel in future.result():
+            linked_statuses[luuid] = [listatus, llabel]
+            for lfid in set(linked2get.pop(luuid, [])):
+                compare(lfid, luuid)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = []
+        for es_item in es_items:
+            if not checked_tags:
+                tagged2ignore = get_items_with_ignore_tags(connection.ff_keys)
+                checked_tags = True  # only do this once if at all
+            iid = es_item.get('uuid')
+            label = es_item.get('embedded').get('display_title')
+            desc = es_item.get('object').get('description')
+            lab = es_item.get('embedded').get('lab').get('display_title')
+            status = es_item.get('properties').get('status', 'in review by lab')
+            opfs = _get_all_other_processed_files(es_item)
+            id2status[iid] = STATUS_LEVEL.get(status)
+            id2item[iid] = {'label': label, 'status': status, 'lab': lab,
+                            'description': desc, 'to_ignore': list(set(opfs)) + tagged2ignore}
+            linked_statuses[iid] = [status, es_item.get('item_type')]
+            for lid in [li.get('uuid') for li in es_item.get('linked_uuids_embedded')]:
+                if lid in linked_statuses:
+                    compare(iid, lid)
+                else:  # add to list to get
+                    linked2get.setdefault(lid, []).append(iid)
+                    if lid not in requested:
+                        requested.add(lid)
+                        to_request.append(lid)
+            # only query es when we have more than a set number of ids, and keep going meanwhile
+            if len(to_request) > MIN_CHUNK_SIZE:
+                futures.append(executor.submit(fetch_linked, to_request))
+                to_request = []
+            for future in [f for f in futures if f.done()]:
+                futures.remove(future)
+                add_fetched(future)
+        if to_request:
+            futures.append(executor.submit(fetch_linked, to_request))
+        for future in futures:
+            add_fetched(future)
+    cache_utils.put_cache(connection, 'check_status_mismatch', 'status_table', status_table)
+
     if mismatches:
         brief_output = {}
         full_output = {}
@@ -713,8 +766,11 @@ def check_status_mismatch(connection, **kwargs):
                 eid, eset.get('label'), eset.get('status'), eset.get('description'))
             brief_output.setdefault(eset.get('lab'), {}).update({key: len(mids)})
             for mid in mids:
-                mitem = id2item.get(mid)
-                val = '{} | {} | {}'.format(mid, mitem.get('label'), mitem.get('status'))
+                if mid in id2item:
+                    mlabel, mstatus = id2item[mid]['label'], id2item[mid]['status']
+                else:
+                    mstatus, mlabel = linked_statuses[mid]
+                val = '{} | {} | {}'.format(mid, mlabel, mstatus)
                 full_output.setdefault(eset.get('lab'), {}).setdefault(key, []).append(val)
         check.status = 'WARN'
         check.summary = "MISMATCHED STATUSES FOUND"
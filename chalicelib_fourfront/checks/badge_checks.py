@@ -2,7 +2,9 @@ import re
 import requests
 import datetime
 import json
+from functools import partial
 from dcicutils import ff_utils
+from .helpers import patch_utils
 
 # Use confchecks to import decorators object and its methods for each check module
 # rather than importing check_function, action_function, CheckResult, ActionResult
@@ -50,24 +52,45 @@ def compare_badges(obj_ids, item_type, badge, ff_keys):
     return needs_badge, remove_badge, badge_ok
 
 
-def replace_messages_content(messages, ff_keys):
-    """ replace any occurrence of @id with its display_title """
+# an approximate way to check for @id: start and end with "/", and with one more "/" in between
+AT_ID_PATTERN = r"(/[^/]+/[^/]+/)"
 
-    # an approximate way to check for @id: start and end with "/", and with one more "/" in between
-    at_id_pattern = r"(/[^/]+/[^/]+/)"
 
-    def _get_db_item(matchobj):
-        at_id = matchobj.group(0)
-        if at_id is not None:
+def get_display_titles(at_ids, ff_keys, chunk_size=50):
+    """ return a dict with the display_title of each @id, searching for many @ids at once.
+    @ids not found by the search (e.g. not in canonical form) are fetched one by one """
+    at_ids = list(dict.fromkeys(at_ids))
+    titles = {}
+    for i in range(0, len(at_ids), chunk_size):
+        query = 'search/?type=Item&field=display_title' + ''.join('&@id=' + at_id for at_id in at_ids[i:i + chunk_size])
+        for item in ff_utils.search_metadata(query, key=ff_keys):
+            titles[item['@id']] = item.get('display_title', item['@id'])
+    for at_id in at_ids:
+        if at_id not in titles:
             item = ff_utils.get_metadata(at_id, key=ff_keys, add_on='frame=object')
-            return item.get('display_title', item['@id'])
-        else:
-            return matchobj
+            titles[at_id] = item.get('display_title', item['@id'])
+    return titles
+
+
+def find_message_at_ids(messages):
+    """ return the @ids found in the values of messages formatted as 'key: value' """
+    at_ids = []
+    for message in messages:
+        at_ids.extend(re.findall(AT_ID_PATTERN, message.split(": ", 1)[1]))
+    return at_ids
+
+
+def replace_messages_content(messages, ff_keys, titles=None):
+    """ replace any occurrence of @id with its display_title.
+    titles can be a dict of display_title by @id (see get_display_titles), otherwise
+    display titles are fetched for the @ids in messages """
+    if titles is None:
+        titles = get_display_titles(find_message_at_ids(messages), ff_keys)
 
     new_messages = []
     for message in messages:
         mes_key, mes_val = message.split(": ", 1)
-        mes_val_new = re.sub(at_id_pattern, _get_db_item, mes_val)
+        mes_val_new = re.sub(AT_ID_PATTERN, lambda matchobj: titles[matchobj.group(0)], mes_val)
         new_messages.append(mes_key + ": " + mes_val_new)
     return new_messages
 
@@ -83,6 +106,11 @@ def compare_badges_and_messages(obj_id_dict, item_type, badge, ff_keys,
     replace_messages replaces an @id with the item's display_title.
     """
     search_url = f'search/?type={item_type}&badges.badge.@id=/badges/{badge}/'
+    if replace_messages:
+        # fetch the display titles of all @ids in the messages at once, and replace each list once
+        titles = get_display_titles(
+            find_message_at_ids(m for messages in obj_id_dict.values() if messages for m in messages), ff_keys)
+        replaced = {key: replace_messages_content(val or [], ff_keys, titles) for key, val in obj_id_dict.items()}
     has_badge = ff_utils.search_metadata(search_url + '&frame=object', key=ff_keys)
     needs_badge = {}
     badge_edit = {}
@@ -102,14 +130,14 @@ def compare_badges_and_messages(obj_id_dict, item_type, badge, ff_keys,
                         badge_ok.append(item['@id'])
                     else:  # new message is different
                         if not ignore_details and replace_messages:  # try replacing @id in messages and check again
-                            messages_for_comparison = replace_messages_content(messages_for_comparison, ff_keys)
+                            messages_for_comparison = replaced[item['@id']]
                             if a_badge.get('messages') == messages_for_comparison:
                                 badge_ok.append(item['@id'])
                                 break
                         if a_badge.get('message'):
                             del a_badge['message']
                         a_badge['messages'] = obj_id_dict[item['@id']] if not replace_messages else\
-                            replace_messages_content(obj_id_dict[item['@id']], ff_keys)
+                            replaced[item['@id']]
                         badge_edit[item['@id']] = item['badges']
                     break
         else:
@@ -119,12 +147,12 @@ def compare_badges_and_messages(obj_id_dict, item_type, badge, ff_keys,
     for key, val in obj_id_dict.items():
         if not val:
             continue
-        if key not in badge_ok + list(badge_edit.keys()):
-            needs_badge[key] = val if not replace_messages else replace_messages_content(val, ff_keys)
+        if key not in badge_ok and key not in badge_edit:
+            needs_badge[key] = val if not replace_messages else replaced[key]
     return needs_badge, remove_badge, badge_edit, badge_ok
 
 
-def patch_badges(full_output, badge_name, ff_keys, single_message=''):
+def patch_badges(full_output, badge_name, ff_keys, time_limit, single_message=''):
     '''
     General function for patching badges.
     For badges with single message choice:
@@ -135,6 +163,8 @@ def patch_badges(full_output, badge_name, ff_keys, single_message=''):
     - single_message kwarg should not be used, but left as empty string.
     - full_output[output_keys[0]] should be a list of item @ids and message to patch into badge.
     - badges can also be edited to change the message.
+    Items are patched in parallel (see patch_utils.bulk_patch); no new patch is started
+    after time_limit seconds.
     '''
     patches = {'add_badge_success': [], 'add_badge_failure': [],
                'remove_badge_success': [], 'remove_badge_failure': []}
@@ -147,45 +177,34 @@ def patch_badges(full_output, badge_name, ff_keys, single_message=''):
         patches['edit_badge_failure'] = []
         output_keys.append('Keep badge and edit messages')
         add_list = full_output[output_keys[0]].keys()
-    for add_key in add_list:
+
+    def add_badge(add_key):
         add_result = ff_utils.get_metadata(add_key + '?frame=object&field=badges', key=ff_keys)
         badges = add_result['badges'] if add_result.get('badges') else []
         badges.append({'badge': badge_id, 'messages': [single_message] if single_message else full_output[output_keys[0]][add_key]})
         if [b['badge'] for b in badges].count(badge_id) > 1:
             # print an error message?
-            patches['add_badge_failure'].append('{} already has badge'.format(add_key))
-            continue
-        try:
-            response = ff_utils.patch_metadata({"badges": badges}, add_key[1:], key=ff_keys)
-            if response['status'] == 'success':
-                patches['add_badge_success'].append(add_key)
-            else:
-                patches['add_badge_failure'].append(add_key)
-        except Exception:
-            patches['add_badge_failure'].append(add_key)
-    for remove_key, remove_val in full_output[output_keys[1]].items():
+            return '{} already has badge'.format(add_key)
+        response = ff_utils.patch_metadata({"badges": badges}, add_key[1:], key=ff_keys)
+        if response['status'] != 'success':
+            return add_key
+
+    def patch_badge_list(item_key, badges):
         # delete field if no badges?
-        try:
-            if remove_val:
-                response = ff_utils.patch_metadata({"badges": remove_val}, remove_key, key=ff_keys)
-            else:
-                response = ff_utils.patch_metadata({}, remove_key + '?delete_fields=badges', key=ff_keys)
-            if response['status'] == 'success':
-                patches['remove_badge_success'].append(remove_key)
-            else:
-                patches['remove_badge_failure'].append(remove_key)
-        except Exception:
-            patches['remove_badge_failure'].append(remove_key)
+        if badges:
+            response = ff_utils.patch_metadata({"badges": badges}, item_key, key=ff_keys)
+        else:
+            response = ff_utils.patch_metadata({}, item_key + '?delete_fields=badges', key=ff_keys)
+        if response['status'] != 'success':
+            return item_key
+
+    tasks = [('add_badge', add_key, partial(add_badge, add_key)) for add_key in add_list]
+    tasks.extend(('remove_badge', remove_key, partial(patch_badge_list, remove_key, remove_val))
+                 for remove_key, remove_val in full_output[output_keys[1]].items())
     if len(output_keys) > 2:
-        for edit_key, edit_val in full_output[output_keys[2]].items():
-            try:
-                response = ff_utils.patch_metadata({"badges": edit_val}, edit_key, key=ff_keys)
-                if response['status'] == 'success':
-                    patches['edit_badge_success'].append(edit_key)
-                else:
-                    patches['edit_badge_failure'].append(edit_key)
-            except Exception:
-                patches['edit_badge_failure'].append(edit_key)
+        tasks.extend(('edit_badge', edit_key, partial(patch_badge_list, edit_key, edit_val))
+                     for edit_key, edit_val in full_output[output_keys[2]].items())
+    patch_utils.bulk_patch(tasks, patches, time_limit, error_format=lambda label, error: label)
     return patches
 
 
@@ -287,13 +306,13 @@ def yellow_flag_biosamples(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_biosample_warning_badges(connection, **kwargs):
     action = ActionResult(connection, 'patch_biosample_warning_badges')
     bs_check_result = action.get_associated_check_result(kwargs)
 
     action.output = patch_badges(
-        bs_check_result['full_output'], 'biosample-metadata-incomplete', connection.ff_keys
+        bs_check_result['full_output'], 'biosample-metadata-incomplete', connection.ff_keys, kwargs['time_limit']
     )
     if [action.output[key] for key in list(action.output.keys()) if 'failure' in key and action.output[key]]:
         action.status = 'FAIL'
@@ -344,13 +363,13 @@ def gold_biosamples(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_gold_biosample_badges(connection, **kwargs):
     action = ActionResult(connection, 'patch_gold_biosample_badges')
     gold_check_result = action.get_associated_check_result(kwargs)
 
     action.output = patch_badges(
-        gold_check_result['full_output'], 'gold-biosample', connection.ff_keys,
+        gold_check_result['full_output'], 'gold-biosample', connection.ff_keys, kwargs['time_limit'],
         single_message=('Biosample receives gold status for being a 4DN Tier 1 or Tier 2'
                         ' cell line that follows the approved SOP and contains all of the '
                         'pertinent metadata information as required by the 4DN Samples working group.')
@@ -442,12 +461,12 @@ def repsets_have_bio_reps(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_badges_for_replicate_numbers(connection, **kwargs):
     action = ActionResult(connection, 'patch_badges_for_replicate_numbers')
     rep_check_result = action.get_associated_check_result(kwargs)
 
-    action.output = patch_badges(rep_check_result['full_output'], 'replicate-numbers', connection.ff_keys)
+    action.output = patch_badges(rep_check_result['full_output'], 'replicate-numbers', connection.ff_keys, kwargs['time_limit'])
     if [action.output[key] for key in list(action.output.keys()) if 'failure' in key and action.output[key]]:
         action.status = 'FAIL'
         action.description = 'Some items failed to patch. See below for details.'
@@ -510,13 +529,14 @@ def exp_has_raw_files(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_badges_for_raw_files(connection, **kwargs):
     action = ActionResult(connection, 'patch_badges_for_raw_files')
     raw_check_result = action.get_associated_check_result(kwargs)
 
     action.output = patch_badges(
-        raw_check_result['full_output'], 'no-raw-files', connection.ff_keys, single_message='Raw files missing'
+        raw_check_result['full_output'], 'no-raw-files', connection.ff_keys, kwargs['time_limit'],
+        single_message='Raw files missing'
     )
     if [action.output[key] for key in list(action.output.keys()) if 'failure' in key and action.output[key]]:
         action.status = 'FAIL'
@@ -715,13 +735,13 @@ def consistent_replicate_info(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_badges_for_inconsistent_replicate_info(connection, **kwargs):
     action = ActionResult(connection, 'patch_badges_for_inconsistent_replicate_info')
     rep_info_check_result = action.get_associated_check_result(kwargs)
 
     action.output = patch_badges(
-        rep_info_check_result['full_output'], 'inconsistent-replicate-info', connection.ff_keys
+        rep_info_check_result['full_output'], 'inconsistent-replicate-info', connection.ff_keys, kwargs['time_limit']
     )
     if [action.output[key] for key in list(action.output.keys()) if 'failure' in key and action.output[key]]:
         action.status = 'FAIL'
@@ -1,11 +1,15 @@
 import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import helpers as es_helpers
 
 # Use confchecks to import decorators object and its methods for each check module
 # rather than importing check_function, action_function, CheckResult, ActionResult
 # individually - they're now part of class Decorators in foursight-core::decorators
 # that requires initialization with foursight prefix.
 from .helpers.confchecks import *
+from .helpers.cache_utils import is_cache_key
+from .helpers.checkpoint_utils import get_checkpoint, rotate_to_checkpoint, set_checkpoint
 
 
 @check_function(action="migrate_checks_to_es")
@@ -38,14 +42,58 @@ def elasticsearch_s3_count_diff(connection, **kwargs):
     return check
 
 
-@action_function(timeout=270)
+def iter_s3_keys(s3, prefix='', start_after=None):
+    """ Lazily lists the keys of the s3 connection bucket with given prefix, one
+        page (1000 keys) at a time, in lexicographical order starting after
+        the start_after key if given """
+    list_kwargs = {'Bucket': s3.bucket, 'Prefix': prefix}
+    if start_after:
+        list_kwargs['StartAfter'] = start_after
+    for page in s3.client.get_paginator('list_objects_v2').paginate(**list_kwargs):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
+def iter_batches(items, batch_size):
+    """ Groups an iterable into lists of at most batch_size items """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_put_objects(es, keys_and_objects):
+    """ Indexes (key, object) pairs into the es connection index with a single
+        bulk request. Returns the number of newly created documents """
+    if not es.index:
+        return 0
+    actions = [{'_index': es.index, '_id': key, '_source': obj}
+               for key, obj in keys_and_objects if isinstance(obj, dict)]
+    n_created = 0
+    for ok, info in es_helpers.streaming_bulk(es.es, actions, raise_on_error=False, raise_on_exception=False):
+        if ok and info.get('index', {}).get('result') == 'created':
+            n_created += 1
+        elif not ok:
+            print('Failed to add object with error: %s' % info)
+    return n_created
+
+
+@action_function(timeout=270, batch_size=500, workers=16)
 def migrate_checks_to_es(connection, **kwargs):
     """
     Migrates checks from s3 to es. If a check name is given only those
-    checks will be migrated
+    checks will be migrated. Keys are listed page by page, objects are read
+    from s3 with a pool of workers and written to es in bulk batches of
+    batch_size. If the previous run timed out, continue after the last key
+    it migrated
     """
     t0 = time.time()
     time_limit = 270 if kwargs.get('timeout') is None else kwargs.get('timeout')
+    batch_size = kwargs.get('batch_size') or 500
     action = ActionResult(connection, 'migrate_checks_to_es')
     action_logs = {'time out': False}
     s3 = connection.connections['s3']
@@ -53,34 +101,82 @@ def migrate_checks_to_es(connection, **kwargs):
     check = kwargs.get('check')
     if check is not None:
         action.description = 'Migrating check %s from s3 to ES' % check
-        s3_keys = s3.list_all_keys_w_prefix(check)
+        prefix = check if check.endswith('/') else check + '/'
     else:
         action.description = 'Migrating all checks from s3 to ES'
-        s3_keys = s3.list_all_keys()
+        prefix = ''
+    last_key = get_checkpoint(action, scope=check)
+    if last_key:
+        action_logs['resumed_after'] = last_key
     n_migrated = 0
-    for key in s3_keys:
-        if kwargs.get('timeout') and round(time.time() - t0, 2) > time_limit:
-            action_logs['time out'] = True
-            break
-        if 'action_records' in key: # ignore action_records for now
-            continue
-        if es.put_object(key, s3.get_object(key)): # put object by default
-            n_migrated += 1
+    n_keys = 0
+    with ThreadPoolExecutor(max_workers=kwargs.get('workers') or 16) as executor:
+        for batch in iter_batches(iter_s3_keys(s3, prefix, start_after=last_key), batch_size):
+            if kwargs.get('timeout') and round(time.time() - t0, 2) > time_limit:
+                action_logs['time out'] = True
+                break
+            # ignore action_records for now, and caches which are not check results
+            keys = [key for key in batch if 'action_records' not in key and not is_cache_key(key)]
+            n_migrated += bulk_put_objects(es, zip(keys, executor.map(s3.get_object, keys)))
+            n_keys += len(batch)
+            last_key = batch[-1]
     action.status = 'DONE'
     action_logs['n_migrated'] = n_migrated
+    action_logs['n_keys_read'] = n_keys
+    action_logs['seconds'] = round(time.time() - t0, 2)
+    action_logs['keys_per_second'] = round(n_keys / max(action_logs['seconds'], 0.01), 2)
     action.output = action_logs
+    if action_logs['time out']:
+        set_checkpoint(action, last_key, scope=check)
     return action
 
 
-@check_function(timeout=270, days=30, to_clean=None)
+def list_check_names(s3):
+    """ Lists the names of all checks and actions with results on the s3
+        connection bucket, i.e. the top level prefixes """
+    names = []
+    paginator = s3.client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3.bucket, Delimiter='/'):
+        names.extend(prefix['Prefix'].rstrip('/') for prefix in page.get('CommonPrefixes', []))
+    return names
+
+
+def list_old_result_keys(s3, check_name, prior_date):
+    """ Lists the timestamped result keys of a check that are older than prior_date.
+        Keys look like <check_name>/2018-10-15T19:08:32.734656.json so they are
+        listed in chronological order and listing stops at the first newer one """
+    old_keys = []
+    for key in iter_s3_keys(s3, check_name + '/2'):
+        try:
+            key_date = datetime.datetime.strptime(key[len(check_name) + 1:-5], '%Y-%m-%dT%H:%M:%S.%f')
+        except ValueError:
+            continue
+        if key_date > prior_date:
+            break
+        old_keys.append(key)
+    return old_keys
+
+
+def is_not_primary_result(result):
+    """ Primary results are kept, same as CheckResult.delete_results """
+    return isinstance(result, dict) and not result.get('kwargs', {}).get('primary')
+
+
+@check_function(timeout=270, days=30, to_clean=None, retention=None, workers=16)
 def clean_s3_es_checks(connection, **kwargs):
     """
-    Cleans old checks from both s3 and es older than one month. Must be called
-    from a specific check as it will take too long otherwise.
+    Cleans old non-primary check results from both s3 and es older than
+    one month (days). to_clean can be a single check name, a list of check names
+    or 'all' for every check with results on s3. retention can map check names
+    to the number of days to keep for that check. Old keys are deleted with
+    batches of 1000 keys per request. If the time limit is reached, the next
+    run of 'all' starts from the check where this one stopped.
     """
+    t0 = time.time()
     check_to_clean = kwargs.get('to_clean')
     time_limit = kwargs.get('timeout')
     days_back = kwargs.get('days')
+    retention = kwargs.get('retention') or {}
     check = CheckResult(connection, 'clean_s3_es_checks')
     full_output = {}
     if check_to_clean is None:
@@ -88,12 +184,56 @@ def clean_s3_es_checks(connection, **kwargs):
         check.summary = check.description = 'A check must be given to be cleaned'
         check.full_output = full_output
         return check
-    clean_check = CheckResult(connection, check_to_clean)
-    past_date = datetime.datetime.utcnow() - datetime.timedelta(days=days_back)
-    n_deleted_s3, n_deleted_es = clean_check.delete_results(prior_date=past_date, timeout=time_limit)
-    full_output['check_cleared'] = check_to_clean
+    s3 = connection.connections['s3']
+    es = connection.connections.get('es')
+    last_cleaned = None
+    if check_to_clean == 'all':
+        last_cleaned = get_checkpoint(check, scope='all')
+        to_clean = [name for name in list_check_names(s3) if name != 'action_records']
+        to_clean = rotate_to_checkpoint(to_clean, last_cleaned)
+    elif isinstance(check_to_clean, list):
+        to_clean = check_to_clean
+    else:
+        to_clean = [check_to_clean]
+    full_output['checks'] = {}
+    n_deleted_s3, n_deleted_es = 0, 0
+    timed_out = False
+    with ThreadPoolExecutor(max_workers=kwargs.get('workers') or 16) as executor:
+        for check_name in to_clean:
+            if time_limit and round(time.time() - t0, 2) > time_limit:
+                timed_out = True
+                break
+            days = retention.get(check_name, days_back)
+            past_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+            old_keys = list_old_result_keys(s3, check_name, past_date)
+            keys_to_delete = [key for key, result in zip(old_keys, executor.map(s3.get_object, old_keys))
+                              if is_not_primary_result(result)]
+            progress = {'days': days, 'n_old_results': len(old_keys), 'n_to_delete': len(keys_to_delete),
+                        'n_deleted_s3': 0, 'n_deleted_es': 0, 'completed': False}
+            full_output['checks'][check_name] = progress
+            for batch in iter_batches(keys_to_delete, 1000):
+                if time_limit and round(time.time() - t0, 2) > time_limit:
+                    timed_out = True
+                    break
+                if es:
+                    progress['n_deleted_es'] += es.delete_keys(batch)
+                progress['n_deleted_s3'] += len(s3.delete_keys(batch).get('Deleted', []))
+            else:
+                progress['completed'] = True
+                last_cleaned = check_name
+            n_deleted_s3 += progress['n_deleted_s3']
+            n_deleted_es += progress['n_deleted_es']
+            if timed_out:
+                break
+    if len(to_clean) == 1:
+        full_output['check_cleared'] = to_clean[0]
     full_output['n_deleted_s3'] = n_deleted_s3
     full_output['n_deleted_es'] = n_deleted_es
+    full_output['time out'] = timed_out
+    check.summary = 'Deleted %s results from s3 and %s from es for %s checks' % (
+        n_deleted_s3, n_deleted_es, len(full_output['checks']))
     check.status = 'DONE'
     check.full_output = full_output
+    if check_to_clean == 'all' and timed_out and last_cleaned:
+        set_checkpoint(check, last_cleaned, scope='all')
     return check
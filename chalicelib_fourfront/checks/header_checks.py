@@ -1,4 +1,6 @@
+from functools import partial
 from dcicutils import ff_utils
+from .helpers import patch_utils
 
 # Use confchecks to import decorators object and its methods for each check module
 # rather than importing check_function, action_function, CheckResult, ActionResult
@@ -68,7 +70,7 @@ def patch_items_with_headers(connection, action, kwargs):
     - the action (from ActionResult)
     - kwargs (from the action function)
     Takes care of patching info on Fourfront and also populating fields on the
-    action
+    action. No new patch is started after kwargs['time_limit'] seconds
     """
     action_logs = {'patch_failure': [], 'patch_success': []}
     # get latest results from prepare_static_headers
@@ -76,25 +78,17 @@ def patch_items_with_headers(connection, action, kwargs):
     # the dictionaries can be combined
     total_patches = headers_check_result['full_output']['to_add']
     total_patches.update(headers_check_result['full_output']['to_remove'])
-    for item, headers in total_patches.items():
+
+    def patch_headers(item, headers):
         # if all headers are deleted, use ff_utils.delete_field
         if headers == []:
-            try:
-                ff_utils.delete_field(item, 'static_headers', key=connection.ff_keys)
-            except Exception as e:
-                patch_error = '\n'.join([item, str(e)])
-                action_logs['patch_failure'].append(patch_error)
-            else:
-                action_logs['patch_success'].append(item)
+            ff_utils.delete_field(item, 'static_headers', key=connection.ff_keys)
         else:
             patch_data = {'static_headers': headers}
-            try:
-                ff_utils.patch_metadata(patch_data, obj_id=item, key=connection.ff_keys)
-            except Exception as e:
-                patch_error = '\n'.join([item, str(e)])
-                action_logs['patch_failure'].append(patch_error)
-            else:
-                action_logs['patch_success'].append(item)
+            ff_utils.patch_metadata(patch_data, obj_id=item, key=connection.ff_keys)
+
+    tasks = [('patch', item, partial(patch_headers, item, headers)) for item, headers in total_patches.items()]
+    patch_utils.bulk_patch(tasks, action_logs, kwargs['time_limit'])
     action.status = 'DONE'
     action.output = action_logs
 
@@ -114,7 +108,7 @@ def prepare_static_headers(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers')
     # get latest results from prepare_static_headers
@@ -138,7 +132,7 @@ def prepare_static_headers_data_use_guidelines(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_data_use_guidelines(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_data_use_guidelines')
     # get latest results from prepare_static_headers
@@ -159,7 +153,7 @@ def prepare_static_headers_inSitu_HiC(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_inSitu_HiC(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_inSitu_HiC')
     # get latest results from prepare_static_headers
@@ -180,7 +174,7 @@ def prepare_static_headers_dilution_HiC(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_dilution_HiC(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_dilution_HiC')
     # get latest results from prepare_static_headers
@@ -201,7 +195,7 @@ def prepare_static_headers_FISH(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_FISH(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_FISH')
     # get latest results from prepare_static_headers
@@ -222,7 +216,7 @@ def prepare_static_headers_SPT(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_SPT(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_SPT')
     # get latest results from prepare_static_headers
@@ -243,7 +237,7 @@ def prepare_static_headers_SPRITE(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_SPRITE(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_SPRITE')
     # get latest results from prepare_static_headers
@@ -264,7 +258,7 @@ def prepare_static_headers_MARGI(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_MARGI(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_MARGI')
     # get latest results from prepare_static_headers
@@ -285,7 +279,7 @@ def prepare_static_headers_sciHiC(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_sciHiC(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_sciHiC')
     # get latest results from prepare_static_headers
@@ -306,7 +300,7 @@ def prepare_static_headers_DNase_HiC(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_DNase_HiC(connection, **kwargs):
     action = ActionResult(connection, 'patch_static_headers_DNase_HiC')
     # get latest results from prepare_static_headers
@@ -326,7 +320,7 @@ def prepare_static_headers_Chromatin_Tracing(connection, **kwargs):
      return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_static_headers_Chromatin_Tracing(connection, **kwargs):
      action = ActionResult(connection, 'patch_static_headers_Chromatin_Tracing')
      # get latest results from prepare_static_headers
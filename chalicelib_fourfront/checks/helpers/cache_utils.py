@@ -0,0 +1,25 @@
+import json
+
+# Caches are json objects that checks keep between runs, stored on s3 next to the
+# check results as <check name>/cache/<cache name>.json. They are not check results,
+# so they are not listed with the timestamped results and not migrated to es.
+CACHE_DIR = 'cache'
+
+
+def cache_key(check_name, cache_name):
+    return '/'.join([check_name, CACHE_DIR, cache_name + '.json'])
+
+
+def is_cache_key(key):
+    return key.split('/')[1:2] == [CACHE_DIR]
+
+
+def get_cache(connection, check_name, cache_name):
+    """Return the cache stored by a check, or an empty dict if there is none"""
+    cached = connection.connections['s3'].get_object(cache_key(check_name, cache_name))
+    return cached if isinstance(cached, dict) else {}
+
+
+def put_cache(connection, check_name, cache_name, value):
+    """Store a json serializable dict as cache of a check"""
+    connection.connections['s3'].put_object(cache_key(check_name, cache_name), json.dumps(value))
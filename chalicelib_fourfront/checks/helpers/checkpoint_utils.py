@@ -0,0 +1,71 @@
+import hashlib
+import json
+
+# Checkpoints let checks and actions that stop at a time limit (i.e. lambda_limit)
+# continue from where the previous run stopped, instead of starting over every time.
+# The cursor (i.e. the accession of the last processed item) is stored with the result,
+# in full_output for checks and in output for actions.
+CHECKPOINT_KEY = 'checkpoint'
+
+
+def _output_field(run_result):
+    """CheckResults keep their output in full_output, ActionResults in output"""
+    return 'full_output' if hasattr(run_result, 'full_output') else 'output'
+
+
+def checkpoint_scope(*values):
+    """Return a short fingerprint of the given json serializable values, to be used as
+    scope of a checkpoint that is only valid for the same inputs (i.e. the same check result)"""
+    return hashlib.md5(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_checkpoint(run_result, scope=None):
+    """Return the cursor stored with the latest result of this check or action, or None.
+    If a scope is given, only return a cursor that was stored with the same scope"""
+    latest = run_result.get_latest_result()
+    if not latest:
+        return None
+    output = latest.get(_output_field(run_result))
+    if not isinstance(output, dict):
+        return None
+    checkpoint = output.get(CHECKPOINT_KEY)
+    if not checkpoint or checkpoint.get('scope') != scope:
+        return None
+    return checkpoint.get('cursor')
+
+
+def set_checkpoint(run_result, cursor, scope=None):
+    """Store the cursor with the result that is being built, the next run will continue after it.
+    Output must be a dict (or None). A cursor of None removes the checkpoint"""
+    field = _output_field(run_result)
+    output = getattr(run_result, field)
+    if output is None:
+        output = {}
+        setattr(run_result, field, output)
+    if cursor is None:
+        output.pop(CHECKPOINT_KEY, None)
+    else:
+        output[CHECKPOINT_KEY] = {'cursor': cursor, 'scope': scope}
+
+
+def rotate_to_checkpoint(items, cursor, key=lambda x: x):
+    """For checks that report on all items: return the items starting right after the one
+    matching the cursor and wrapping around to the ones before it, so that consecutive time
+    limited runs cover all items. Items are returned unchanged if the cursor is not found"""
+    if cursor is None:
+        return items
+    for n, item in enumerate(items):
+        if key(item) == cursor:
+            return items[n + 1:] + items[:n + 1]
+    return items
+
+
+def resume_after_checkpoint(items, cursor, key=lambda x: x):
+    """For actions that should handle each item once: return the items after the one
+    matching the cursor. Items are returned unchanged if the cursor is not found"""
+    if cursor is None:
+        return items
+    for n, item in enumerate(items):
+        if key(item) == cursor:
+            return items[n + 1:]
+    return items
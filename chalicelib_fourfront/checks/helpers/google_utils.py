@@ -3,6 +3,9 @@ NOTICE: THIS FILE (and google client library dependency) IS TEMPORARY AND WILL B
 """
 
 import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import (
     date,
     datetime,
@@ -12,6 +15,7 @@ import pytz
 from types import FunctionType
 from calendar import monthrange
 from collections import OrderedDict
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
 from google.oauth2.service_account import Credentials
 from dcicutils import ff_utils, s3_utils
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
@@ -183,6 +187,13 @@ class GoogleAPISyncer:
         https://developers.google.com/analytics/devguides/reporting/core/v4/rest/v4/reports/batchGet
         """
 
+        # Backfill settings - GA4 allows 10 concurrent requests per property
+        max_concurrent_requests = 4
+        backfill_workers        = 4
+        backfill_days_per_request = 31
+        quota_retries           = 5
+        quota_wait              = 2     # seconds, doubled after each retry
+
         def transform_report_result(self, raw_result, save_raw_values=False, date_increment="daily"):
             """
             Transform raw responses (multi-dimensional array) from Google Analytics to a more usable
@@ -323,6 +334,7 @@ class GoogleAPISyncer:
             _NestedGoogleServiceAPI.__init__(self, syncer_instance)
             self.property_id = self.owner.extra_config.get('analytics_property_id', DEFAULT_GOOGLE_API_CONFIG['analytics_property_id'])
             self._api =  BetaAnalyticsDataClient(credentials=self.owner.credentials) #build('analyticsreporting', 'v4', credentials=self.owner.credentials, cache_discovery=False)
+            self._request_slots = threading.BoundedSemaphore(self.max_concurrent_requests)
 
 
 
@@ -383,30 +395,10 @@ class GoogleAPISyncer:
             if report_key_names is None:
                 raise Exception("Cant determine report key names.")
 
-            def process_report_request_type(report_request, **kwargs):
-                if isinstance(report_request, str): # Convert string to dict by executing AnalyticsAPI[report_request](**kwargs)
-                    report_request = getattr(self, report_request)(execute=False, **{ k:v for k,v in kwargs.items() if k in ('start_date', 'end_date') })
-
-                return RunReportRequest(dict(report_request, # Add required common key/vals, see https://developers.google.com/analytics/devguides/reporting/core/v4/basics.
-                    property='properties/' + self.property_id,
-                    limit=report_request.get('limit', self.owner.extra_config.get('analytics_page_size', DEFAULT_GOOGLE_API_CONFIG['analytics_page_size']))
-                ))
-
-            formatted_report_requests = [ process_report_request_type(r, **kwargs) for r in report_requests ]
-
-            # Google only permits 5 requests max within a batchRequest, so we need to chunk it up if over this -
-            report_request_count = len(formatted_report_requests)
-            if report_request_count > 5:
-                raw_result = { "reports" : [] }
-                for chunk_num in range(report_request_count // 5 + 1):
-                    chunk_num_start = chunk_num * 5
-                    chunk_num_end = min([chunk_num_start + 5, report_request_count])
-                    if chunk_num_start < chunk_num_end:
-                        for chunk_raw_res in self._api.batch_run_reports(BatchRunReportsRequest(requests=formatted_report_requests[chunk_num_start:chunk_num_end], property='properties/' + self.property_id)).reports:
-                            raw_result['reports'].append(chunk_raw_res)
-            else:
-                raw_result = {}
-                raw_result['reports'] = self._api.batch_run_reports(BatchRunReportsRequest(requests=formatted_report_requests, property='properties/' + self.property_id)).reports
+            formatted_report_requests = [ self.format_report_request(r, **kwargs) for r in report_requests ]
+
+            raw_result = {}
+            raw_result['reports'] = self.batch_run_reports(formatted_report_requests)
 
             # We get back as raw_result:
             #   { "reports" : [{ "columnHeader" : { "dimensions" : [Xh, Yh, Zh], "metricHeaderEntries" : [{ "name" : 1h, "type" : "INTEGER" }, ...] }, "data" : { "rows": [{ "dimensions" : [X,Y,Z], "metrics" : [1,2,3,4] }] }  }, { .. }, ....] }
@@ -421,6 +413,159 @@ class GoogleAPISyncer:
 
 
 
+        def format_report_request(self, report_request, **kwargs):
+            """
+            Returns a RunReportRequest for a report request dict, or for the name of a report provider method
+            (executed with `start_date` and `end_date` from kwargs).
+            """
+            if isinstance(report_request, str): # Convert string to dict by executing AnalyticsAPI[report_request](**kwargs)
+                report_request = getattr(self, report_request)(execute=False, **{ k:v for k,v in kwargs.items() if k in ('start_date', 'end_date') })
+
+            return RunReportRequest(dict(report_request, # Add required common key/vals, see https://developers.google.com/analytics/devguides/reporting/core/v4/basics.
+                property='properties/' + self.property_id,
+                limit=report_request.get('limit', self.owner.extra_config.get('analytics_page_size', DEFAULT_GOOGLE_API_CONFIG['analytics_page_size']))
+            ))
+
+
+
+        def batch_run_reports(self, formatted_report_requests):
+            """
+            Runs RunReportRequests and returns their reports, in the same order.
+            Google only permits 5 requests max within a batchRequest, so they are sent in chunks of 5.
+            At most `max_concurrent_requests` batches run at the same time (from all threads), and batches
+            that fail because of quota limits are retried with exponential backoff.
+            """
+            reports = []
+            for chunk_start in range(0, len(formatted_report_requests), 5):
+                batch_request = BatchRunReportsRequest(
+                    requests=formatted_report_requests[chunk_start:chunk_start + 5],
+                    property='properties/' + self.property_id
+                )
+                for attempt in range(self.quota_retries + 1):
+                    try:
+                        with self._request_slots:
+                            reports.extend(self._api.batch_run_reports(batch_request).reports)
+                        break
+                    except (ResourceExhausted, ServiceUnavailable):
+                        if attempt == self.quota_retries:
+                            raise
+                        time.sleep(self.quota_wait * 2 ** attempt)
+            return reports
+
+
+
+        def query_reports_by_date(self, report_names, start_date, end_date):
+            """
+            Runs the reports of `report_names` for a range of days at once, with an added `date` dimension,
+            and splits their rows into per-day reports.
+
+            Returns:
+                A tuple of a dictionary of parsed reports by ISO date (see query_reports), and the list of reports
+                that had more rows than returned (these should be queried one day at a time).
+            """
+            formatted_report_requests = []
+            for report_name in report_names:
+                report_request = getattr(self, report_name)(start_date=start_date, end_date=end_date, execute=False)
+                report_request = dict(report_request, dimensions=list(report_request.get('dimensions', [])) + [{ 'name': 'date' }])
+                formatted_report_requests.append(self.format_report_request(report_request))
+            reports = self.batch_run_reports(formatted_report_requests)
+
+            days = []
+            day = date.fromisoformat(start_date)
+            while day <= date.fromisoformat(end_date):
+                days.append(day.isoformat())
+                day += timedelta(days=1)
+            reports_by_date = { day : OrderedDict() for day in days }
+            truncated = []
+            for report_name, report in zip(report_names, reports):
+                if report.row_count > len(report.rows):
+                    truncated.append(report_name)
+                    continue
+                for day in days:
+                    reports_by_date[day][report_name] = []
+                # requests are only used to find the date range, which is not a single day here
+                parsed = self.transform_report_result({ 'reports': [report], 'requests': [], 'report_key_names': [report_name] })
+                for item in parsed['reports'][report_name]:
+                    for_date = item.pop('date') # YYYYMMDD
+                    reports_by_date[for_date[0:4] + '-' + for_date[4:6] + '-' + for_date[6:8]][report_name].append(item)
+            return reports_by_date, truncated
+
+
+
+        def backfill_reports(self, increment, date_ranges):
+            """
+            Returns the report data (see query_reports) of many days or months, in the order of `date_ranges`,
+            a list of (start_date, end_date) ISO date tuples.
+
+            For days, reports without a row `limit` (top N) are requested for up to `backfill_days_per_request`
+            days at once with a date dimension. Other reports, and days or months that need separate requests,
+            are queried concurrently by `backfill_workers` threads.
+            """
+            report_names = self.get_report_provider_method_names()
+            reports_by_date = { start : OrderedDict() for start, _ in date_ranges }
+            if increment == 'daily':
+                ranged_names = [ name for name in report_names if 'limit' not in getattr(self, name)(execute=False) ]
+                days = [ start for start, _ in date_ranges ]
+                for chunk_start in range(0, len(days), self.backfill_days_per_request):
+                    chunk = days[chunk_start:chunk_start + self.backfill_days_per_request]
+                    chunk_reports, _ = self.query_reports_by_date(ranged_names, chunk[0], chunk[-1])
+                    for day in chunk:
+                        reports_by_date[day].update(chunk_reports[day])
+
+            def query_period(date_range):
+                start, end = date_range
+                reports = reports_by_date[start]
+                missing_names = [ name for name in report_names if name not in reports ]
+                if missing_names:
+                    reports.update(self.query_reports(missing_names, start_date=start, end_date=end, increment=increment)['reports'])
+                return {
+                    "reports"        : OrderedDict((name, reports[name]) for name in report_names),
+                    "for_date"       : start,
+                    "date_increment" : increment
+                }
+
+            with ThreadPoolExecutor(max_workers=self.backfill_workers) as executor:
+                return list(executor.map(query_period, date_ranges))
+
+
+
+        def post_tracking_items(self, report_data_list):
+            """
+            Creates TrackingItems for a list of report data (in date order) and POSTs them concurrently.
+            Each item is POSTed once: ff_utils already retries failed requests, and POSTing again after an error
+            could create a second TrackingItem for the same date.
+            If a POST fails, the items of later dates that were posted are deleted again, so that the next
+            run continues from the failed date without leaving a gap, and the error is raised.
+
+            Returns:
+                The list of posted TrackingItems.
+            """
+            key = dict(self.owner.access_key, server=self.owner.server)
+            tracking_items = [ self.create_tracking_item(report_data=report_data) for report_data in report_data_list ]
+
+            def post_item(tracking_item):
+                try:
+                    response = ff_utils.post_metadata(tracking_item, 'tracking-items', key=key)
+                    return response['@graph'][0]
+                except Exception as e:
+                    return e
+
+            with ThreadPoolExecutor(max_workers=self.backfill_workers) as executor:
+                results = list(executor.map(post_item, tracking_items))
+            failed = [ idx for idx, result in enumerate(results) if isinstance(result, Exception) ]
+            if failed:
+                for result in results[failed[0] + 1:]:
+                    if isinstance(result, Exception):
+                        continue
+                    try:
+                        ff_utils.patch_metadata({ 'status' : 'deleted' }, result['uuid'], key=key)
+                    except Exception as e:
+                        print('Could not delete TrackingItem', result['uuid'], 'for', result['google_analytics']['for_date'], '-', e)
+                raise results[failed[0]]
+            return results
+
+
+
         def get_latest_tracking_item_date(self, increment="daily"):
             """
             Queries '/search/?type=TrackingItem&sort=-google_analytics.for_date&&google_analytics.date_increment=...'
@@ -453,6 +598,8 @@ class GoogleAPISyncer:
 
             Adds 1 TrackingItem for each day to represent analytics data for said day.
             Fill up from latest already-existing TrackingItem until day before current day (to get full day of data).
+            Reports of all missing days (or months) are queried together and the TrackingItems POSTed concurrently,
+            see `backfill_reports` and `post_tracking_items`.
 
             TODO:
             `date.fromisoformat(...)`  is not supported until Python 3.7 though (without extra libraries).
@@ -504,17 +651,10 @@ class GoogleAPISyncer:
                 if date_to_fill_from > end_date:
                     return { 'created' : created_list, 'count' : counter }
 
+                date_ranges = []
                 while date_to_fill_from <= end_date:
                     for_date_str = date_to_fill_from.isoformat()
-                    response = self.create_tracking_item(
-                        do_post_request = True,
-                        start_date      = for_date_str,
-                        end_date        = for_date_str,
-                        increment       = increment
-                    )
-                    counter += 1
-                    created_list.append(response['uuid'])
-                    print('Created ' + str(counter) + ' TrackingItems so far.', date_to_fill_from)
+                    date_ranges.append((for_date_str, for_date_str))
                     date_to_fill_from += timedelta(days=1)
 
 
@@ -532,23 +672,22 @@ class GoogleAPISyncer:
                 if fill_year > end_year and fill_month > end_month:
                     return { 'created' : created_list, 'count' : counter }
 
+                date_ranges = []
                 while fill_year < end_year or (fill_year == end_year and fill_month <= end_month):
                     for_date_start_str = date(fill_year, fill_month, 1).isoformat()
                     for_date_end_str = date(fill_year, fill_month, monthrange(fill_year, fill_month)[1]).isoformat() # Last day of fill month
-                    response = self.create_tracking_item(
-                        do_post_request = True,
-                        start_date      = for_date_start_str,
-                        end_date        = for_date_end_str,
-                        increment       = increment
-                    )
-                    counter += 1
-                    created_list.append(response['uuid'])
-                    print('Created ' + str(counter) + ' TrackingItems so far.', str(fill_year) + "-" + str(fill_month))
+                    date_ranges.append((for_date_start_str, for_date_end_str))
                     fill_month += 1
                     if fill_month > 12:
                         fill_month -= 12
                         fill_year += 1
 
+            report_data_list = self.backfill_reports(increment, date_ranges)
+            for response in self.post_tracking_items(report_data_list):
+                counter += 1
+                created_list.append(response['uuid'])
+            print('Created ' + str(counter) + ' TrackingItems.')
+
             return { 'created' : created_list, 'count' : counter }
 
 
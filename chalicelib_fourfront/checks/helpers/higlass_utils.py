@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# number of concurrent requests made to s3 and the higlass server
+probe_workers = 16
+# number of uids asked for in one tileset_info request (tileset_info/?d=a&d=b...)
+tileset_info_batch_size = 50
+# retries and initial wait (seconds, doubled after each retry) for requests the higlass server did not process
+max_retries = 4
+retry_wait = 1
+
+
+def pooled_session(pool_size=probe_workers):
+    """Return a requests Session that keeps up to pool_size connections open per host,
+    so it can be shared by pool_size threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def does_url_exist(session, url):
+    """Check that a url is valid with a HEAD request"""
+    try:
+        r = session.head(url)
+        return r.status_code == requests.codes.ok
+    except Exception:
+        return False
+
+
+def is_chromsizes_registered(session, higlass_server, higlass_uid):
+    """Check that a chromsizes file is registered on the higlass server"""
+    try:
+        res = session.get(higlass_server + '/api/v1/chrom-sizes/?id=%s' % higlass_uid)
+    except Exception:
+        return False
+    return res.status_code < 400
+
+
+def get_tileset_info(session, higlass_server, higlass_uids):
+    """Get the tileset info of many tilesets with one request (tileset_info/?d=a&d=b...).
+    Return a dict with the info by uid, with an 'error' for all uids if the request failed"""
+    try:
+        res = session.get(higlass_server + '/api/v1/tileset_info/', params={'d': higlass_uids})
+        if res.status_code >= 400:
+            raise Exception('tileset_info returned status %s' % res.status_code)
+        info = res.json()
+    except Exception as e:
+        return {uid: {'error': str(e)} for uid in higlass_uids}
+    return {uid: info.get(uid, {}) for uid in higlass_uids}
+
+
+def find_unregistered_tilesets(session, higlass_server, higlass_uids, workers=probe_workers,
+                               batch_size=tileset_info_batch_size):
+    """Return the set of uids that are not registered on the higlass server.
+    tileset_info is requested for batches of uids, a few batches at a time"""
+    higlass_uids = list(dict.fromkeys(higlass_uids))
+    batches = [higlass_uids[i:i + batch_size] for i in range(0, len(higlass_uids), batch_size)]
+    unregistered = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_info in executor.map(lambda batch: get_tileset_info(session, higlass_server, batch), batches):
+            unregistered.update(uid for uid, info in batch_info.items() if 'error' in info)
+    return unregistered
+
+
+def is_connect_error(error):
+    """True if the error happened while connecting to the server, so the request was not sent"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def post_with_backoff(session, url, retries=max_retries, wait=retry_wait, **kwargs):
+    """POST to the higlass server, retrying with exponential backoff only when the request was
+    not processed: connection errors before the request was sent, 429 (too many requests) and
+    503 (unavailable). Registrations and copies are not idempotent, so other errors are not
+    retried. Returns the last response, or raises the last error"""
+    for attempt in range(retries + 1):
+        try:
+            res = session.post(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            if attempt == retries or not is_connect_error(e):
+                raise
+        else:
+            if res.status_code not in (429, 503) or attempt == retries:
+                return res
+        time.sleep(wait * 2 ** attempt)
@@ -0,0 +1,77 @@
+import datetime
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+HEADERS = {
+    'User-Agent': (
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 13_3_1) '
+        'AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/124.0.0.0 Safari/537.36'
+    )
+}
+# status codes of a working link
+OK_STATUS = [200, 412]
+
+
+def request_url(session, url, timeout=2):
+    """Request a url with HEAD, falling back to GET if HEAD does not return an ok status
+    (some servers do not support HEAD). Returns the result as a dict with one of
+    'status' (status code), 'timeout', 'ssl_error' or 'error' (exception message)"""
+    try:
+        res = session.head(url, timeout=timeout, headers=HEADERS, allow_redirects=True)
+        if res.status_code not in OK_STATUS:
+            res = session.get(url, timeout=timeout, headers=HEADERS)
+    except requests.exceptions.Timeout:
+        return {'timeout': True}
+    except requests.exceptions.SSLError:
+        return {'ssl_error': True}
+    except Exception as e:
+        return {'error': str(e)}
+    return {'status': res.status_code}
+
+
+def check_urls(urls, workers=16, per_host=2, timeout=2):
+    """Request each distinct url once, concurrently, with at most per_host requests
+    at a time to the same host. Returns a dict with the request_url result by url"""
+    urls = list(dict.fromkeys(urls))
+    host_limits = defaultdict(lambda: threading.Semaphore(per_host))
+    for url in urls:  # create the semaphores before starting threads
+        host_limits[urlparse(url).netloc]
+
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        def polite_request(url):
+            with host_limits[urlparse(url).netloc]:
+                return request_url(session, url, timeout=timeout)
+
+        return dict(zip(urls, executor.map(polite_request, urls)))
+
+
+class LinkCache(object):
+    """Results of working links from previous runs, as {url: [result, date checked]},
+    so that they are only requested again once they are older than ttl_days.
+    Broken links are not cached and are requested on every run"""
+
+    def __init__(self, cached=None, ttl_days=7):
+        self.now = datetime.datetime.utcnow()
+        expiry = (self.now - datetime.timedelta(days=ttl_days)).isoformat()
+        self.results = {url: value for url, value in (cached or {}).items() if value[1] > expiry}
+
+    def get(self, url):
+        value = self.results.get(url)
+        return value[0] if value else None
+
+    def update(self, results):
+        for url, result in results.items():
+            if result.get('status') in OK_STATUS:
+                self.results[url] = [result, self.now.isoformat()]
+
+    def to_dict(self):
+        return self.results
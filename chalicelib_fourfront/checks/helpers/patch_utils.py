@@ -0,0 +1,48 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# number of items patched at the same time
+patch_workers = 8
+
+
+def format_error(label, error):
+    return '\n'.join([label, str(error)])
+
+
+def bulk_patch(tasks, logs, time_limit, start=None, workers=patch_workers, error_format=format_error):
+    """
+    Run patch tasks in parallel and log each outcome in logs.
+    Each task is a (log_name, label, fxn) tuple. fxn does the requests for one item
+    and is called once (ff_utils already retries failed requests); it returns None if
+    successful, or a message to log as failure. The label is logged in
+    logs[log_name + '_success'] on success, the message (or the error formatted with
+    error_format if fxn raised) in logs[log_name + '_failure'].
+    Tasks not started within time_limit seconds of start (default: now) are logged in
+    logs['not_attempted']. Set time_limit to 0 or None to disable the time limit.
+    Returns False if some tasks were not attempted, True otherwise.
+    """
+    start = start or time.time()
+
+    def run(task):
+        log_name, label, fxn = task
+        if time_limit and time.time() - start > time_limit:
+            return None
+        try:
+            failure = fxn()
+        except Exception as e:
+            return False, error_format(label, e)
+        if failure:
+            return False, failure
+        return True, label
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = list(executor.map(run, tasks))
+    completed = True
+    for (log_name, label, fxn), outcome in zip(tasks, outcomes):
+        if outcome is None:
+            logs.setdefault('not_attempted', []).append(label)
+            completed = False
+            continue
+        success, entry = outcome
+        logs.setdefault(log_name + ('_success' if success else '_failure'), []).append(entry)
+    return completed
@@ -0,0 +1,134 @@
+import hashlib
+import re
+import threading
+import time
+import requests
+
+EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+# NCBI allows 3 requests per second without an api key
+requests_per_second = 3
+# number of titles searched with one esearch request
+title_batch_size = 20
+# batched title searches with more hits than this are done one title at a time instead
+max_summaries = 500
+
+
+class TokenBucket(object):
+    """Rate limiter shared by threads: acquire() blocks until a token is available.
+    Tokens are added at rate per second, up to capacity (the allowed burst)"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+def title_words(title):
+    return re.findall(r'\w+', title.lower())
+
+
+def title_hash(title):
+    return hashlib.md5(' '.join(title_words(title)).encode('utf-8')).hexdigest()
+
+
+class PubMedClient(object):
+    """Searches PubMed with the E-utilities, at most requests_per_second requests per second.
+    Search methods return None if a request failed, so failures can be told from no results"""
+
+    def __init__(self, limiter=None, session=None):
+        self.limiter = limiter or TokenBucket(requests_per_second)
+        self.session = session or requests.Session()
+
+    def request(self, utility, params):
+        """POST to an E-utility (i.e. 'esearch.fcgi'), return the json response or None"""
+        self.limiter.acquire()
+        try:
+            res = self.session.post(EUTILS_URL + utility, data=params)
+            if res.status_code != 200:
+                return None
+            return res.json()
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def esearch(self, term, **params):
+        res = self.request('esearch.fcgi', dict(params, db='pubmed', retmode='json', term=term))
+        return res.get('esearchresult') if res else None
+
+    def search_title(self, title):
+        """Return the PMIDs of articles with all words of title in their title"""
+        result = self.esearch(title, field='title')
+        return result.get('idlist', []) if result else None
+
+    def search_authors(self, authors):
+        """Return the PMIDs of articles by all authors (searched by the first word of their names)"""
+        result = self.esearch(' '.join('{}[Author]'.format(a.split(' ')[0]) for a in authors))
+        return result.get('idlist', []) if result else None
+
+    def search_titles(self, titles):
+        """Search many titles with one esearch request per title_batch_size titles. The hits
+        are kept on the history server and their titles fetched with one esummary request,
+        then matched to the searched titles. Return {title: [PMIDs] or None if the search failed}"""
+        found = {}
+        for i in range(0, len(titles), title_batch_size):
+            batch = titles[i:i + title_batch_size]
+            found.update(self._search_title_batch(batch))
+        return found
+
+    def _search_title_batch(self, titles):
+        terms = ['(' + ' AND '.join(w + '[Title]' for w in title_words(t)) + ')' for t in titles]
+        result = self.esearch(' OR '.join(terms), usehistory='y', retmax=0)
+        if result is None:
+            return {title: None for title in titles}
+        count = int(result.get('count', 0))
+        if count > max_summaries:
+            return {title: self.search_title(title) for title in titles}
+        found = {title: [] for title in titles}
+        if not count:
+            return found
+        summaries = self.request('esummary.fcgi', {'db': 'pubmed', 'retmode': 'json', 'retmax': count,
+                                                   'WebEnv': result['webenv'], 'query_key': result['querykey']})
+        if summaries is None:
+            return {title: None for title in titles}
+        articles = summaries.get('result', {})
+        for pmid in articles.get('uids', []):
+            article_words = set(title_words(articles[pmid].get('title', '')))
+            for title in titles:
+                if set(title_words(title)) <= article_words:
+                    found[title].append(pmid)
+        return found
+
+    def find_geo_datasets(self, pmids):
+        """Return {pmid: [GSE accessions]} for the articles linked to GEO datasets,
+        with one elink request for all articles and one efetch request per linked article"""
+        if not pmids:
+            return {}
+        links = self.request('elink.fcgi', {'dbfrom': 'pubmed', 'db': 'gds', 'retmode': 'json', 'id': list(pmids)})
+        datasets = {}
+        for linkset in (links or {}).get('linksets', []):
+            geo_ids = [num for item in linkset.get('linksetdbs', []) for num in item.get('links', [])]
+            if not geo_ids or not linkset.get('ids'):
+                continue
+            self.limiter.acquire()
+            try:
+                res = self.session.post(EUTILS_URL + 'efetch.fcgi', data={'db': 'gds', 'id': ','.join(geo_ids)})
+            except requests.exceptions.RequestException:
+                continue
+            if res.status_code != 200:
+                continue
+            geo_accs = [item for item in res.text.split() if item.startswith('GSE')]
+            if geo_accs:
+                datasets[str(linkset['ids'][0])] = geo_accs
+        return datasets
@@ -1,7 +1,11 @@
+import copy
 import time
 import random
 import re
 import string
+import threading
+import boto3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 # import json  # used for testing
 from dcicutils import ff_utils
 from dcicutils.s3_utils import s3Utils
@@ -10,15 +14,50 @@ from datetime import datetime, timezone, timedelta
 from operator import itemgetter
 from tibanna_4dn.core import API
 from . import wfrset_utils
+from .checkpoint_utils import (
+    checkpoint_scope,
+    get_checkpoint,
+    rotate_to_checkpoint,
+    set_checkpoint
+)
 
 lambda_limit = wfrset_utils.lambda_limit
 random_wait = wfrset_utils.random_wait
 load_wait = wfrset_utils.load_wait
+# number of workflow runs started concurrently by start_tasks
+run_launch_workers = 8
+
+
+# workflow and experiment type metadata is reused within a status check, which clears
+# the cache when it starts; entries also expire after this many seconds
+metadata_cache_ttl = 1800
+_metadata_cache = {}
+
+
+def cached_metadata(cache_key, fetch, ttl=None):
+    """Return a copy of the cached value for cache_key, calling fetch() to (re)populate
+    the cache if the key is missing or older than ttl seconds (metadata_cache_ttl by default)"""
+    ttl = metadata_cache_ttl if ttl is None else ttl
+    cached = _metadata_cache.get(cache_key)
+    if cached is None or time.time() - cached[0] > ttl:
+        cached = (time.time(), fetch())
+        _metadata_cache[cache_key] = cached
+    return copy.deepcopy(cached[1])
+
+
+def clear_metadata_cache():
+    """Drop all cached workflow and experiment type metadata"""
+    _metadata_cache.clear()
 
 
 # creates hash keyed by workflow app_name with values for accepted versions
 # and the run_time from info in database
 def get_workflow_details(my_auth):
+    return cached_metadata(('workflow_details', my_auth.get('server')),
+                           lambda: _fetch_workflow_details(my_auth))
+
+
+def _fetch_workflow_details(my_auth):
     wf_details = {}
     wf_query = "search/?type=Workflow&tags=current&tags=accepted&field=max_runtime" \
         "&app_name!=No value&app_version!=No value&field=app_name&field=app_version"
@@ -220,6 +259,93 @@ def extract_nz_chr(acc, auth):
     return nz_num, chrsize, max_distance
 
 
+class MetadataLibrary(object):
+    """Indexes the items returned by ff_utils.expand_es_metadata for an experiment set,
+    so that files, workflow runs and qcs can be found by @id, uuid or accession in
+    constant time instead of scanning the item lists for every lookup.
+    For backwards compatibility library['files'], library['wfrs'] and library['qcs']
+    return the indexes, and any other key returns the item list of that type
+    (ie. library['file_fastq'])"""
+    def __init__(self, all_items):
+        self.all_items = all_items
+        self.files = {}
+        self.wfrs = {}
+        self.qcs = {}
+        self._items = {}
+        for item_type, items in all_items.items():
+            if item_type.startswith('file_'):
+                index = self.files
+            elif item_type in ['workflow_run_awsem', 'workflow_run_sbg']:
+                index = self.wfrs
+            elif item_type.startswith('quality_metric'):
+                index = self.qcs
+            else:
+                index = None
+            for item in items:
+                for identifier in [item.get('@id'), item.get('uuid'), item.get('accession')]:
+                    if not identifier:
+                        continue
+                    self._items[identifier] = item
+                    if index is not None:
+                        index[identifier] = item
+
+    def __getitem__(self, key):
+        if key in ['files', 'wfrs', 'qcs']:
+            return getattr(self, key)
+        return self.all_items[key]
+
+    def __contains__(self, identifier):
+        return identifier in self._items
+
+    def get(self, identifier):
+        """Return the item with given @id, uuid or accession, raise KeyError if not in library"""
+        return self._items[identifier]
+
+
+def find_item(items, identifier, field='@id'):
+    """Find the item with item[field] == identifier in a list of items, or
+    in an index (dict or MetadataLibrary index) keyed by that identifier"""
+    if isinstance(items, (dict, MetadataLibrary)):
+        return items[identifier]
+    return [i for i in items if i[field] == identifier][0]
+
+
+# number of experiment sets expanded together by prefetch_set_libraries
+prefetch_page_size = 10
+
+
+def prefetch_set_libraries(sets, my_auth, page_size=prefetch_page_size,
+                           ignore_field=['experiment_relation', 'biosample_relation', 'references', 'reference_pubs']):
+    """Generator yielding (set, library) for each experiment set in sets.
+    Sets are expanded page_size at a time with a single expand_es_metadata call,
+    so items shared between sets (reference files, workflows, etc.) are fetched once per page
+    and the library of a page is shared by its sets. The next page is fetched in a background
+    thread while the sets of the current page are processed."""
+    pages = [sets[i:i + page_size] for i in range(0, len(sets), page_size)]
+    if not pages:
+        return
+
+    def expand_page(page):
+        all_items, _ = ff_utils.expand_es_metadata([a_set['uuid'] for a_set in page], my_auth,
+                                                   store_frame='embedded',
+                                                   add_pc_wfr=True,
+                                                   ignore_field=ignore_field)
+        return MetadataLibrary(all_items)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        next_library = executor.submit(expand_page, pages[0])
+        for n, page in enumerate(pages):
+            library = next_library.result()
+            if n + 1 < len(pages):
+                next_library = executor.submit(expand_page, pages[n + 1])
+            for a_set in page:
+                yield a_set, library
+    finally:
+        # do not wait for a pending prefetch if the caller stopped early (ie. lambda_limit)
+        executor.shutdown(wait=False)
+
+
 def check_qcs_on_files(file_meta, all_qcs):
     """Go over qc related fields, and check for overall quality score."""
     def check_qc(file_accession, resp, failed_qcs_list):
@@ -232,12 +358,12 @@ def check_qcs_on_files(file_meta, all_qcs):
     failed_qcs = []
     if not file_meta.get('quality_metric'):
         return
-    qc_result = [i for i in all_qcs if i['@id'] == file_meta['quality_metric']['@id']][0]
+    qc_result = find_item(all_qcs, file_meta['quality_metric']['@id'])
     if qc_result['display_title'].startswith('QualityMetricQclist'):
         if not qc_result.get('qc_list'):
             return
         for qc in qc_result['qc_list']:
-            qc_resp = [i for i in all_qcs if i['@id'] == qc['@id']][0]
+            qc_resp = find_item(all_qcs, qc['@id'])
             failed_qcs = check_qc(file_meta['accession'], qc_resp, failed_qcs)
     else:
         failed_qcs = check_qc(file_meta['accession'], qc_result, failed_qcs)
@@ -274,19 +400,19 @@ def stepper(my_auth, library, keep,
             if isinstance(an_input, list) or isinstance(an_input, tuple):
                 for a_nested_input in an_input:
                     file_accs.append(a_nested_input.split('/')[2])
-                    input_resp = [i for i in all_files if i['@id'] == a_nested_input][0]
+                    input_resp = find_item(all_files, a_nested_input)
                     errors = check_qcs_on_files(input_resp, all_qcs)
                     if errors:
                         qc_errors.extend(errors)
             else:
                 file_accs.append(an_input.split('/')[2])
-                input_resp = [i for i in all_files if i['@id'] == an_input][0]
+                input_resp = find_item(all_files, an_input)
                 errors = check_qcs_on_files(input_resp, all_qcs)
                 if errors:
                     qc_errors.extend(errors)
         name_tag = '_'.join(file_accs)
     else:
-        input_resp = [i for i in all_files if i['@id'] == new_step_input_file][0]
+        input_resp = find_item(all_files, new_step_input_file)
         errors = check_qcs_on_files(input_resp, all_qcs)
         if errors:
             qc_errors.extend(errors)
@@ -410,7 +536,7 @@ def get_wfr_out(emb_file, wfr_name, key=None, all_wfrs=None, versions=None,
 
     # get metadata for the last wfr
     if all_wfrs:
-        wfr = [i for i in all_wfrs if i['uuid'] == last_wfr['uuid']][0]
+        wfr = find_item(all_wfrs, last_wfr['uuid'], 'uuid')
     else:
         wfr = ff_utils.get_metadata(last_wfr['uuid'], key)
     run_duration = last_wfr['run_hours']
@@ -474,11 +600,64 @@ def get_attribution(file_json):
     return attributions
 
 
-def extract_file_info(obj_id, arg_name, additional_parameters, auth, env, rename=[]):
-    """Takes file id, and creates info dict for tibanna"""
-    my_s3_util = s3Utils(env=env)
+class FileMetadataResolver(object):
+    """Resolves input file identifiers (@id or accession) to the file metadata needed to start runs.
+    prefetch collects files with bulk searches, later lookups are served from memory and
+    fall back to get_metadata for files that were not prefetched"""
+    fields = ['uuid', 'accession', 'display_title', 'lab', 'contributing_labs']
+    chunk_size = 100
+
+    def __init__(self, auth):
+        self.auth = auth
+        self.files = {}
+
+    @staticmethod
+    def file_key(identifier):
+        """@id (/files-fastq/4DNFIXXXXXXX/) and accession of a file share the same key"""
+        if identifier.startswith('/'):
+            return identifier.split('/')[2]
+        return identifier
+
+    def prefetch(self, identifiers):
+        """Fetch all files not yet in memory with searches of chunk_size accessions"""
+        keys = sorted(set(self.file_key(i) for i in identifiers) - set(self.files))
+        for n in range(0, len(keys), self.chunk_size):
+            query = '/search/?type=File' + ''.join(['&accession=' + i for i in keys[n:n + self.chunk_size]])
+            query += ''.join(['&field=' + i for i in self.fields])
+            for a_file in ff_utils.search_metadata(query, key=self.auth):
+                self.files[a_file['accession']] = a_file
+
+    def get(self, identifier):
+        key = self.file_key(identifier)
+        if key not in self.files:
+            self.files[key] = ff_utils.get_metadata(identifier, key=self.auth)
+        return self.files[key]
+
+
+def run_input_files(run_info):
+    """Return all file identifiers in the inputs of a missing run (including references)"""
+    def flatten(value):
+        if isinstance(value, (list, tuple)):
+            return [i for v in value for i in flatten(v)]
+        return [value]
+
+    inputs = run_info[2]
+    return [i for arg, files in inputs.items() if arg != 'additional_file_parameters' for i in flatten(files)]
+
+
+def extract_file_info(obj_id, arg_name, additional_parameters, auth, env, rename=[], resolver=None, s3_util=None):
+    """Takes file id, and creates info dict for tibanna
+    if a FileMetadataResolver is given, file metadata is taken from it instead of individual get requests
+    if an s3Utils is given, the buckets are taken from it instead of a new s3Utils for env"""
+    my_s3_util = s3_util or s3Utils(env=env)
     raw_bucket = my_s3_util.raw_file_bucket
     out_bucket = my_s3_util.outfile_bucket
+
+    def get_file_metadata(a_file):
+        if resolver:
+            return resolver.get(a_file)
+        return ff_utils.get_metadata(a_file, key=auth)
+
     """Creates the formatted dictionary for files.
     """
     # start a dictionary
@@ -506,7 +685,7 @@ def extract_file_info(obj_id, arg_name, additional_parameters, auth, env, rename
                         nested_nested_uuid = []
                         for nested_nested_obj in nested_obj:
                             print('4', nested_nested_obj)
-                            metadata = ff_utils.get_metadata(nested_nested_obj, key=auth)
+                            metadata = get_file_metadata(nested_nested_obj)
                             nested_nested_object_key.append(metadata['display_title'])
                             nested_nested_uuid.append(metadata['uuid'])
                             # get the bucket
@@ -518,7 +697,7 @@ def extract_file_info(obj_id, arg_name, additional_parameters, auth, env, rename
                         nested_object_key.append(nested_nested_object_key)
                         nested_uuid.append(nested_nested_uuid)
                     else:
-                        metadata = ff_utils.get_metadata(nested_obj, key=auth)
+                        metadata = get_file_metadata(nested_obj)
                         nested_object_key.append(metadata['display_title'])
                         nested_uuid.append(metadata['uuid'])
                         # get the bucket
@@ -530,7 +709,7 @@ def extract_file_info(obj_id, arg_name, additional_parameters, auth, env, rename
                 object_key.append(nested_object_key)
                 uuid.append(nested_uuid)
             else:
-                metadata = ff_utils.get_metadata(obj, key=auth)
+                metadata = get_file_metadata(obj)
                 object_key.append(metadata['display_title'])
                 uuid.append(metadata['uuid'])
                 # get the bucket
@@ -549,7 +728,7 @@ def extract_file_info(obj_id, arg_name, additional_parameters, auth, env, rename
 
     # if obj_id is a string
     else:
-        metadata = ff_utils.get_metadata(obj_id, key=auth)
+        metadata = get_file_metadata(obj_id)
         template['uuid'] = metadata['uuid']
         # get the bucket
         if 'FileProcessed' in metadata['@type']:
@@ -557,7 +736,7 @@ def extract_file_info(obj_id, arg_name, additional_parameters, auth, env, rename
         else:  # covers cases of FileFastq, FileReference, FileMicroscopy
             my_bucket = raw_bucket
         if rename:
-            template['rename'] = object_key.replace(change_from, change_to)
+            template['rename'] = metadata['display_title'].replace(change_from, change_to)
         if additional_parameters:
             template.update(additional_parameters)
     return template
@@ -572,8 +751,15 @@ def get_namekey_from_etype(exp_type):
     return name
 
 
+def get_experiment_type_metadata(auth, exp_type):
+    """Get the (cached) ExperimentType item for the experiment type title"""
+    etype_id = "experiment_type/{}".format(get_namekey_from_etype(exp_type))
+    return cached_metadata(('experiment_type', auth.get('server'), etype_id),
+                           lambda: ff_utils.get_metadata(etype_id, auth))
+
+
 def get_current_pipeline_tag(auth, exp_type):
-    etype_meta = ff_utils.get_metadata("experiment_type/{}".format(get_namekey_from_etype(exp_type)), auth)
+    etype_meta = get_experiment_type_metadata(auth, exp_type)
     if etype_meta:
         if 'current_pipeline' in etype_meta:
             return etype_meta.get('current_pipeline')
@@ -583,7 +769,7 @@ def get_current_pipeline_tag(auth, exp_type):
 def get_accepted_pipeline_versions(auth, exp_type, kwargs):
     accepted_versions = kwargs.get('acc_pipes', None)
     if not accepted_versions:
-        etype_meta = ff_utils.get_metadata("experiment_type/{}".format(get_namekey_from_etype(exp_type)), auth)
+        etype_meta = get_experiment_type_metadata(auth, exp_type)
         if not etype_meta:
             return accepted_versions
         accepted_versions = etype_meta.get('accepted_pipelines', [])
@@ -664,7 +850,7 @@ def find_fastq_info(my_rep_set, fastq_files, type=None):
     - refs keys  {pairing, organism, enzyme, bwa_ref, chrsize_ref, enz_ref, f_size, lab}
     """
     # remove non fastq.gz files from the file list
-    fastq_files = [i for i in fastq_files if i['file_format']['file_format'] == 'fastq']
+    fastq_files = {i['uuid']: i for i in fastq_files if i['file_format']['file_format'] == 'fastq'}
     file_dict = {}
     refs = {}
 
@@ -687,7 +873,7 @@ def find_fastq_info(my_rep_set, fastq_files, type=None):
         if enzyme:
             enzymes.append(enzyme['display_title'])
         for fastq_file in exp_files:
-            file_resp = [i for i in fastq_files if i['uuid'] == fastq_file['uuid']][0]
+            file_resp = fastq_files[fastq_file['uuid']]
             if file_resp.get('file_size'):
                 total_f_size += file_resp['file_size']
             # skip pair no 2
@@ -820,21 +1006,86 @@ def check_runs_without_output(res, check, run_name, my_auth, start, **kwargs):
     return check
 
 
+# Incremental mode of the pipeline status checks: the modification date of each evaluated set
+# is kept in full_output[SET_STATES_KEY] as {accession: [date_modified, date evaluated]}
+SET_STATES_KEY = 'set_states'
+set_outputs = ['skipped', 'running_runs', 'needs_runs', 'completed_runs', 'problematic_runs']
+# runs of these sets progress without the set being modified, so they are evaluated on every run
+unsettled_outputs = ['running_runs', 'needs_runs', 'completed_runs']
+# set states are only reused by runs with the same values for these kwargs
+set_state_kwargs = ['lab_title', 'start_date', 'max_runtime', 'acc_wf_vers', 'acc_pipes', 'query']
+
+
+def output_accession(output_name, entry):
+    """Return the set accession of an entry of full_output[output_name] (see check_hic)"""
+    if output_name == 'completed_runs':
+        return entry['add_tag'][0]
+    return next(iter(entry))
+
+
+def date_modified(a_set):
+    return (a_set.get('last_modified') or {}).get('date_modified')
+
+
+def select_sets_to_check(res, check, kwargs):
+    """Return the sets of res that should be evaluated by check_hic, check_repli, etc.
+    With kwargs['incremental'], sets are skipped if they were not modified since the previous
+    run evaluated them, have no running, missing or completed runs and were evaluated in the
+    last kwargs['full_refresh_hours']. Their results are copied from the previous result, so the
+    summary still covers all sets. Call save_set_states with the returned sets after evaluation"""
+    scope = checkpoint_scope(*[kwargs.get(k) for k in set_state_kwargs])
+    states = {}
+    check.full_output[SET_STATES_KEY] = {'scope': scope, 'sets': states}
+    if not kwargs.get('incremental'):
+        return res
+    latest = check.get_latest_result() or {}
+    previous = latest.get('full_output')
+    if not isinstance(previous, dict) or (previous.get(SET_STATES_KEY) or {}).get('scope') != scope:
+        return res
+    previous_states = previous[SET_STATES_KEY]['sets']
+    refresh_hours = kwargs.get('full_refresh_hours') or 24
+    refresh_after = (datetime.utcnow() - timedelta(hours=refresh_hours)).isoformat()
+    unsettled = {output_accession(name, entry) for name in unsettled_outputs for entry in previous.get(name, [])}
+    to_check = []
+    for a_set in res:
+        acc = a_set['accession']
+        state = previous_states.get(acc)
+        if state and state[0] == date_modified(a_set) and state[1] > refresh_after and acc not in unsettled:
+            states[acc] = state
+        else:
+            to_check.append(a_set)
+    # brief_output lines start with the set accession (see check_hic)
+    check.brief_output.extend(line for line in latest.get('brief_output') or []
+                              if line.split(' - ')[0] in states)
+    for name in set_outputs:
+        check.full_output[name].extend(entry for entry in previous.get(name, [])
+                                       if output_accession(name, entry) in states)
+    return to_check
+
+
+def save_set_states(check, sets):
+    """Remember the modification date of the sets evaluated by this run.
+    Sets not reached before lambda_limit are evaluated again by the next run"""
+    now = datetime.utcnow().isoformat()
+    evaluated = {line.split(' - ')[0] for line in check.brief_output}
+    states = check.full_output[SET_STATES_KEY]['sets']
+    for a_set in sets:
+        if a_set['accession'] in evaluated:
+            states[a_set['accession']] = [date_modified(a_set), now]
+
+
 def check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=False, **kwargs):
     """Check run status for each set in res, and report missing runs and completed process"""
-    for a_set in res:
-        # get all related items
-        all_items, _ = ff_utils.expand_es_metadata([a_set['uuid']], my_auth,
-                                                   store_frame='embedded',
-                                                   add_pc_wfr=True,
-                                                   ignore_field=['experiment_relation',
-                                                                 'biosample_relation',
-                                                                 'references',
-                                                                 'reference_pubs'])
-        all_wfrs = all_items.get('workflow_run_awsem', []) + all_items.get('workflow_run_sbg', [])
+    # continue after the last set checked by the previous run if it stopped at lambda_limit
+    cursor = get_checkpoint(check)
+    res = rotate_to_checkpoint(res, cursor, key=itemgetter('accession'))
+    # get all related items, expanded a page of sets at a time
+    for n, (a_set, library) in enumerate(prefetch_set_libraries(res, my_auth)):
+        all_wfrs = library.wfrs
         now = datetime.utcnow()
         print(a_set['accession'], (now-start).seconds)
         if (now-start).seconds > lambda_limit:
+            set_checkpoint(check, res[n - 1]['accession'] if n else cursor)
             break
         # missing run
         missing_run = []
@@ -850,7 +1101,7 @@ def check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, no
         part3 = 'ready'
         # references dict content
         # pairing, organism, enzyme, bwa_ref, chrsize_ref, enz_ref, f_size
-        exp_files, refs = find_fastq_info(a_set, all_items['file_fastq'])
+        exp_files, refs = find_fastq_info(a_set, library['file_fastq'])
         set_summary = " - ".join([set_acc, str(refs['organism']), str(refs['enzyme']), str(refs['f_size'])])
         # if no files were found
         if all(not value for value in exp_files.values()):
@@ -899,7 +1150,7 @@ def check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, no
             exp_bams = []
             part2 = 'ready'
             for pair in exp_files[exp]:
-                pair_resp = [i for i in all_items['file_fastq'] if i['@id'] == pair[0]][0]
+                pair_resp = library.get(pair[0])
                 step1_result = get_wfr_out(pair_resp, 'bwa-mem', key=my_auth, all_wfrs=all_wfrs, **kwargs)
                 # if successful
                 if step1_result['status'] == 'complete':
@@ -926,7 +1177,7 @@ def check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, no
             # make sure all input bams went through same last step2
             all_step2s = []
             for bam in exp_bams:
-                bam_resp = [i for i in all_items['file_processed'] if i['@id'] == bam][0]
+                bam_resp = library.get(bam)
                 step2_result = get_wfr_out(bam_resp, 'hi-c-processing-bam', key=my_auth, all_wfrs=all_wfrs, **kwargs)
                 all_step2s.append((step2_result['status'], step2_result.get('annotated_bam')))
             # all bams should have same wfr
@@ -969,7 +1220,7 @@ def check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, no
             # make sure all input bams went through same last step3
             all_step3s = []
             for a_pair in set_pairs:
-                a_pair_resp = [i for i in all_items['file_processed'] if i['@id'] == a_pair][0]
+                a_pair_resp = library.get(a_pair)
                 step3_result = get_wfr_out(a_pair_resp, 'hi-c-processing-pairs', key=my_auth, all_wfrs=all_wfrs, **kwargs)
                 all_step3s.append((step3_result['status'], step3_result.get('mcool')))
             # make sure existing step3s are matching
@@ -1039,19 +1290,16 @@ def check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, no
 
 def check_margi(res, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=False, **kwargs):
     """Check run status for each set in res, and report missing runs and completed process"""
-    for a_set in res:
-        # get all related items
-        all_items, all_uuids = ff_utils.expand_es_metadata([a_set['uuid']], my_auth,
-                                                           store_frame='embedded',
-                                                           add_pc_wfr=True,
-                                                           ignore_field=['experiment_relation',
-                                                                         'biosample_relation',
-                                                                         'references',
-                                                                         'reference_pubs'])
-        all_wfrs = all_items.get('workflow_run_awsem', []) + all_items.get('workflow_run_sbg', [])
+    # continue after the last set checked by the previous run if it stopped at lambda_limit
+    cursor = get_checkpoint(check)
+    res = rotate_to_checkpoint(res, cursor, key=itemgetter('accession'))
+    # get all related items, expanded a page of sets at a time
+    for n, (a_set, library) in enumerate(prefetch_set_libraries(res, my_auth)):
+        all_wfrs = library.wfrs
         now = datetime.utcnow()
-        print(a_set['accession'], (now-start).seconds, len(all_uuids))
+        print(a_set['accession'], (now-start).seconds)
         if (now-start).seconds > lambda_limit:
+            set_checkpoint(check, res[n - 1]['accession'] if n else cursor)
             break
         # missing run
         missing_run = []
@@ -1067,7 +1315,7 @@ def check_margi(res, my_auth, exp_type, check, start, lambda_limit, nore=False,
         part3 = 'ready'
         # references dict content
         # pairing, organism, enzyme, bwa_ref, chrsize_ref, enz_ref, f_size
-        exp_files, refs = find_fastq_info(a_set, all_items['file_fastq'], type='MARGI')
+        exp_files, refs = find_fastq_info(a_set, library['file_fastq'], type='MARGI')
         set_summary = " - ".join([set_acc, str(refs['organism']), str(refs['enzyme']), str(refs['f_size'])])
         # if no files were found
         if all(not value for value in exp_files.values()):
@@ -1117,7 +1365,7 @@ def check_margi(res, my_auth, exp_type, check, start, lambda_limit, nore=False,
             for pair in exp_files[exp]:
                 part2 = 'ready'
                 input_bam = ""
-                pair_resp = [i for i in all_items['file_fastq'] if i['@id'] == pair[0]][0]
+                pair_resp = library.get(pair[0])
                 step1_result = get_wfr_out(pair_resp, 'imargi-processing-fastq', key=my_auth, all_wfrs=all_wfrs, **kwargs)
                 # if successful
                 if step1_result['status'] == 'complete':
@@ -1143,7 +1391,7 @@ def check_margi(res, my_auth, exp_type, check, start, lambda_limit, nore=False,
                     part2_5 = 'not ready'
                     continue
 
-                bam_resp = [i for i in all_items['file_processed'] if i['@id'] == input_bam][0]
+                bam_resp = library.get(input_bam)
                 step2_result = get_wfr_out(bam_resp, 'imargi-processing-bam', key=my_auth, all_wfrs=all_wfrs, **kwargs)
                 # if successful
                 if step2_result['status'] == 'complete':
@@ -1188,7 +1436,7 @@ def check_margi(res, my_auth, exp_type, check, start, lambda_limit, nore=False,
             # make sure all input bams went through same last step3
             all_step3s = []
             for a_pair in set_pairs:
-                a_pair_resp = [i for i in all_items['file_processed'] if i['@id'] == a_pair][0]
+                a_pair_resp = library.get(a_pair)
                 step3_result = get_wfr_out(a_pair_resp, 'imargi-processing-pairs', key=my_auth, all_wfrs=all_wfrs, **kwargs)
                 all_step3s.append((step3_result['status'], step3_result.get('out_mcool')))
             # make sure existing step3s are matching
@@ -1374,7 +1622,8 @@ def patch_complete_data(patch_data, pipeline_type, auth, move_to_pc=False, pc_ap
     return log
 
 
-def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, fs_env, mount=False):
+def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, fs_env, mount=False, resolver=None,
+                    s3_util=None):
     if fs_env == 'staging':
         raise ValueError("'staging' not an expected value for fs_env - pipelines do not run on staging."
                          "please run on data instead.")
@@ -1385,11 +1634,11 @@ def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, fs_
     input_file_parameters = input_files_and_params.get('additional_file_parameters', {})
     for arg, files in input_files.items():
         additional_params = input_file_parameters.get(arg, {})
-        inp = extract_file_info(files, arg, additional_params, auth, env)
+        inp = extract_file_info(files, arg, additional_params, auth, env, resolver=resolver, s3_util=s3_util)
         all_inputs.append(inp)
     # tweak to get bg2bw working
     all_inputs = sorted(all_inputs, key=itemgetter('workflow_argument_name'))
-    my_s3_util = s3Utils(env=env)
+    my_s3_util = s3_util or s3Utils(env=env)
     out_bucket = my_s3_util.outfile_bucket
     sfn = 'tibanna_pony_' + fs_env
     # shorten long name_tags
@@ -1427,7 +1676,7 @@ def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, fs_
         return str(e)
 
 
-def start_missing_run(run_info, auth, env, fs_env):
+def start_missing_run(run_info, auth, env, fs_env, resolver=None, s3_util=None):
     attr_keys = ['fastq1', 'fastq', 'input_pairs', 'input_bams', 'input_fastqs',
                  'fastq_R1', 'input_bam', 'rna.fastqs_R1', 'mad_qc.quantfiles', 'mcoolfile',
                  'chip.ctl_fastqs', 'chip.fastqs', 'chip.tas', 'atac.fastqs', 'atac.tas', 'input_bed']
@@ -1458,42 +1707,88 @@ def start_missing_run(run_info, auth, env, fs_env):
                          ' should be added to att_keys dictionary on foursight cgap_utils.py or attr_keys'
                          ' in wfr_utils.py function start_missing_run').format(possible_keys)
         raise ValueError(error_message)
-    attributions = get_attribution(ff_utils.get_metadata(attr_file, auth))
+    if resolver:
+        attributions = get_attribution(resolver.get(attr_file))
+    else:
+        attributions = get_attribution(ff_utils.get_metadata(attr_file, auth))
     settings = wfrset_utils.step_settings(run_settings[0], run_settings[1], attributions, run_settings[2])
-    url = run_missing_wfr(settings, inputs, name_tag, auth, env, fs_env, mount=False)
+    url = run_missing_wfr(settings, inputs, name_tag, auth, env, fs_env, mount=False, resolver=resolver, s3_util=s3_util)
     return url
 
 
-def start_tasks(missing_runs, patch_meta, action, my_auth, my_env, fs_env, start, move_to_pc=False, runtype='hic', pc_append=False):
-    started_runs = 0
+def setup_default_boto3_session():
+    """Create the default boto3 session and resolve its credentials in this thread. boto3.client()
+    uses this session, and setting it up from several threads at once is not thread safe"""
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.get_credentials()
+
+
+def start_tasks(missing_runs, patch_meta, action, my_auth, my_env, fs_env, start, move_to_pc=False, runtype='hic', pc_append=False,
+                max_workers=None):
+    """Start the missing runs and patch the completed sets. Runs are started concurrently by at most
+    max_workers threads (run_launch_workers by default); no new run is started after lambda_limit.
+    If a previous run of the action on the same inputs stopped at lambda_limit, continue where it stopped"""
     action.description = ""
     action_log = {'started_runs': [], 'failed_runs': [], 'patched_meta': [], 'failed_meta': []}
+    scope = checkpoint_scope(missing_runs, patch_meta)
+    cursor = get_checkpoint(action, scope) or {'runs': 0, 'patches': 0}
+    n_runs, n_patches = cursor['runs'], cursor['patches']
+    timed_out = False
     if missing_runs:
-        for a_case in missing_runs:
-            now = datetime.utcnow()
-            acc = list(a_case.keys())[0]
-            print((now-start).seconds, acc)
-            if (now-start).seconds > lambda_limit:
-                action.description = 'Did not complete action due to time limitations.'
-                break
-
-            for a_run in a_case[acc]:
-                started_runs += 1
-                url = start_missing_run(a_run, my_auth, my_env, fs_env)
-                log_message = acc + ' started running ' + a_run[0] + ' with ' + a_run[3]
-                if url.startswith('http'):
-                    action_log['started_runs'].append([log_message, url])
-                else:
-                    action_log['failed_runs'].append([log_message, url])
+        max_workers = max_workers or run_launch_workers
+        runs_to_start = [(acc, a_run) for a_case in missing_runs for acc in a_case for a_run in a_case[acc]]
+        runs_to_start = runs_to_start[n_runs:]
+        # setting up boto3 sessions and clients is not thread safe: the workers share one s3Utils,
+        # and the default session, which tibanna uses for its clients, is set up before they start
+        setup_default_boto3_session()
+        s3_util = s3Utils(env=my_env)
+        # resolve the input and reference files of all runs with a few bulk searches
+        resolver = FileMetadataResolver(my_auth)
+        resolver.prefetch([i for _, a_run in runs_to_start for i in run_input_files(a_run)])
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        launching = {}
+        try:
+            while runs_to_start or launching:
+                while runs_to_start and len(launching) < max_workers:
+                    now = datetime.utcnow()
+                    if (now-start).seconds > lambda_limit:
+                        action.description = 'Did not complete action due to time limitations.'
+                        timed_out = True
+                        runs_to_start = []
+                        break
+                    acc, a_run = runs_to_start.pop(0)
+                    n_runs += 1
+                    print((now-start).seconds, acc, a_run[3])
+                    launching[executor.submit(start_missing_run, a_run, my_auth, my_env, fs_env, resolver, s3_util)] = (acc, a_run)
+                if not launching:
+                    break
+                done, _ = wait(launching, return_when=FIRST_COMPLETED)
+                for future in done:
+                    acc, a_run = launching.pop(future)
+                    try:
+                        url = future.result()
+                    except Exception as e:
+                        url = str(e)
+                    log_message = acc + ' started running ' + a_run[0] + ' with ' + a_run[3]
+                    if url.startswith('http'):
+                        action_log['started_runs'].append([log_message, url])
+                        use_run_budget(my_auth)
+                    else:
+                        action_log['failed_runs'].append([log_message, url])
+        finally:
+            executor.shutdown(wait=True)
     if patch_meta:
         action_log['patched_meta'] = []
-        for a_completed_info in patch_meta:
+        for a_completed_info in patch_meta[n_patches:]:
             acc = a_completed_info['add_tag'][0]
             now = datetime.utcnow()
             if (now-start).seconds > lambda_limit:
                 action.description = 'Did not complete action due to time limitations.'
+                timed_out = True
                 break
             error = patch_complete_data(a_completed_info, runtype, my_auth, move_to_pc=move_to_pc, pc_append=pc_append)
+            n_patches += 1
             if not error:
                 log_message = acc + ' completed processing'
                 action_log['patched_meta'].append(log_message)
@@ -1507,25 +1802,24 @@ def start_tasks(missing_runs, patch_meta, action, my_auth, my_env, fs_env, start
             action.description += add_desc
 
     action.output = action_log
+    if timed_out:
+        set_checkpoint(action, {'runs': n_runs, 'patches': n_patches}, scope)
     action.status = 'DONE'
     return action
 
 
 def check_repli(res, my_auth, exp_type, check, start, lambda_limit, winsize=None, **kwargs):
     """Check run status for each set in res, and report missing runs and completed process"""
-    for a_set in res:
-        # get all related items
-        all_items, _ = ff_utils.expand_es_metadata([a_set['uuid']], my_auth,
-                                                   store_frame='embedded',
-                                                   add_pc_wfr=True,
-                                                   ignore_field=['experiment_relation',
-                                                                 'biosample_relation',
-                                                                 'references',
-                                                                 'reference_pubs'])
-        all_wfrs = all_items.get('workflow_run_awsem', []) + all_items.get('workflow_run_sbg', [])
+    # continue after the last set checked by the previous run if it stopped at lambda_limit
+    cursor = get_checkpoint(check)
+    res = rotate_to_checkpoint(res, cursor, key=itemgetter('accession'))
+    # get all related items, expanded a page of sets at a time
+    for n, (a_set, library) in enumerate(prefetch_set_libraries(res, my_auth)):
+        all_wfrs = library.wfrs
         now = datetime.utcnow()
         print(a_set['accession'], (now-start).seconds)
         if (now-start).seconds > lambda_limit:
+            set_checkpoint(check, res[n - 1]['accession'] if n else cursor)
             break
         # missing run
         missing_run = []
@@ -1540,7 +1834,7 @@ def check_repli(res, my_auth, exp_type, check, start, lambda_limit, winsize=None
         set_acc = a_set['accession']
         # references dict content
         # pairing, organism, enzyme, bwa_ref, chrsize_ref, enz_ref, f_size
-        exp_files, refs = find_fastq_info(a_set, all_items['file_fastq'])
+        exp_files, refs = find_fastq_info(a_set, library['file_fastq'])
         paired = refs['pairing']
         set_summary = " - ".join([set_acc, str(refs['organism']), str(refs['f_size'])])
         # if no files were found
@@ -1577,9 +1871,9 @@ def check_repli(res, my_auth, exp_type, check, start, lambda_limit, winsize=None
             part2 = 'ready'  # switch for watching the exp
             for pair in exp_files[exp]:
                 if paired == 'Yes':
-                    pair_resp = [i for i in all_items['file_fastq'] if i['@id'] == pair[0]][0]
+                    pair_resp = library.get(pair[0])
                 elif paired == 'No':
-                    pair_resp = [i for i in all_items['file_fastq'] if i['@id'] == pair][0]
+                    pair_resp = library.get(pair)
                 step1_result = get_wfr_out(pair_resp, 'repliseq-parta', key=my_auth, all_wfrs=all_wfrs, **kwargs)
                 # if successful
                 if step1_result['status'] == 'complete':
@@ -1666,19 +1960,16 @@ def check_repli(res, my_auth, exp_type, check, start, lambda_limit, winsize=None
 
 def check_rna(res, my_auth, exp_type, check, start, lambda_limit, **kwargs):
     """Check run status for each set in res, and report missing runs and completed process"""
-    for a_set in res:
-        # get all related items
-        all_items, all_uuids = ff_utils.expand_es_metadata([a_set['uuid']], my_auth,
-                                                           store_frame='embedded',
-                                                           add_pc_wfr=True,
-                                                           ignore_field=['experiment_relation',
-                                                                         'biosample_relation',
-                                                                         'references',
-                                                                         'reference_pubs'])
-        all_wfrs = all_items.get('workflow_run_awsem', []) + all_items.get('workflow_run_sbg', [])
+    # continue after the last set checked by the previous run if it stopped at lambda_limit
+    cursor = get_checkpoint(check)
+    res = rotate_to_checkpoint(res, cursor, key=itemgetter('accession'))
+    # get all related items, expanded a page of sets at a time
+    for n, (a_set, library) in enumerate(prefetch_set_libraries(res, my_auth)):
+        all_wfrs = library.wfrs
         now = datetime.utcnow()
         # print(a_set['accession'], (now-start).seconds)
         if (now-start).seconds > lambda_limit:
+            set_checkpoint(check, res[n - 1]['accession'] if n else cursor)
             break
         # missing run
         missing_run = []
@@ -1694,7 +1985,7 @@ def check_rna(res, my_auth, exp_type, check, start, lambda_limit, **kwargs):
         final_status = 'ready'
         # references dict content
         # pairing, organism, enzyme, bwa_ref, chrsize_ref, enz_ref, f_size
-        exp_files, refs = find_fastq_info(a_set, all_items['file_fastq'])
+        exp_files, refs = find_fastq_info(a_set, library['file_fastq'])
 
         print(a_set['accession'], 'paired=', refs['pairing'], refs['organism'], refs['f_size'])
         paired = refs['pairing']
@@ -1729,7 +2020,7 @@ def check_rna(res, my_auth, exp_type, check, start, lambda_limit, **kwargs):
         # check  strandedness_verified
         not_verified = []
         for an_exp in exp_files:
-            an_exp_resp = [i for i in all_items['experiment_seq'] if i['accession'] == an_exp][0]
+            an_exp_resp = library.get(an_exp)
             tags = an_exp_resp.get('tags', [])
             if 'strandedness_verified' not in tags:
                 not_verified.append(an_exp)
@@ -1752,7 +2043,7 @@ def check_rna(res, my_auth, exp_type, check, start, lambda_limit, **kwargs):
                 continue
 
             strand_info = ''
-            exp_resp = [i for i in all_items['experiment_seq'] if i['accession'] == exp][0]
+            exp_resp = library.get(exp)
             tags = exp_resp.get('tags', [])
             strand_info = exp_resp.get('strandedness')
 
@@ -1777,10 +2068,10 @@ def check_rna(res, my_auth, exp_type, check, start, lambda_limit, **kwargs):
             input_files = exp_files[exp]
             if paired == 'Yes':
                 pars['rna.endedness'] = 'paired'
-                input_resp = [i for i in all_items['file_fastq'] if i['@id'] == input_files[0][0]][0]
+                input_resp = library.get(input_files[0][0])
             elif paired == 'No':
                 pars['rna.endedness'] = 'single'
-                input_resp = [i for i in all_items['file_fastq'] if i['@id'] == input_files[0]][0]
+                input_resp = library.get(input_files[0])
             step1_result = get_wfr_out(input_resp, app_name, key=my_auth, all_wfrs=all_wfrs, **kwargs)
 
             # if successful
@@ -1837,7 +2128,7 @@ def check_rna(res, my_auth, exp_type, check, start, lambda_limit, **kwargs):
             step2_status = 'ready'
         # run step2 if step1 s are complete
         else:
-            step2_input = [i for i in all_items['file_processed'] if i['@id'] == step2_files[0]][0]
+            step2_input = library.get(step2_files[0])
             step2_result = get_wfr_out(step2_input, 'mad_qc_workflow', key=my_auth, all_wfrs=all_wfrs, md_qc=True, **kwargs)
 
             # if successful
@@ -1946,7 +2237,7 @@ def get_chip_info(f_exp_resp, all_items):
     if targets:
         # use the tag from the first target, this assumes the rest follows the first one
         target = targets[0]
-        target_info = [i for i in all_items['bio_feature'] if i['uuid'] == target['uuid']][0]
+        target_info = find_item(all_items['bio_feature'], target['uuid'], 'uuid')
         # set to tf default and switch to histone if tagged so
         target_tags = target_info.get('tags', [])
         if not target_tags:
@@ -1974,7 +2265,7 @@ def get_chip_info(f_exp_resp, all_items):
             if len(controls) != 1:
                 print('multiple control experiments')
             else:
-                cont_exp_resp = [i for i in all_items['experiment_seq'] if i['uuid'] == controls[0]['uuid']][0]
+                cont_exp_resp = find_item(all_items['experiment_seq'], controls[0]['uuid'], 'uuid')
                 cont_exp_info = cont_exp_resp['experiment_sets']
                 control_set = [i['accession'] for i in cont_exp_info if i['@id'].startswith('/experiment-set-replicates/')][0]
     else:
@@ -1995,7 +2286,7 @@ def get_chip_files(exp_resp, all_files, isChip):
     exp_files = exp_resp['files']
     for a_file in exp_files:
         f_t = []
-        file_resp = [i for i in all_files if i['uuid'] == a_file['uuid']][0]
+        file_resp = find_item(all_files, a_file['uuid'], 'uuid')
         # get pair end no
         pair_end = file_resp.get('paired_end')
         if pair_end == '2':
@@ -2017,7 +2308,7 @@ def get_chip_files(exp_resp, all_files, isChip):
                 paired.append('single')
             f_t.append(file_resp['@id'])
         else:
-            f2 = [i for i in all_files if i['@id'] == paired_with][0]
+            f2 = find_item(all_files, paired_with)
             f_t.append(file_resp['@id'])
             f_t.append(f2['@id'])
         files.append(f_t)
@@ -2035,9 +2326,9 @@ def select_best_2(file_list, all_files, all_qcs):
         return (file_list)
 
     for f in file_list:
-        f_resp = [i for i in all_files if i['@id'] == f][0]
+        f_resp = find_item(all_files, f)
         qc = f_resp['quality_metric']
-        qc_resp = [i for i in all_qcs if i['uuid'] == qc['uuid']][0]
+        qc_resp = find_item(all_qcs, qc['uuid'], 'uuid')
         if 'nodup_flagstat_qc' in qc_resp:
             try:
                 score = qc_resp['nodup_flagstat_qc'][0]['mapped']
@@ -2055,17 +2346,52 @@ def select_best_2(file_list, all_files, all_qcs):
     return [scores[0][1], scores[1][1]]
 
 
+# Docker Hub rate limits pulls to 200 every 6 hours. The limit used here is set below that,
+# since only a few workflows check it before running
+n_runs_max = 180
+# the count of recent runs is reused by the checks and actions of a scheduled wave for this
+# many seconds, and decremented as runs are started (see use_run_budget)
+run_budget_ttl = 900
+_run_budget = {}
+_run_budget_lock = threading.Lock()
+
+
+def count_recent_runs(my_auth, hours=6):
+    """Count the workflow runs created in the past hours, with a search that only returns the total.
+    An empty search returns 404 with a total of 0, which search_request_with_retries accepts"""
+    statuses = ['in review by lab', 'deleted', 'pre-release', 'released to project', 'released']
+    query = 'type=WorkflowRunAwsem' + ''.join(['&status=' + s for s in statuses])
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    query += '&date_created.from=' + datetime.strftime(since, "%Y-%m-%d %H:%M")
+    url = '/'.join([my_auth['server'].rstrip('/'), 'search/?' + query + '&limit=0'])
+    res = ff_utils.authorized_request(url, auth=my_auth, retry_fxn=ff_utils.search_request_with_retries)
+    return res.json().get('total', 0)
+
+
+def get_run_budget(my_auth):
+    """Return the number of runs that can still be started in the current 6h window"""
+    server = my_auth.get('server')
+    with _run_budget_lock:
+        budget = _run_budget.get(server)
+        if budget is None or time.time() - budget[0] > run_budget_ttl:
+            budget = [time.time(), max(n_runs_max - count_recent_runs(my_auth), 0)]
+            _run_budget[server] = budget
+        return budget[1]
+
+
+def use_run_budget(my_auth, n_runs=1):
+    """Decrement the run budget after starting runs, if it was counted by this process"""
+    with _run_budget_lock:
+        budget = _run_budget.get(my_auth.get('server'))
+        if budget is not None:
+            budget[1] = max(budget[1] - n_runs, 0)
+
+
 def limit_number_of_runs(check, my_auth):
     """Checks the number of workflow runs started in the past 6h. Return the
     number of remaining runs before hitting the rate limit of pulls from Docker
     Hub. This is currently 200 every 6 hours."""
-    n_runs_max = 180  # this is set below the actual limit, since only a few workflows check this before running
-    statuses = ['in review by lab', 'deleted', 'pre-release', 'released to project', 'released']
-    query = '/search/?type=WorkflowRunAwsem' + ''.join(['&status=' + s for s in statuses])
-    six_h_ago = datetime.now(timezone.utc) - timedelta(hours=6)
-    query += '&date_created.from=' + datetime.strftime(six_h_ago, "%Y-%m-%d %H:%M")
-    recent_runs = ff_utils.search_metadata(query, key=my_auth)
-    n_runs_available = max(n_runs_max - len(recent_runs), 0)  # no negative results
+    n_runs_available = get_run_budget(my_auth)
     if n_runs_available == 0:
         check.status = 'PASS'
         check.brief_output = ['Waiting (max 6h) due to Docker Hub rate limit']
@@ -2074,17 +2400,73 @@ def limit_number_of_runs(check, my_auth):
     return check, n_runs_available
 
 
-def prereleased_and_not_uploaded(connection, filemeta):
+class S3KeyIndex(object):
+    """Answers whether keys exist on s3 buckets from memory, for all the files of a check run.
+    prepare checks many keys of a bucket at once: small sets with concurrent HEAD requests,
+    large sets by listing the whole bucket with paged ListObjectsV2 requests.
+    Keys that were not prepared are checked with a HEAD request on first lookup"""
+    list_threshold = 2000
+    workers = 16
+
+    def __init__(self, s3_util):
+        self.s3_util = s3_util
+        self.listed = {}  # bucket -> all keys of the bucket
+        self.checked = {}  # bucket -> {key: exists}
+
+    def _head(self, key, bucket):
+        return bool(self.s3_util.does_key_exist(key, bucket, False))
+
+    def _list_bucket(self, bucket):
+        keys = set()
+        for page in self.s3_util.s3.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+            keys.update(obj['Key'] for obj in page.get('Contents', []))
+        self.listed[bucket] = keys
+
+    def prepare(self, keys, bucket):
+        if bucket in self.listed:
+            return
+        checked = self.checked.setdefault(bucket, {})
+        keys = [k for k in set(keys) if k and k not in checked]
+        if len(keys) > self.list_threshold:
+            self._list_bucket(bucket)
+        elif keys:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                checked.update(zip(keys, executor.map(lambda k: self._head(k, bucket), keys)))
+
+    def exists(self, key, bucket):
+        if not key:
+            return False
+        if bucket in self.listed:
+            return key in self.listed[bucket]
+        checked = self.checked.setdefault(bucket, {})
+        if key not in checked:
+            checked[key] = self._head(key, bucket)
+        return checked[key]
+
+
+def prereleased_and_not_uploaded(connection, filemeta, key_index=None):
     """Check if a file is pre-released and not uploaded yet.
     This should only happen for files that are to be restricted status upon release.
     Some files with pipelines will be uploaded so should have the usual basic QC run on them,
     however, there will be cases where there is no processing pipeline so no need to upload the 
-    raw files and so the md5, fastq_first_line and fastQC can be skipped"""
+    raw files and so the md5, fastq_first_line and fastQC can be skipped
+    Pass a S3KeyIndex to check many files against the same index"""
     statuses_to_check = ['pre-release', 'restricted']
     if filemeta.get('status') not in statuses_to_check:
         return False
-    my_s3_util = s3Utils(env=connection.ff_env)
-    if not my_s3_util.does_key_exist(filemeta.get('upload_key'), my_s3_util.raw_file_bucket, False):
+    if key_index is None:
+        key_index = S3KeyIndex(connection.ff_s3)
+    if not key_index.exists(filemeta.get('upload_key'), connection.ff_s3.raw_file_bucket):
         # if the file is not in the raw bucket, it is not uploaded
         return True
     return False
+
+
+def remove_prereleased_and_not_uploaded(connection, files, key_index=None):
+    """Remove the pre-released files that are not uploaded yet (see prereleased_and_not_uploaded),
+    checking the raw bucket for all of them at once"""
+    if key_index is None:
+        key_index = S3KeyIndex(connection.ff_s3)
+    key_index.prepare([f.get('upload_key') for f in files if f.get('status') in ['pre-release', 'restricted']],
+                      connection.ff_s3.raw_file_bucket)
+    return [f for f in files if not prereleased_and_not_uploaded(connection, f, key_index)]
@@ -16,23 +16,15 @@ pairs_mapper = {"GRCh38": "hg38",
                 "GRCz11": "danRer11"}
 
 
-def step_settings(step_name, my_organism, attribution, overwrite=None):
-    """Return a setting dict for given step, and modify variables in
-    output files; genome assembly, file_type, desc, contributing lab.
-    overwrite is a dictionary, if given will overwrite keys in resulting template
-    overwrite = {'config': {"a": "b"},
-                 'parameters': {'c': "d"}
-                    }
-    """
-    genome = ""
-    genome = mapper.get(my_organism)
-    pairs_assembly = pairs_mapper.get(genome)
+# placeholders in the templates, replaced with the assemblies of the organism by step_settings
+GENOME = '<genome_assembly>'
+PAIRS_ASSEMBLY = '<pairs_assembly>'
 
-    out_n = "This is an output file of the Hi-C processing pipeline"
-    int_n = "This is an intermediate file in the HiC processing pipeline"
-    # int_n_rep = "This is an intermediate file in the Repliseq processing pipeline"
+out_n = "This is an output file of the Hi-C processing pipeline"
+int_n = "This is an intermediate file in the HiC processing pipeline"
+# int_n_rep = "This is an intermediate file in the Repliseq processing pipeline"
 
-    wf_dict = [
+wf_templates = [
     {
         'app_name': 'md5',
         'workflow_uuid': 'c77a117b-9a58-477e-aaa5-291a109a99f6',
@@ -62,7 +54,7 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         'parameters': {"nThreads": 16},
         'custom_pf_fields': {
             'out_bam': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'intermediate file',
                 'description': int_n}
         }
@@ -73,11 +65,11 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         'parameters': {"nthreads_merge": 16, "nthreads_parse_sort": 16},
         'custom_pf_fields': {
             'annotated_bam': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'alignments',
                 'description': out_n},
             'filtered_pairs': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'contact list-replicate',
                 'description': out_n}
         }
@@ -93,15 +85,15 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
                        },
         'custom_pf_fields': {
             'hic': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'contact matrix',
                 'description': out_n},
             'mcool': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'contact matrix',
                 'description': out_n},
             'merged_pairs': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'contact list-combined',
                 'description': out_n}
         }
@@ -113,7 +105,7 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         'parameters': {"nThreads": 4},
         'custom_pf_fields': {
             'out_bam': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'alignments',
                 'description': "This is an alignment file for fastq pairs from the MARGI processing pipeline"}
         }
@@ -122,14 +114,14 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         'app_name': 'imargi-processing-bam',
         'workflow_uuid': '4918e659-6e6c-444f-93c4-276c0d753537',
         'config': {'mem': 8, 'cpu': 8, 'ebs_size': '10x', 'EBS_optimized': 'true'},
-        'parameters': {"nthreads": 8, "assembly": pairs_assembly},
+        'parameters': {"nthreads": 8, "assembly": PAIRS_ASSEMBLY},
         'custom_pf_fields': {
             'out_qc': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'QC',
                 'description': 'This is an output file of the MARGI processing pipeline'},
             'out_pairs': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'contact list-replicate',
                 'description': 'This is an output file of the MARGI processing pipeline'}
         }
@@ -140,11 +132,11 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         'config': {'mem': 8, 'cpu': 4, 'ebs_size': '10x', 'EBS_optimized': 'true'},
         'custom_pf_fields': {
             'out_mcool': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'contact matrix',
                 'description': 'This is an output file of the MARGI processing pipeline'},
             'merged_pairs': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'contact list-combined',
                 'description': 'This is an output file of the MARGI processing pipeline'}
         }
@@ -155,15 +147,15 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "parameters": {"nthreads": 4, "memperthread": "2G"},
         'custom_pf_fields': {
             'filtered_sorted_deduped_bam': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'alignments',
                 'description': 'This is an output file of the RepliSeq processing pipeline'},
             'count_bg_rpkm': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'normalized counts',
                 'description': 'read counts, unfiltered RPKM'},
             'count_bg': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'counts',
                 'description': 'read counts, unfiltered, unnormalized'}
         }
@@ -192,7 +184,7 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "parameters": {},
         'custom_pf_fields': {
             'merged_fastq': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'reads-combined',
                 'description': 'Merged fastq file'
             }
@@ -205,12 +197,12 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {"ebs_size": 70},
         'custom_pf_fields': {
             'chip.first_ta': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read positions',
                 'description': 'Positions of aligned reads in bed format, one line per read mate, for control experiment, from ENCODE ChIP-Seq Pipeline'
             },
             'chip.first_ta_xcor': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'intermediate file',
                 'description': 'Counts file used only for QC'
             }
@@ -223,7 +215,7 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config":{"instance_type": 'c5.2xlarge', "ebs_size": 70},
         'custom_pf_fields': {
             'chip.first_ta': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read positions',
                 'description': 'Positions of aligned reads in bed format, one line per read mate, for control experiment, from ENCODE ChIP-Seq Pipeline',
                 'disable_wfr_inputs': True}
@@ -236,15 +228,15 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {"instance_type": "c5.2xlarge", "ebs_size": 120},
         'custom_pf_fields': {
             'chip.optimal_peak': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'peaks',
                 'description': 'Peak calls from ENCODE ChIP-Seq Pipeline'},
             'chip.conservative_peak': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'conservative peaks',
                 'description': 'Conservative peak calls from ENCODE ChIP-Seq Pipeline'},
             'chip.fc_bw': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'signal fold change',
                 'description': 'ChIP-seq signal fold change over input control'}
         }
@@ -256,7 +248,7 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {},
         'custom_pf_fields': {
             'atac.first_ta': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read positions',
                 'description': 'Positions of aligned reads in bed format, one line per read mate, from ENCODE ATAC-Seq Pipeline'}
         }
@@ -268,15 +260,15 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {},
         'custom_pf_fields': {
             'atac.optimal_peak': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'peaks',
                 'description': 'Peak calls from ENCODE ATAC-Seq Pipeline'},
             'atac.conservative_peak': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'conservative peaks',
                 'description': 'Conservative peak calls from ENCODE ATAC-Seq Pipeline'},
             'atac.sig_fc': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'signal fold change',
                 'description': 'ATAC-seq signal fold change'}
         }
@@ -288,7 +280,7 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {"mem": 2, "cpu": 2},
         'custom_pf_fields': {
             'merged_bed': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read positions',
                 'description': 'Merged file, positions of aligned reads in bed format, one line per read mate'}
         }
@@ -300,11 +292,11 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {'mem': 32},
         'custom_pf_fields': {
             'bwfile': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'insulation score-diamond',
                 'description': 'Diamond insulation scores calls on Hi-C contact matrices'},
             'bedfile': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'boundaries',
                 'description': 'Boundaries calls on Hi-C contact matrices'}
         }
@@ -316,7 +308,7 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {'mem': 4, 'cpu': 1, 'ebs_size': '1.1x', 'EBS_optimized': 'false'},
         'custom_pf_fields': {
             'bwfile': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'compartments',
                 'description': 'Compartments signals on Hi-C contact matrices'}
         },
@@ -338,27 +330,27 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "config": {"instance_type": ["m5a.4xlarge", "m6a.4xlarge"]},
         'custom_pf_fields': {
             'rna.outbam': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read positions',
                 'description': 'Output file from RNA seq pipeline'
             },
             'rna.plusbw': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read counts (plus)',
                 'description': 'Output file from RNA seq pipeline'
             },
             'rna.minusbw': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read counts (minus)',
                 'description': 'Output file from RNA seq pipeline'
             },
             'rna.gene_expression': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'gene expression',
                 'description': 'Output file from RNA seq pipeline'
             },
             'rna.isoform_expression': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'isoform expression',
                 'description': 'Output file from RNA seq pipeline'
             }
@@ -374,22 +366,22 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         },
         'custom_pf_fields': {
             'rna.outbam': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read positions',
                 'description': 'Output file from RNA seq pipeline'
             },
             'rna.outbw': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'read counts',
                 'description': 'Output file from RNA seq pipeline'
             },
             'rna.gene_expression': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'gene expression',
                 'description': 'Output file from RNA seq pipeline'
             },
             'rna.isoform_expression': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': 'isoform expression',
                 'description': 'Output file from RNA seq pipeline'
             }
@@ -435,33 +427,83 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
         "parameters": {},
         'custom_pf_fields': {
             '': {
-                'genome_assembly': genome,
+                'genome_assembly': GENOME,
                 'file_type': '',
                 'description': ''}
         }
     }]
 
-    template = [i for i in wf_dict if i['app_name'] == step_name][0]
+# added to the config of all templates, unless the template sets them
+update_config = {
+    "ebs_type": "gp2",
+    "spot_instance": False,
+    "ebs_iops": "",
+    "log_bucket": "tibanna-output",
+    "key_name": "4dn-encode",
+    "public_postrun_json": True,
+    "behavior_on_capacity_limit": "retry_without_spot"
+}
+template_keys = ['app_name', 'workflow_uuid', 'config', 'parameters', 'custom_pf_fields', 'overwrite_input_extra']
+
+
+def validate_template(template):
+    """Raise a ValueError if a workflow template is malformed"""
+    if not isinstance(template, dict):
+        raise ValueError('Workflow template should be a dict: %s' % template)
+    name = template.get('app_name')
+    if not isinstance(name, str) or not isinstance(template.get('workflow_uuid'), str):
+        raise ValueError('Workflow template needs app_name and workflow_uuid: %s' % template)
+    unknown = [key for key in template if key not in template_keys]
+    if unknown:
+        raise ValueError('Unknown keys %s in workflow template %s' % (unknown, name))
+    for key in ['config', 'parameters', 'custom_pf_fields']:
+        if not isinstance(template.get(key, {}), dict):
+            raise ValueError('%s of workflow template %s should be a dict' % (key, name))
+    for arg_name, pf_fields in template.get('custom_pf_fields', {}).items():
+        if not isinstance(pf_fields, dict):
+            raise ValueError('custom_pf_fields of %s in workflow template %s should be a dict' % (arg_name, name))
+
+
+def build_step_templates(templates):
+    """Validate the templates and return them by app_name, with the default config and parameters"""
+    registry = {}
+    for template in templates:
+        validate_template(template)
+        if template['app_name'] in registry:
+            raise ValueError('Duplicate workflow template %s' % template['app_name'])
+        template = dict(template)
+        config = template.get('config') or {}
+        template['config'] = dict(config, **{key: val for key, val in update_config.items() if key not in config})
+        template['parameters'] = template.get('parameters') or {}
+        registry[template['app_name']] = template
+    return registry
 
-    update_config = {
-        "ebs_type": "gp2",
-        "spot_instance": False,
-        "ebs_iops": "",
-        "log_bucket": "tibanna-output",
-        "key_name": "4dn-encode",
-        "public_postrun_json": True,
-        "behavior_on_capacity_limit": "retry_without_spot"
-    }
-    if template.get('config'):
-        temp_conf = template['config']
-        for a_key in update_config:
-            if a_key not in temp_conf:
-                temp_conf[a_key] = update_config[a_key]
-    else:
-        template['config'] = update_config
 
-    if not template.get('parameters'):
-        template['parameters'] = {}
+step_templates = build_step_templates(wf_templates)
+
+
+def fill_template(value, placeholders):
+    """Return a copy of a template with the placeholders (strings) replaced with their values"""
+    if isinstance(value, dict):
+        return {key: fill_template(val, placeholders) for key, val in value.items()}
+    if isinstance(value, list):
+        return [fill_template(val, placeholders) for val in value]
+    if isinstance(value, str):
+        return placeholders.get(value, value)
+    return value
+
+
+def step_settings(step_name, my_organism, attribution, overwrite=None):
+    """Return a setting dict for given step, and modify variables in
+    output files; genome assembly, file_type, desc, contributing lab.
+    overwrite is a dictionary, if given will overwrite keys in resulting template
+    overwrite = {'config': {"a": "b"},
+                 'parameters': {'c': "d"}
+                    }
+    """
+    genome = mapper.get(my_organism)
+    pairs_assembly = pairs_mapper.get(genome)
+    template = fill_template(step_templates[step_name], {GENOME: genome, PAIRS_ASSEMBLY: pairs_assembly})
     template['common_fields'] = attribution
     if overwrite:
         for a_key in overwrite:
@@ -6,12 +6,14 @@ import time
 import uuid
 from urllib.parse import urlparse
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 
 # Use confchecks to import decorators object and its methods for each check module
 # rather than importing check_function, action_function, CheckResult, ActionResult
 # individually - they're now part of class Decorators in foursight-core::decorators
 # that requires initialization with foursight prefix.
 from .helpers.confchecks import *
+from .helpers import higlass_utils
 
 
 def get_reference_files(connection):
@@ -1618,6 +1620,7 @@ def files_not_registered_with_higlass(connection, **kwargs):
     all_valid_types = valid_filetypes["raw"] + valid_filetypes["proc"]
 
     files_to_be_reg = {}
+    candidates = []
     not_found_upload_key = []
     not_found_s3 = []
     no_genome_assembly = []
@@ -1645,15 +1648,6 @@ def files_not_registered_with_higlass(connection, **kwargs):
         "proc": None,
     }
 
-    ''' small helper function to check urls are valid
-    '''
-    def does_url_exist(path):
-        try:
-            r = requests.head(path)
-            return r.status_code == requests.codes.ok
-        except Exception:
-            return False
-
     for file_cat, filetypes in valid_filetypes.items():
         # If the user specified a filetype, only use that one.
         filetypes_to_use = [f for f in filetypes if search_all_filetypes or f == kwargs['filetype']]
@@ -1771,7 +1765,7 @@ def files_not_registered_with_higlass(connection, **kwargs):
                     not_found_upload_key.append(file_info['accession'])
                     continue
 
-            # make sure file exists on s3
+            # s3 and higlass are checked below for all files at once
             typebucket_by_cat = {
                 "raw": connection.ff_s3.raw_file_bucket,
                 "proc": connection.ff_s3.outfile_bucket,
@@ -1783,33 +1777,48 @@ def files_not_registered_with_higlass(connection, **kwargs):
 
                     # If the URL points to the files folder, it is a reference file. However, the extra files live in the wfoutput folder
                     file_info['open_data_url'] = file_info['open_data_url'].replace("/files/", "/wfoutput/")
-                if not does_url_exist(file_info['open_data_url']):
+            else:
+                file_info['bucket'] = typebucket_by_cat[current_file_cat]
+            candidates.append(file_info)
+
+        if time_expired:
+            break
+
+    def exists_on_s3(file_info):
+        if file_info.get('open_data_url') is not None:
+            return higlass_utils.does_url_exist(session, file_info['open_data_url'])
+        return bool(connection.ff_s3.does_key_exist(file_info['upload_key'], bucket=file_info['bucket']))
+
+    # make sure files exist on s3, then check for higlass_uid and, if confirm_on_higlass is True,
+    # check the higlass server. Requests are made concurrently, over one pool of connections,
+    # for a chunk of files at a time so we can stop at the time limit
+    chunk_size = 500
+    with higlass_utils.pooled_session() as session, \
+            ThreadPoolExecutor(max_workers=higlass_utils.probe_workers) as executor:
+        for i in range(0, len(candidates), chunk_size):
+            if kwargs['time_limit'] and time.time() - start_time > kwargs['time_limit']:
+                time_expired = True
+                break
+            chunk = candidates[i:i + chunk_size]
+            on_s3 = list(executor.map(exists_on_s3, chunk))
+            unregistered = set()
+            if kwargs['confirm_on_higlass'] is True:
+                registered = [f for f, found in zip(chunk, on_s3) if found and f.get('higlass_uid')]
+                # Chromsize files use a different URL
+                chromsizes = [f['higlass_uid'] for f in registered if f['file_format'] == 'chromsizes']
+                tilesets = [f['higlass_uid'] for f in registered if f['file_format'] != 'chromsizes']
+                for uid, found in zip(chromsizes, executor.map(
+                        lambda uid: higlass_utils.is_chromsizes_registered(session, higlass_server, uid), chromsizes)):
+                    if not found:
+                        unregistered.add(uid)
+                unregistered.update(higlass_utils.find_unregistered_tilesets(session, higlass_server, tilesets))
+            for file_info, found in zip(chunk, on_s3):
+                file_info.pop('bucket', None)
+                if not found:
                     not_found_s3.append(file_info)
                     continue
-            elif not connection.ff_s3.does_key_exist(file_info['upload_key'], bucket=typebucket_by_cat[current_file_cat]):
-                not_found_s3.append(file_info)
-                continue
-
-            # check for higlass_uid and, if confirm_on_higlass is True, check the higlass server
-            if file_info.get('higlass_uid'):
-                if kwargs['confirm_on_higlass'] is True:
-                    # Chromsize files use a different URL
-                    if procfile['file_format'].get('file_format') == "chromsizes":
-                        higlass_get = higlass_server + '/api/v1/chrom-sizes/?id=%s' % file_info['higlass_uid']
-                        hg_res = requests.get(higlass_get)
-                        if hg_res.status_code >= 400:
-                            files_to_be_reg[file_format].append(file_info)
-                    else:
-                        higlass_get = higlass_server + '/api/v1/tileset_info/?d=%s' % file_info['higlass_uid']
-                        hg_res = requests.get(higlass_get)
-
-                        # Make sure the response completed successfully and did not return an error.
-                        if hg_res.status_code >= 400:
-                            files_to_be_reg[file_format].append(file_info)
-                        elif 'error' in hg_res.json().get(file_info['higlass_uid'], {}):
-                            files_to_be_reg[file_format].append(file_info)
-            else:
-                files_to_be_reg[file_format].append(file_info)
+                if not file_info.get('higlass_uid') or file_info['higlass_uid'] in unregistered:
+                    files_to_be_reg[file_info['file_format']].append(file_info)
 
     check.full_output = {'files_not_registered': files_to_be_reg,
                          'files_without_upload_key': not_found_upload_key,
@@ -1848,12 +1857,62 @@ def files_not_registered_with_higlass(connection, **kwargs):
     check.action_message = "Will attempt to patch higlass_uid for %s files." % file_count
     return check
 
+
+def get_higlass_registration_payload(connection, ftype, hit):
+    """
+    Based on the filetype, construct a payload to upload to the higlass server.
+    Returns None if the filetype can not be registered.
+    """
+    payload = {}
+    payload['coordSystem'] = hit['genome_assembly']
+    raw_bucket_types = ['chromsizes', 'beddb']
+    out_bucket_types = ['mcool', 'bg', 'bw', 'bigbed', 'bed']
+    if 'open_data_url' in hit and hit.get('open_data_url') is not None:
+        # The expected file path format is: bucket/upload_key
+        url_parsed = urlparse(hit.get('open_data_url'))
+        bucket = url_parsed.netloc.split('.')[0] #subdomain
+        file_path = bucket + url_parsed.path
+        payload["filepath"] = file_path
+    else:
+        if ftype in raw_bucket_types:
+            payload["filepath"] = connection.ff_s3.raw_file_bucket + "/" + hit['upload_key']
+        elif ftype in out_bucket_types:
+            payload["filepath"] = connection.ff_s3.outfile_bucket + "/" + hit['upload_key']
+
+    if ftype == 'chromsizes':
+        payload['filetype'] = 'chromsizes-tsv'
+        payload['datatype'] = 'chromsizes'
+    elif ftype == 'beddb':
+        payload['filetype'] = 'beddb'
+        payload['datatype'] = 'gene-annotation'
+    elif ftype == 'mcool':
+        payload['filetype'] = 'cooler'
+        payload['datatype'] = 'matrix'
+    elif ftype in ['bg', 'bw', 'bigbed']:
+        # bigbeds can be registered the same way as bigwigs
+        payload['filetype'] = 'bigwig'
+        payload['datatype'] = 'vector'
+    elif ftype == 'bed' and hit['upload_key'].endswith(".bed.multires.mv5"):
+        payload['filetype'] = 'multivec'
+        payload['datatype'] = 'multivec'
+    elif ftype == 'bed':
+        payload['filetype'] = 'beddb'
+        payload['datatype'] = 'bedlike'
+    else:
+        return None
+    return payload
+
+
 @action_function(file_accession=None, force_new_higlass_uid=False, time_limit=870)
 def patch_file_higlass_uid(connection, **kwargs):
     """
     After running "files_not_registered_with_higlass",
     Try to register files with higlass.
 
+    Files are registered by a pool of workers, retrying with exponential backoff
+    on higlass server errors. The new higlass_uids are then patched to Fourfront.
+    The outcome for each file is in the 'files' part of the output.
+
     Set `time_limit` kwarg to 0 or None to disable time limit.
 
     Args:
@@ -1872,7 +1931,9 @@ def patch_file_higlass_uid(connection, **kwargs):
         'registration_failure': {},
         'registration_success': 0,
         'beddb_copy_failure': {},
-        'beddb_copy_success': 0
+        'beddb_copy_success': 0,
+        'files': {},
+        'time_expired': False
     }
     # get latest results
     higlass_check = CheckResult(connection, 'files_not_registered_with_higlass')
@@ -1897,123 +1958,118 @@ def patch_file_higlass_uid(connection, **kwargs):
 
     # Keep track of how long this task has lasted.
     start_time = time.time()
-    time_expired = False
 
-    # Files to register is organized by filetype.
-    to_be_registered = higlass_check_result.get('full_output', {}).get('files_not_registered')
-    for ftype, hits in to_be_registered.items():
-        if time_expired:
-            break
-        for hit in hits:
-            if kwargs['time_limit'] and time.time() - start_time > kwargs['time_limit']:
-                time_expired = True
-                break
-
-            # If a file accession was specified, skip all others
-            if kwargs['file_accession'] and hit['accession'] != kwargs['file_accession']:
-                continue
-
-            # Based on the filetype, construct a payload to upload to the higlass server.
-            payload = {}
-            payload['coordSystem'] = hit['genome_assembly']
-            raw_bucket_types = ['chromsizes', 'beddb']
-            out_bucket_types = ['mcool', 'bg', 'bw', 'bigbed', 'bed']
-            if 'open_data_url' in hit and hit.get('open_data_url') is not None:
-                # The expected file path format is: bucket/upload_key
-                od_url = hit.get('open_data_url')
-                url_parsed = urlparse(hit.get('open_data_url'))
-                bucket = url_parsed.netloc.split('.')[0] #subdomain
-                file_path = bucket + url_parsed.path
-                payload["filepath"] = file_path
-            else:
-                if ftype in raw_bucket_types:
-                    payload["filepath"] = connection.ff_s3.raw_file_bucket + "/" + hit['upload_key']
-                elif ftype in out_bucket_types:
-                    payload["filepath"] = connection.ff_s3.outfile_bucket + "/" + hit['upload_key']
-
-            if ftype == 'chromsizes':
-                payload['filetype'] = 'chromsizes-tsv'
-                payload['datatype'] = 'chromsizes'
-            elif ftype == 'beddb':
-                payload['filetype'] = 'beddb'
-                payload['datatype'] = 'gene-annotation'
-            elif ftype == 'mcool':
-                payload['filetype'] = 'cooler'
-                payload['datatype'] = 'matrix'
-            elif ftype in ['bg', 'bw', 'bigbed']:
-                # bigbeds can be registered the same way as bigwigs
-                payload['filetype'] = 'bigwig'
-                payload['datatype'] = 'vector'
-            elif ftype == 'bed' and hit['upload_key'].endswith(".bed.multires.mv5"):
-                payload['filetype'] = 'multivec'
-                payload['datatype'] = 'multivec'
-            elif ftype == 'bed':
-                payload['filetype'] = 'beddb'
-                payload['datatype'] = 'bedlike'
+    def time_expired():
+        return kwargs['time_limit'] and time.time() - start_time > kwargs['time_limit']
+
+    def register_file(ftype, hit, payload):
+        """ Register one file on the higlass server and return its outcome """
+        outcome = {'file_format': ftype}
+        if time_expired():
+            outcome['registration'] = 'not attempted, time limit reached'
+            return outcome
+        # Call the Flask server component on the Higlass server to copy beddb files
+        # from S3 to the local file system. Using mounted versions of these files is very slow.
+        if payload['filetype'] == 'beddb':
+            try:
+                copy_res = higlass_utils.post_with_backoff(session, higlass_server + ':8005/cp/' + payload["filepath"])
+            except Exception as e:
+                outcome['beddb_copy_failure'] = str(e)
             else:
-                err_msg = 'No filetype case specified for %s' % ftype
-                action_logs['registration_failure'][hit['accession']] = err_msg
-                continue
-
-            # Call the Flask server component on the Higlass server to copy beddb files
-            # from S3 to the local file system. Using mounted versions of these files is very slow.
-            if payload['filetype'] == 'beddb':
-                copy_res = requests.post(
-                    higlass_server + ':8005/cp/' + payload["filepath"]
-                )
-
                 if copy_res.status_code == 200:
                     # If copying has been successful, we point to the local file
                     payload["filepath"] = "beddbs/" + payload["filepath"]
-                    action_logs['beddb_copy_success'] += 1
+                    outcome['beddb_copy'] = 'success'
                 else:
-                    try:
-                        err_msg = copy_res.text
-                        action_logs['beddb_copy_failure'][hit['accession']] = err_msg
-                    except Exception:
-                        err_msg = copy_res.status_code
-                        action_logs['beddb_copy_failure'][hit['accession']] = err_msg
-
-
-            # register with previous higlass_uid if already there
-            # otherwise, specify our own new higlass_uid with slugid
-            if hit.get('higlass_uid') and not kwargs['force_new_higlass_uid']:
-                payload['uuid'] = hit['higlass_uid']
-            else:
-                payload['uuid'] = str(uuid.uuid4())
+                    outcome['beddb_copy_failure'] = copy_res.text or copy_res.status_code
+
+        # register with previous higlass_uid if already there
+        # otherwise, specify our own new higlass_uid with slugid
+        if hit.get('higlass_uid') and not kwargs['force_new_higlass_uid']:
+            payload['uuid'] = hit['higlass_uid']
+        else:
+            payload['uuid'] = str(uuid.uuid4())
 
-            res = requests.post(
+        try:
+            res = higlass_utils.post_with_backoff(
+                session,
                 higlass_server + '/api/v1/link_tile/',
                 data=json.dumps(payload),
                 auth=authentication,
                 headers=headers
             )
+        except Exception as e:
+            outcome['registration'] = 'failure'
+            outcome['error'] = str(e)
+            return outcome
+        if res.status_code == 201:
+            outcome['registration'] = 'success'
+            # Get higlass's uuid. This is Fourfront's higlass_uid.
+            outcome['higlass_uid'] = res.json()['uuid']
+        else:
+            # Add reason for failure. res.json not available on 500 resp
+            try:
+                err_msg = res.json().get("error", res.status_code)
+            except Exception:
+                err_msg = res.status_code
+            outcome['registration'] = 'failure'
+            outcome['error'] = err_msg
+        return outcome
 
-            # update the metadata file as well, if uid wasn't already present or changed
-            if res.status_code == 201:
-                action_logs['registration_success'] += 1
-                # Get higlass's uuid. This is Fourfront's higlass_uid.
-                response_higlass_uid = res.json()['uuid']
-
-                if 'higlass_uid' not in hit or hit['higlass_uid'] != response_higlass_uid:
-                    patch_data = {'higlass_uid': response_higlass_uid}
-                    try:
-                        ff_utils.patch_metadata(patch_data, obj_id=hit['uuid'], key=connection.ff_keys)
-                    except Exception as e:
-                        action_logs['patch_failure'][hit['accession']] = "{type}: {message}".format(
-                            type = type(e),
-                            message = str(e)
-                        )
-                        pass
-                    else:
-                        action_logs['patch_success'][hit['accession']] = response_higlass_uid
-            else:
-                # Add reason for failure. res.json not available on 500 resp
-                try:
-                    err_msg = res.json().get("error", res.status_code)
-                except Exception:
-                    err_msg = res.status_code
+    # Files to register is organized by filetype.
+    to_be_registered = higlass_check_result.get('full_output', {}).get('files_not_registered')
+    registrations = []
+    for ftype, hits in to_be_registered.items():
+        for hit in hits:
+            # If a file accession was specified, skip all others
+            if kwargs['file_accession'] and hit['accession'] != kwargs['file_accession']:
+                continue
+            payload = get_higlass_registration_payload(connection, ftype, hit)
+            if payload is None:
+                err_msg = 'No filetype case specified for %s' % ftype
                 action_logs['registration_failure'][hit['accession']] = err_msg
+                action_logs['files'][hit['accession']] = {'file_format': ftype, 'registration': 'failure', 'error': err_msg}
+                continue
+            registrations.append((ftype, hit, payload))
+
+    # registration phase
+    with higlass_utils.pooled_session() as session, \
+            ThreadPoolExecutor(max_workers=higlass_utils.probe_workers) as executor:
+        outcomes = list(executor.map(lambda args: register_file(*args), registrations))
+
+    # patch phase, update the metadata file as well, if uid wasn't already present or changed
+    to_patch = []
+    for (ftype, hit, payload), outcome in zip(registrations, outcomes):
+        action_logs['files'][hit['accession']] = outcome
+        if 'beddb_copy_failure' in outcome:
+            action_logs['beddb_copy_failure'][hit['accession']] = outcome['beddb_copy_failure']
+        elif 'beddb_copy' in outcome:
+            action_logs['beddb_copy_success'] += 1
+        if outcome['registration'] == 'success':
+            action_logs['registration_success'] += 1
+            if 'higlass_uid' not in hit or hit['higlass_uid'] != outcome['higlass_uid']:
+                to_patch.append((hit, outcome))
+        elif outcome['registration'] == 'failure':
+            action_logs['registration_failure'][hit['accession']] = outcome['error']
+        else:
+            action_logs['time_expired'] = True
+
+    def patch_higlass_uid(hit, outcome):
+        try:
+            ff_utils.patch_metadata({'higlass_uid': outcome['higlass_uid']}, obj_id=hit['uuid'], key=connection.ff_keys)
+        except Exception as e:
+            return "{type}: {message}".format(type=type(e), message=str(e))
+        return None
+
+    with ThreadPoolExecutor(max_workers=higlass_utils.probe_workers) as executor:
+        patch_errors = list(executor.map(lambda args: patch_higlass_uid(*args), to_patch))
+    for (hit, outcome), error in zip(to_patch, patch_errors):
+        if error:
+            outcome['patch'] = 'failure'
+            action_logs['patch_failure'][hit['accession']] = error
+        else:
+            outcome['patch'] = 'success'
+            action_logs['patch_success'][hit['accession']] = outcome['higlass_uid']
     action.status = 'DONE'
     action.output = action_logs
     return action
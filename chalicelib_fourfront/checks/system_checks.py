@@ -1,9 +1,14 @@
+import bisect
 import requests
 import json
 import datetime
 import boto3
 import time
+import threading
 import geocoder
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from requests.adapters import HTTPAdapter
 from foursight_core.stage import Stage
 from foursight_core.checks.helpers.sys_utils import (
     parse_datetime_to_utc,
@@ -16,6 +21,7 @@ from dcicutils import (
     env_utils
 )
 from chalicelib_fourfront.checks.helpers.es_utils import get_es_metadata
+from .helpers import cache_utils, patch_utils
 
 # Use confchecks to import decorators object and its methods for each check module
 # rather than importing check_function, action_function, CheckResult, ActionResult
@@ -668,12 +674,65 @@ def snapshot_rds(connection, **kwargs):
     return check
 
 
+# days that a looked up IP location is reused by process_download_tracking_items
+ip_geo_ttl_days = 30
+# number of IP locations looked up at the same time (ipinfo rate limits bursts)
+geo_workers = 3
+
+
+def lookup_ip_geo(session, ip, rate_limited=None):
+    """Return the location of an IP address as 'city//country', or None if the lookup failed.
+    Sets the rate_limited event if the service answered 429"""
+    try:
+        geo = geocoder.ip(ip, session=session)
+    except Exception:
+        return None
+    if not geo.ok:
+        if rate_limited is not None and getattr(geo, 'status_code', None) == 429:
+            rate_limited.set()
+        return None
+    geo_country = getattr(geo, 'country') or 'Unknown'
+    geo_city = getattr(geo, 'city') or 'Unknown'
+    geo_state = getattr(geo, 'state', None)
+    if geo_state:
+        geo_city = ', '.join([geo_city, geo_state])
+    return '//'.join([geo_city, geo_country])
+
+
+def resolve_ip_geo(ips, time_limit, start=None, workers=geo_workers):
+    """Look up the locations of IP addresses concurrently, with a shared persistent connection.
+    No lookup is started time_limit seconds after start (default: now), or once the service
+    rate limited a lookup. Returns {ip: 'city//country' or None if not looked up or failed}"""
+    start = time.time() if start is None else start
+    ips = list(ips)
+    rate_limited = threading.Event()
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        def lookup(ip):
+            if rate_limited.is_set() or time.time() - start > time_limit:
+                return None
+            return lookup_ip_geo(session, ip, rate_limited)
+
+        return dict(zip(ips, executor.map(lookup, ips)))
+
+
+def in_range_window(dates, date, window):
+    """True if sorted list dates has a date less than window (a timedelta) before or after date"""
+    idx = bisect.bisect_left(dates, date)
+    return ((idx < len(dates) and dates[idx] - date < window) or
+            (idx > 0 and date - dates[idx - 1] < window))
+
+
 # @check_function()
 def process_download_tracking_items(connection, **kwargs):
     """
     Do a few things here, and be mindful of the 5min lambda limit.
     - Consolidate tracking items with download_tracking.range_query=True
-    - Change remote_ip to geo_country and geo_city
+    - Change remote_ip to geo_country and geo_city (IP locations are cached for ip_geo_ttl_days).
+      Items whose IP location could not be looked up are left for the next run
     - If the user_agent looks to be a bot, set status=deleted
     - Change unused range query items to status=deleted
     """
@@ -709,7 +768,16 @@ def process_download_tracking_items(connection, **kwargs):
         else:
             range_cache[range_key] = [parsed_date]
     del cons_query
-    ip_cache = {}
+    # keep the dates of each key sorted, to find the ones close to an item by bisection
+    for range_dates in range_cache.values():
+        range_dates.sort()
+    range_window = datetime.timedelta(hours=range_consolidation_hrs)
+    # locations of IPs from previous runs, as {ip: ['city//country', date looked up]}
+    now = datetime.datetime.utcnow()
+    geo_expiry = (now - datetime.timedelta(days=ip_geo_ttl_days)).isoformat()
+    ip_cache = {ip: value for ip, value in
+                cache_utils.get_cache(connection, 'process_download_tracking_items', 'ip_geo').items()
+                if value[1] > geo_expiry}
     time_limit = 270  # 4.5 minutes
     # list of strings used to flag user_agent as a bot. By no means complete
     bot_agents = ['bot', 'crawl', 'slurp', 'spider', 'mediapartners', 'ltx71']
@@ -720,7 +788,7 @@ def process_download_tracking_items(connection, **kwargs):
     # batch large groups of tracking items at once to save time with geocoder
     # for now, this function will process only <search_limit> results.
     # I would love to use a generator, but search results change as items are indexed...
-    search_limit = 1000
+    search_limit = 3000
     search_query = ''.join(['search/?type=TrackingItem&tracking_type=download_tracking',
                             '&download_tracking.geo_country=No+value',
                             '&status=in+review+by+lab&sort=-date_created&limit=', str(search_limit)])
@@ -728,30 +796,33 @@ def process_download_tracking_items(connection, **kwargs):
     counts = {'proc': 0, 'deleted': 0, 'released': 0}
 
     page_ips = set([tracking['download_tracking']['remote_ip'] for tracking in search_page])
-    # transform all IP addresses into GEO information with a persistent connection
-    with requests.Session() as session:
-        for track_ip in page_ips:
-            if track_ip in ip_cache:
-                continue
-            geo = geocoder.ip(track_ip, session=session)
-            geo_country = getattr(geo, 'country') or 'Unknown'
-            geo_city = getattr(geo, 'city') or 'Unknown'
-            geo_state = getattr(geo, 'state', None)
-            if geo_state:
-                geo_city = ', '.join([geo_city, geo_state])
-            # cache the geo info in an arbitrary form
-            ip_cache[track_ip] = '//'.join([geo_city, geo_country])
+    # transform the new IP addresses into GEO information, leaving half of the time for patching.
+    # Failed lookups are not cached and their items are not patched, so they are retried next run
+    resolved = resolve_ip_geo((track_ip for track_ip in page_ips if track_ip not in ip_cache),
+                              time_limit / 2, start=t0)
+    for track_ip, geo_info in resolved.items():
+        if geo_info:
+            ip_cache[track_ip] = [geo_info, now.isoformat()]
+    if resolved:
+        cache_utils.put_cache(connection, 'process_download_tracking_items', 'ip_geo', ip_cache)
+
+    def patch_tracking(patch_body, uuid):
+        ff_utils.patch_metadata(patch_body, uuid, key=connection.ff_keys)
 
     # iterate over the individual tracking items
+    tasks = []
+    statuses = {}
+    no_geo = 0
     for tracking in search_page:
-        if round(time.time() - t0, 2) > time_limit:
-            break
         dl_info = tracking['download_tracking']
+        if dl_info['remote_ip'] not in ip_cache:
+            no_geo += 1
+            continue
         user_agent = dl_info.get('user_agent', 'unknown_user_agent').lower()
         # remove request_headers, which may contain sensitive information
         if 'request_headers' in dl_info:
             del dl_info['request_headers']
-        geo_info = ip_cache[dl_info['remote_ip']]
+        geo_info = ip_cache[dl_info['remote_ip']][0]
         dl_info['geo_city'], dl_info['geo_country'] = geo_info.split('//')
         patch_body = {'status': 'released', 'download_tracking': dl_info}
         # delete items from bot user agents
@@ -768,34 +839,39 @@ def process_download_tracking_items(connection, **kwargs):
             parsed_date = parse_datetime_to_utc(tracking['date_created'])
             if parsed_date is not None:
                 if range_key in range_cache:
-                    # for all reference range queries with this info, see if this one
-                    # was created within one hour of it. if so, it is redundant and delete
-                    for range_reference in range_cache[range_key]:
-                        compare_date_low = range_reference - datetime.timedelta(hours=range_consolidation_hrs)
-                        compare_date_high = range_reference + datetime.timedelta(hours=range_consolidation_hrs)
-                        if parsed_date > compare_date_low and parsed_date < compare_date_high:
-                            patch_body['status'] = 'deleted'
-                            break
-                    if patch_body['status'] != 'deleted':
-                        range_cache[range_key].append(parsed_date)
+                    # if a reference range query with this info was created within one
+                    # hour of this one, this one is redundant and delete
+                    if in_range_window(range_cache[range_key], parsed_date, range_window):
+                        patch_body['status'] = 'deleted'
+                    else:
+                        bisect.insort(range_cache[range_key], parsed_date)
                 else:
                     # set the upper limit for for range queries to consolidate
                     range_cache[range_key] = [parsed_date]
             else:
                 check.brief_output['cannot_parse_date_created'].append(tracking['uuid'])
+        statuses[tracking['uuid']] = patch_body['status']
+        tasks.append(('patch', tracking['uuid'], partial(patch_tracking, patch_body, tracking['uuid'])))
 
-        ff_utils.patch_metadata(patch_body, tracking['uuid'], key=connection.ff_keys)
+    # patch in parallel; items not patched in time are found again by the next run
+    patches = {}
+    patch_utils.bulk_patch(tasks, patches, time_limit, start=t0)
+    for uuid in patches.get('patch_success', []):
         counts['proc'] += 1
-        if patch_body['status'] == 'released':
+        if statuses[uuid] == 'released':
             counts['released'] += 1
         else:
             counts['deleted'] += 1
+    if patches.get('patch_failure'):
+        check.brief_output['patch_failure'] = patches['patch_failure']
     if any(check.brief_output.values()):
         check.status = 'WARN'
     else:
         check.status = 'PASS'
     check.summary = 'Successfully processed %s download tracking items' % counts['proc']
     check.description = '%s. Released %s items and deleted %s items' % (check.summary, counts['released'], counts['deleted'])
+    if patches.get('not_attempted') or no_geo:
+        check.description += '. %s items left for the next run' % (len(patches.get('not_attempted', [])) + no_geo)
     return check
 
 
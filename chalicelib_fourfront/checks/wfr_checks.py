@@ -1,8 +1,8 @@
 from datetime import datetime, timedelta
 from dcicutils import ff_utils
-from dcicutils.s3_utils import s3Utils
 from .helpers import wfr_utils
 from .helpers import wfrset_utils
+from .helpers.checkpoint_utils import get_checkpoint, resume_after_checkpoint, set_checkpoint
 
 # Use confchecks to import decorators object and its methods for each check module
 # rather than importing check_function, action_function, CheckResult, ActionResult
@@ -55,11 +55,17 @@ def md5run_extra_file_start(connection, **kwargs):
     if kwargs.get('start_missing'):
         targets.extend(md5run_check_result.get('extra_files_missing_md5', []))
     action_logs['targets'] = targets
-    for a_target in targets:
+    # skip the targets handled by a previous run on the same check result that stopped at lambda_limit
+    scope = kwargs.get('called_by')
+    last_target = get_checkpoint(action, scope)
+    stopped_at = None
+    for a_target in resume_after_checkpoint(targets, last_target):
         now = datetime.utcnow()
         if (now-start).seconds > lambda_limit:
             action.description = 'Did not complete action due to time limitations'
+            stopped_at = last_target
             break
+        last_target = a_target
         a_file = ff_utils.get_metadata(a_target, key=my_auth)
         attributions = wfr_utils.get_attribution(a_file)
         wfr_setup = wfrset_utils.step_settings('md5', 'no_organism', attributions)
@@ -84,6 +90,8 @@ def md5run_extra_file_start(connection, **kwargs):
                 action_logs['runs_failed'].append([a_target, extra_format, url])
 
     action.output = action_logs
+    if stopped_at:
+        set_checkpoint(action, stopped_at, scope)
     action.status = 'DONE'
     return action
 
@@ -104,6 +112,7 @@ def md5run_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'md5run_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "md5run_start"
     check.brief_output = []
     check.full_output = {}
@@ -129,12 +138,10 @@ def md5run_status(connection, **kwargs):
     limit = kwargs.get('file_limit')
     query += '&limit=' + limit
     # The search
-    res = ff_utils.search_metadata(query, key=my_auth, is_generator=True)
-    # 2024-02-08: Note that any() is destructive of the (res) generator;
-    # so this code was causing us to skip past the first result in the generator.
-    # if not any(res):
-    #    check.summary = 'All Good!'
-    #    return check
+    res = ff_utils.search_metadata(query, key=my_auth)
+    if not res:
+        check.summary = 'All Good!'
+        return check
     # if there are files, make sure they are not on s3
     no_s3_file = []
     running = []
@@ -142,36 +149,32 @@ def md5run_status(connection, **kwargs):
     not_switched_status = []
     # multiple failed runs
     problems = []
-    # 2024-02-08: Per above comment WRT any() on a generator, only do
-    # this S3 access only if we have at least one result in the loop below.
-    # Be nicer to have a generator wrapper to allow easily
-    # checking for any results without skipping past the first item.
-    # my_s3_util = s3Utils(env=connection.ff_env)
-    # raw_bucket = my_s3_util.raw_file_bucket
-    # out_bucket = my_s3_util.outfile_bucket
-    my_s3_util = None
+    my_s3_util = connection.ff_s3
+    raw_bucket = my_s3_util.raw_file_bucket
+    out_bucket = my_s3_util.outfile_bucket
+
+    def file_bucket(a_file):
+        if 'FileProcessed' in a_file['@type']:
+            return out_bucket
+        elif 'FileVistrack' in a_file['@type']:
+            return out_bucket
+        else:  # covers cases of FileFastq, FileReference, FileMicroscopy
+            return raw_bucket
+
+    # check all files on s3 at once
+    key_index = wfr_utils.S3KeyIndex(my_s3_util)
+    for bucket in [raw_bucket, out_bucket]:
+        key_index.prepare([a_file['upload_key'] for a_file in res if file_bucket(a_file) == bucket], bucket)
     for a_file in res:
-        if not my_s3_util:
-            my_s3_util = s3Utils(env=connection.ff_env)
-            raw_bucket = my_s3_util.raw_file_bucket
-            out_bucket = my_s3_util.outfile_bucket
         # lambda has a time limit (300sec), kill before it is reached so we get some results
         now = datetime.utcnow()
         if (now-start).seconds > lambda_limit:
             check.brief_output.append('did not complete checking all')
             break
 
-        # find bucket
-        if 'FileProcessed' in a_file['@type']:
-            my_bucket = out_bucket
-        elif 'FileVistrack' in a_file['@type']:
-            my_bucket = out_bucket
-        else:  # covers cases of FileFastq, FileReference, FileMicroscopy
-            my_bucket = raw_bucket
         # check if file is in s3
         file_id = a_file['accession']
-        head_info = my_s3_util.does_key_exist(a_file['upload_key'], my_bucket)
-        if not head_info:
+        if not key_index.exists(a_file['upload_key'], file_bucket(a_file)):
             no_s3_file.append(file_id)
             continue
         md5_report = wfr_utils.get_wfr_out(a_file, "md5", key=my_auth, md_qc=True, **kwargs)
@@ -186,12 +189,6 @@ def md5run_status(connection, **kwargs):
             # There is a successful run, but status is not switched, happens when a file is reuploaded.
             # note this happens infrequently so should be fine to do this way
             not_switched_status.append(file_id)
-    else:
-        # We get here at the end of the result set iteration for loop, regardless of where or not
-        # there were results; if my_s3_util is not set at this point it means there were no results.
-        if not my_s3_util:
-            check.summary = 'All Good!'
-            return check
 
     summary = ''
     if running:
@@ -255,7 +252,7 @@ def md5run_uploaded_files(connection, **kwargs):
 
     files = {}
     no_md5_files = ff_utils.search_metadata(query, key=my_auth)
-    no_md5_files = [f for f in no_md5_files if not wfr_utils.prereleased_and_not_uploaded(connection, f)]
+    no_md5_files = wfr_utils.remove_prereleased_and_not_uploaded(connection, no_md5_files)
     for f in no_md5_files:
         wfrs = f.get('workflow_run_inputs')
         has_md5run = False
@@ -302,11 +299,17 @@ def md5run_start(connection, **kwargs):
     if kwargs.get('start_not_switched'):
         targets.extend(md5run_check_result.get('files_with_run_and_wrong_status_to_start', []))
     action_logs['targets'] = targets
-    for a_target in targets:
+    # skip the targets handled by a previous run on the same check result that stopped at lambda_limit
+    scope = kwargs.get('called_by')
+    last_target = get_checkpoint(action, scope)
+    stopped_at = None
+    for a_target in resume_after_checkpoint(targets, last_target):
         now = datetime.utcnow()
         if (now-start).seconds > lambda_limit:
             action.description = 'Did not complete action due to time limitations'
+            stopped_at = last_target
             break
+        last_target = a_target
         a_file = ff_utils.get_metadata(a_target, key=my_auth)
         attributions = wfr_utils.get_attribution(a_file)
         inp_f = {'input_file': a_file['@id']}
@@ -322,6 +325,8 @@ def md5run_start(connection, **kwargs):
         else:
             action_logs['runs_failed'].append([a_target, url])
     action.output = action_logs
+    if stopped_at:
+        set_checkpoint(action, stopped_at, scope)
     action.status = 'DONE'
     return action
 
@@ -338,6 +343,7 @@ def fastqc_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'fastqc_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "fastqc_start"
     check.brief_output = []
     check.full_output = {}
@@ -367,7 +373,7 @@ def fastqc_status(connection, **kwargs):
     res = ff_utils.search_metadata(query, key=my_auth)
     # check for pre-released status files that have not been uploaded (because they will become restricted)
     # and remove from res
-    res = [f for f in res if not wfr_utils.prereleased_and_not_uploaded(connection, f)]
+    res = wfr_utils.remove_prereleased_and_not_uploaded(connection, res)
     if not res:
         check.summary = 'All Good!'
         return check
@@ -424,6 +430,7 @@ def pairsqc_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'pairsqc_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "pairsqc_start"
     check.brief_output = []
     check.full_output = {}
@@ -524,6 +531,7 @@ def bg2bw_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'bg2bw_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "bg2bw_start"
     check.brief_output = []
     check.full_output = {}
@@ -625,6 +633,7 @@ def bed2beddb_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'bed2beddb_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "bed2beddb_start"
     check.brief_output = []
     check.full_output = {}
@@ -753,7 +762,8 @@ def bed2beddb_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="in_situ_hic_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="in_situ_hic_start")
 def in_situ_hic_status(connection, **kwargs):
     """
     Keyword arguments:
@@ -762,10 +772,13 @@ def in_situ_hic_status(connection, **kwargs):
     max_runtime -- assume runs beyond max_runtime are dead - override default value on workflow
     accepted_vers -- if used will override accepted version tags of completed pipelines
                      obtained from ExperimentType items - multiple values as comma sep list
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'in_situ_hic_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "in_situ_hic_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -786,7 +799,9 @@ def in_situ_hic_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, kwargs)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, kwargs)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -810,17 +825,21 @@ def in_situ_hic_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="dilution_hic_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="dilution_hic_start")
 def dilution_hic_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'dilution_hic_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "dilution_hic_start"
     check.brief_output = []
     check.summary = ""
@@ -842,7 +861,9 @@ def dilution_hic_status(connection, **kwargs):
         check.summary = 'All Good!'
         return check
 
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -867,17 +888,21 @@ def dilution_hic_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="tcc_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="tcc_start")
 def tcc_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'tcc_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "tcc_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -898,7 +923,9 @@ def tcc_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=False)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=False)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -922,17 +949,21 @@ def tcc_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="dnase_hic_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="dnase_hic_start")
 def dnase_hic_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'dnase_hic_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "dnase_hic_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -953,7 +984,9 @@ def dnase_hic_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=False)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=False)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -977,17 +1010,21 @@ def dnase_hic_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="capture_hic_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="capture_hic_start")
 def capture_hic_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'capture_hic_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "capture_hic_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1008,7 +1045,9 @@ def capture_hic_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=True)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=True)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1032,17 +1071,21 @@ def capture_hic_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="micro_c_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="micro_c_start")
 def micro_c_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'micro_c_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "micro_c_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1063,7 +1106,9 @@ def micro_c_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=False)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=False)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1087,17 +1132,21 @@ def micro_c_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="chia_pet_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="chia_pet_start")
 def chia_pet_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'chia_pet_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "chia_pet_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1118,7 +1167,9 @@ def chia_pet_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=True)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=True)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1142,17 +1193,21 @@ def chia_pet_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="in_situ_chia_pet_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="in_situ_chia_pet_start")
 def in_situ_chia_pet_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'in_situ_chia_pet_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "in_situ_chia_pet_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1173,7 +1228,9 @@ def in_situ_chia_pet_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nonorm=True)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nonorm=True)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1197,17 +1254,21 @@ def in_situ_chia_pet_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="trac_loop_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="trac_loop_start")
 def trac_loop_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'trac_loop_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "trac_loop_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1228,7 +1289,9 @@ def trac_loop_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=True)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=True, nonorm=True)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1252,17 +1315,21 @@ def trac_loop_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="plac_seq_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="plac_seq_start")
 def plac_seq_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'plac_seq_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "plac_seq_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1283,7 +1350,9 @@ def plac_seq_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=True)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=True)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1307,17 +1376,21 @@ def plac_seq_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="hichip_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="hichip_start")
 def hichip_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'hichip_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "hichip_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1338,7 +1411,9 @@ def hichip_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_hic(res, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=True)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_hic(sets, my_auth, exp_type, check, start, lambda_limit, nore=False, nonorm=True)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1362,17 +1437,21 @@ def hichip_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="repli_2_stage_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="repli_2_stage_start")
 def repli_2_stage_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'repli_2_stage_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "repli_2_stage_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1391,7 +1470,9 @@ def repli_2_stage_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_repli(res, my_auth, exp_type, check, start, lambda_limit)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_repli(sets, my_auth, exp_type, check, start, lambda_limit)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1416,17 +1497,21 @@ def repli_2_stage_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="repli_multi_stage_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="repli_multi_stage_start")
 def repli_multi_stage_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'repli_multi_stage_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "repli_multi_stage_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1445,7 +1530,9 @@ def repli_multi_stage_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_repli(res, my_auth, exp_type, check, start, lambda_limit)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_repli(sets, my_auth, exp_type, check, start, lambda_limit)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1470,17 +1557,21 @@ def repli_multi_stage_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="tsa_seq_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="tsa_seq_start")
 def tsa_seq_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'tsa_seq_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "tsa_seq_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1499,7 +1590,9 @@ def tsa_seq_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_repli(res, my_auth, exp_type, check, start, lambda_limit, winsize=25000)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_repli(sets, my_auth, exp_type, check, start, lambda_limit, winsize=25000)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1525,17 +1618,21 @@ def tsa_seq_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="nad_seq_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="nad_seq_start")
 def nad_seq_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'nad_seq_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "nad_seq_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1554,7 +1651,9 @@ def nad_seq_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_repli(res, my_auth, exp_type, check, start, lambda_limit)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_repli(sets, my_auth, exp_type, check, start, lambda_limit)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1579,17 +1678,21 @@ def nad_seq_start(connection, **kwargs):
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, action="margi_start")
+                acc_wf_vers=None, acc_pipes=None, incremental=True,
+                full_refresh_hours=24, action="margi_start")
 def margi_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'margi_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "margi_start"
     check.brief_output = []
     check.summary = ""
@@ -1611,7 +1714,9 @@ def margi_status(connection, **kwargs):
         check.summary = 'All Good!'
         return check
 
-    check = wfr_utils.check_margi(res, my_auth, exp_type, check, start, lambda_limit)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_margi(sets, my_auth, exp_type, check, start, lambda_limit)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1647,6 +1752,7 @@ def bed2multivec_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'bed2multivec_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "bed2multivec_start"
     check.brief_output = []
     check.full_output = {}
@@ -1785,6 +1891,7 @@ def rna_strandedness_status(connection, **kwargs):
     """
     check = CheckResult(connection, 'rna_strandedness_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "rna_strandedness_start"
     check.brief_output = []
     check.full_output = {}
@@ -1876,11 +1983,17 @@ def rna_strandedness_start(connection, **kwargs):
         targets.extend(rna_strandedness_check_result.get('files_without_rna_strandedness_run', []))
 
     action_logs['targets'] = targets
-    for a_target in targets:
+    # skip the targets handled by a previous run on the same check result that stopped at lambda_limit
+    scope = kwargs.get('called_by')
+    last_target = get_checkpoint(action, scope)
+    stopped_at = None
+    for a_target in resume_after_checkpoint(targets, last_target):
         now = datetime.utcnow()
         if (now-start).seconds > lambda_limit:
             action.description = 'Did not complete action due to time limitations'
+            stopped_at = last_target
             break
+        last_target = a_target
         a_file = ff_utils.get_metadata(a_target, key=my_auth)
         attributions = wfr_utils.get_attribution(a_file)
         org = a_file['experiments'][0]['biosample']['biosource'][0]['organism']['name']
@@ -1899,22 +2012,28 @@ def rna_strandedness_start(connection, **kwargs):
         else:
             action_logs['runs_failed'].append([a_target, url])
     action.output = action_logs
+    if stopped_at:
+        set_checkpoint(action, stopped_at, scope)
     action.status = 'DONE'
     return action
 
 
 @check_function(lab_title=None, start_date=None, max_runtime=None,
-                acc_wf_vers=None, acc_pipes=None, query='', action="rna_seq_start")
+                acc_wf_vers=None, acc_pipes=None, query='', incremental=True,
+                full_refresh_hours=24, action="rna_seq_start")
 def rna_seq_status(connection, **kwargs):
     """
     Keyword arguments:
     lab_title -- limit search with a lab i.e. Bing+Ren, UCSD
     start_date -- limit search to files generated since a date formatted YYYY-MM-DD
     run_time -- assume runs beyond run_time are dead
+    incremental -- only evaluate sets modified since the last run or with pending runs
+    full_refresh_hours -- in incremental mode, evaluate each set at least this often
     """
     start = datetime.utcnow()
     check = CheckResult(connection, 'rna_seq_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "rna_seq_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -1940,7 +2059,9 @@ def rna_seq_status(connection, **kwargs):
     if not res:
         check.summary = 'All Good!'
         return check
-    check = wfr_utils.check_rna(res, my_auth, exp_type, check, start, lambda_limit)
+    sets = wfr_utils.select_sets_to_check(res, check, kwargs)
+    check = wfr_utils.check_rna(sets, my_auth, exp_type, check, start, lambda_limit)
+    wfr_utils.save_set_states(check, sets)
     return check
 
 
@@ -1978,6 +2099,7 @@ def bamqc_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'bamqc_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "bamqc_start"
     check.brief_output = []
     check.full_output = {}
@@ -2069,6 +2191,7 @@ def fastq_first_line_status(connection, **kwargs):
     """
     check = CheckResult(connection, 'fastq_first_line_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "fastq_first_line_start"
     check.brief_output = []
     check.full_output = {}
@@ -2084,7 +2207,7 @@ def fastq_first_line_status(connection, **kwargs):
     # The search
     print('About to query ES for files')
     res = ff_utils.search_metadata(query, key=my_auth)
-    res = [f for f in res if not wfr_utils.prereleased_and_not_uploaded(connection, f)]
+    res = wfr_utils.remove_prereleased_and_not_uploaded(connection, res)
     if not res:
         check.summary = "All good!"
         return check
@@ -2141,11 +2264,17 @@ def fastq_first_line_start(connection, **kwargs):
         targets.extend(fastq_formatqc_check_result.get('files_without_fastq_formatqc_run', []))
 
     action_logs['targets'] = targets
-    for a_target in targets:
+    # skip the targets handled by a previous run on the same check result that stopped at lambda_limit
+    scope = kwargs.get('called_by')
+    last_target = get_checkpoint(action, scope)
+    stopped_at = None
+    for a_target in resume_after_checkpoint(targets, last_target):
         now = datetime.utcnow()
         if (now-start).seconds > lambda_limit:
             action.description = 'Did not complete action due to time limitations'
+            stopped_at = last_target
             break
+        last_target = a_target
         a_file = ff_utils.get_metadata(a_target, key=my_auth)
         attributions = wfr_utils.get_attribution(a_file)
         # Add function to calculate resolution automatically
@@ -2163,6 +2292,8 @@ def fastq_first_line_start(connection, **kwargs):
         else:
             action_logs['runs_failed'].append([a_target, url])
     action.output = action_logs
+    if stopped_at:
+        set_checkpoint(action, stopped_at, scope)
     action.status = 'DONE'
     return action
 
@@ -2179,6 +2310,7 @@ def bam_re_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'bam_re_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "bam_re_start"
     check.brief_output = []
     check.full_output = {}
@@ -2316,6 +2448,7 @@ def insulation_scores_and_boundaries_status(connection, **kwargs):
 
     check = CheckResult(connection, 'insulation_scores_and_boundaries_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "insulation_scores_and_boundaries_start"
     check.description = ""
     check.brief_output = []
@@ -2459,6 +2592,7 @@ def long_running_wfrs_fdn_status(connection, **kwargs):
     """
     check = CheckResult(connection, 'long_running_wfrs_fdn_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "long_running_wfrs_fdn_start"
     check.description = "Find runs running longer than specified, action will delete the metadata and might lead to re-runs"
     check.brief_output = []
@@ -2699,6 +2833,7 @@ def compartments_caller_status(connection, **kwargs):
 
     check = CheckResult(connection, 'compartments_caller_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "compartments_caller_start"
     check.description = ""
     check.brief_output = []
@@ -2834,6 +2969,7 @@ def mcoolqc_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'mcoolqc_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "mcoolqc_start"
     check.brief_output = []
     check.full_output = {}
@@ -2919,6 +3055,7 @@ def template_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'template_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "template_start"
     check.brief_output = []
     check.full_output = {}
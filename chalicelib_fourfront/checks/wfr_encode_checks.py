@@ -22,6 +22,7 @@ def chipseq_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'chipseq_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "chipseq_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -76,10 +77,9 @@ def chipseq_status(connection, **kwargs):
             check.full_output['skipped'].append({a_set['accession']: 'files status uploading'})
             continue
 
-        all_wfrs = all_items.get('workflow_run_awsem', []) + all_items.get('workflow_run_sbg', [])
-        all_files = [i for typ in all_items for i in all_items[typ] if typ.startswith('file_')]
-        all_qcs = [i for typ in all_items for i in all_items[typ] if typ.startswith('quality_metric')]
-        library = {'wfrs': all_wfrs, 'files': all_files, 'qcs': all_qcs}
+        library = wfr_utils.MetadataLibrary(all_items)
+        all_files = library.files
+        all_qcs = library.qcs
         keep = {'missing_run': [], 'running': [], 'problematic_run': []}
         # if all completed, patch this info
         complete = {'patch_opf': [],
@@ -97,7 +97,7 @@ def chipseq_status(connection, **kwargs):
         # get organism, target and control from the first replicate
         f_exp = replicate_exps[0]['replicate_exp']['uuid']
         # have to do another get for control experiments if there is one
-        f_exp_resp = [i for i in all_items['experiment_seq'] if i['uuid'] == f_exp][0]
+        f_exp_resp = library.get(f_exp)
         control, control_set, target_type, organism = wfr_utils.get_chip_info(f_exp_resp, all_items)
         print('ORG:', organism, "CONT:", control, "TARGET:", target_type, "CONT_SET:", control_set)
         set_summary = " - ".join([set_acc, str(organism), str(target_type), str(control)])
@@ -132,7 +132,7 @@ def chipseq_status(connection, **kwargs):
             # track if all control experiments are completed processing
             control_ready = True
             exp_id = an_exp['replicate_exp']['accession']
-            exp_resp = [i for i in all_items['experiment_seq'] if i['accession'] == exp_id][0]
+            exp_resp = library.get(exp_id)
             exp_files, paired = wfr_utils.get_chip_files(exp_resp, all_files, True)
             print(exp_id, len(exp_files), paired)
 
@@ -305,7 +305,7 @@ def chipseq_status(connection, **kwargs):
                         exp_cnt_id = exp_cnt_ids[0]
                         print('controlled by set', exp_cnt_id)
                         # have to do a get for the control experiment
-                        exp_cnt_resp = [i for i in all_items['experiment_seq'] if i['@id'] == exp_cnt_id][0]
+                        exp_cnt_resp = library.get(exp_cnt_id)
                         cont_file = ''
                         # check opf for control file
                         for opf_case in exp_cnt_resp.get('other_processed_files', []):
@@ -538,6 +538,7 @@ def atacseq_status(connection, **kwargs):
     start = datetime.utcnow()
     check = CheckResult(connection, 'atacseq_status')
     my_auth = connection.ff_keys
+    wfr_utils.clear_metadata_cache()
     check.action = "atacseq_start"
     check.description = "run missing steps and add processing results to processed files, match set status"
     check.brief_output = []
@@ -590,10 +591,9 @@ def atacseq_status(connection, **kwargs):
             check.brief_output.append(final_status)
             check.full_output['skipped'].append({a_set['accession']: 'files status uploading'})
             continue
-        all_wfrs = all_items.get('workflow_run_awsem', []) + all_items.get('workflow_run_sbg', [])
-        all_files = [i for typ in all_items for i in all_items[typ] if typ.startswith('file_')]
-        all_qcs = [i for typ in all_items for i in all_items[typ] if typ.startswith('quality_metric')]
-        library = {'wfrs': all_wfrs, 'files': all_files, 'qcs': all_qcs}
+        library = wfr_utils.MetadataLibrary(all_items)
+        all_files = library.files
+        all_qcs = library.qcs
         keep = {'missing_run': [], 'running': [], 'problematic_run': []}
         # if all completed, patch this info
         complete = {'patch_opf': [],
@@ -608,7 +608,7 @@ def atacseq_status(connection, **kwargs):
         # get organism
         f_exp = replicate_exps[0]['replicate_exp']['uuid']
         # have to do another get for control experiments if there is one
-        f_exp_resp = [i for i in all_items['experiment_atacseq'] if i['uuid'] == f_exp][0]
+        f_exp_resp = library.get(f_exp)
         biosample = f_exp_resp['biosample']
         organism = list(set([bs['organism']['name'] for bs in biosample['biosource']]))[0]
         set_summary = " - ".join([set_acc, str(organism)])
@@ -629,7 +629,7 @@ def atacseq_status(connection, **kwargs):
             # track if all experiments completed step0
             ready_for_step1 = True
             exp_id = an_exp['replicate_exp']['accession']
-            exp_resp = [i for i in all_items['experiment_atacseq'] if i['accession'] == exp_id][0]
+            exp_resp = library.get(exp_id)
             # exp_files [[pair1,pair2], [pair1, pair2]]
             exp_files, paired = wfr_utils.get_chip_files(exp_resp, all_files, False)
             # if there are more then 2 files, we need to merge:
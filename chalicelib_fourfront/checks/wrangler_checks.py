@@ -9,7 +9,9 @@ import time
 import itertools
 import random
 from difflib import SequenceMatcher
-from .helpers import wrangler_utils
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from .helpers import cache_utils, patch_utils, pubmed_utils, wrangler_utils
 from collections import Counter
 from oauth2client.service_account import ServiceAccountCredentials
 import gspread
@@ -150,7 +152,8 @@ def get_transfer_fields(biorxiv_meta):
     return {f: biorxiv_meta.get(f) for f in fields2transfer if biorxiv_meta.get(f) is not None}
 
 
-@check_function(uuid_list=None, false_positives=None, add_to_result=None, action="add_pub_and_replace_biorxiv")
+@check_function(uuid_list=None, false_positives=None, add_to_result=None, recheck_days=7,
+                action="add_pub_and_replace_biorxiv")
 def biorxiv_is_now_published(connection, **kwargs):
     ''' To restrict the check to just certain biorxivs use a comma separated list
         of biorxiv uuids in uuid_list kwarg.  This is useful if you want to
@@ -170,6 +173,9 @@ def biorxiv_is_now_published(connection, **kwargs):
         to journal article (PMID:ID) - to add that pairing to the result full_output. It will
         be acted on by the associated action format of input is uuid PMID:nnnnnn, uuid PMID:nnnnnn
 
+        Biorxivs without a matching article are only searched again after recheck_days (unless
+        they are in uuid_list) - use recheck_days=0 to search all of them
+
         NOTE: because the data to transfer from biorxiv to pub is obtained from the check result
         it is important to run the check (again) before executing the action in case something has
         changed since the check was run
@@ -248,8 +254,17 @@ def biorxiv_is_now_published(connection, **kwargs):
             false_pos.setdefault(id_vals[0], []).append(id_vals[1])
 
     fulloutput['false_positives'] = false_pos
-    pubmed_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&retmode=json'
     problems = {}
+    # biorxivs without a match are only searched again after recheck_days, unless listed in uuid_list.
+    # misses are keyed by title hash, or by uuid for biorxivs without a title
+    def miss_key(bx):
+        return pubmed_utils.title_hash(bx['title']) if bx.get('title') else bx.get('uuid')
+
+    misses = cache_utils.get_cache(connection, 'biorxiv_is_now_published', 'pubmed_misses')
+    now = datetime.datetime.utcnow()
+    recheck_after = (now - datetime.timedelta(days=kwargs.get('recheck_days') or 0)).isoformat()
+    misses = {thash: date for thash, date in misses.items() if date > recheck_after}
+    to_search = []
     for bx in biorxivs:
         title = bx.get('title')
         authors = bx.get('authors')
@@ -262,31 +277,23 @@ def biorxiv_is_now_published(connection, **kwargs):
             msg = "some biorxiv records are missing metadata used for search\n"
             if msg not in chkdesc:
                 chkdesc = chkdesc + msg
-        # first search with title
-        suffix = '&field=title&term={}'.format(title)
-        title_query = pubmed_url + suffix
-        time.sleep(1)
-        do_author_search = False
-        ids = []
-        res = requests.get(title_query)
-        if res.status_code == 200:
-            result = res.json().get('esearchresult')
-            if not result or not result.get('idlist'):
-                do_author_search = True
-            else:
-                ids = result.get('idlist')
-        else:
-            do_author_search = True  # problem with request to pubmed
-
-        if do_author_search and authors:
-            author_string = '&term=' + '%20'.join(['{}[Author]'.format(a.split(' ')[0]) for a in authors])
-            author_query = pubmed_url + author_string
-            time.sleep(1)
-            res = requests.get(author_query)
-            if res.status_code == 200:
-                result = res.json().get('esearchresult')
-                if result and result.get('idlist'):
-                    ids = result.get('idlist')
+        if not (title or authors) or (not kwargs.get('uuid_list') and miss_key(bx) in misses):
+            continue
+        to_search.append(bx)
+
+    pubmed = pubmed_utils.PubMedClient()
+    # first search with titles, many at once. biorxivs without a title are searched by authors only
+    title_ids = pubmed.search_titles([bx['title'] for bx in to_search if bx.get('title')])
+    found_ids = []
+    for bx in to_search:
+        authors = bx.get('authors')
+        buuid = bx.get('uuid')
+        ids = title_ids.get(bx['title']) if bx.get('title') else []
+        searched = ids is not None
+        if not ids and authors:
+            ids = pubmed.search_authors(authors)
+            searched = searched and ids is not None
+        ids = ids or []
 
         if buuid in false_pos:
             ids = [i for i in ids if i not in false_pos[buuid]]
@@ -299,22 +306,13 @@ def biorxiv_is_now_published(connection, **kwargs):
             # here we don't want the embedded search view so get frame=object
             bmeta = get_biorxiv_meta(buuid, connection)
             fulloutput['biorxivs2check'][buuid].setdefault('data2transfer', {}).update(get_transfer_fields(bmeta))
-            # look for GEO datasets
-            for id_ in ids:
-                result = requests.get('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-                                      'elink.fcgi?dbfrom=pubmed&db=gds&id={}&retmode=json'.format(id_))
-                if result.status_code != 200:
-                    continue
-                geo_ids = [num for link in json.loads(result.text).get('linksets', [])
-                           for item in link.get('linksetdbs', []) for num in item.get('links', [])]
-                geo_accs = []
-                for geo_id in geo_ids:
-                    geo_result = requests.get('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-                                              'efetch.fcgi?db=gds&id={}'.format(geo_id))
-                    if geo_result.status_code == 200:
-                        geo_accs.extend([item for item in geo_result.text.split() if item.startswith('GSE')])
-                if geo_accs:
-                    fulloutput['GEO datasets found']['PMID:' + id_] = geo_accs
+            found_ids.extend(ids)
+        elif searched:
+            misses[miss_key(bx)] = now.isoformat()
+    # look for GEO datasets
+    for id_, geo_accs in pubmed.find_geo_datasets(list(dict.fromkeys(found_ids))).items():
+        fulloutput['GEO datasets found']['PMID:' + id_] = geo_accs
+    cache_utils.put_cache(connection, 'biorxiv_is_now_published', 'pubmed_misses', misses)
 
     if fndcnt != 0:
         chkdesc = "Candidate Biorxivs to replace found\nNOTE: please re-run check directly prior to running action to ensure all metadata is up to date." + chkdesc
@@ -794,26 +792,32 @@ def identify_files_without_filesize(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(time_limit=750)
 def patch_file_size(connection, **kwargs):
+    start = time.time()
     action = ActionResult(connection, 'patch_file_size')
     action_logs = {'s3_file_not_found': [], 'patch_failure': [], 'patch_success': []}
     # get the associated identify_files_without_filesize run result
     filesize_check_result = action.get_associated_check_result(kwargs)
-    for hit in filesize_check_result.get('full_output', []):
+    hits = filesize_check_result.get('full_output', [])
+
+    def head_file(hit):
         bucket = connection.ff_s3.outfile_bucket if 'FileProcessed' in hit['@type'] else connection.ff_s3.raw_file_bucket
-        head_info = connection.ff_s3.does_key_exist(hit['upload_key'], bucket)
+        return connection.ff_s3.does_key_exist(hit['upload_key'], bucket)
+
+    def patch_size(hit, head_info):
+        patch_data = {'file_size': head_info['ContentLength']}
+        ff_utils.patch_metadata(patch_data, obj_id=hit['uuid'], key=connection.ff_keys)
+
+    with ThreadPoolExecutor(max_workers=patch_utils.patch_workers) as executor:
+        head_infos = list(executor.map(head_file, hits))
+    tasks = []
+    for hit, head_info in zip(hits, head_infos):
         if not head_info:
             action_logs['s3_file_not_found'].append(hit['accession'])
         else:
-            patch_data = {'file_size': head_info['ContentLength']}
-            try:
-                ff_utils.patch_metadata(patch_data, obj_id=hit['uuid'], key=connection.ff_keys)
-            except Exception as e:
-                acc_and_error = '\n'.join([hit['accession'], str(e)])
-                action_logs['patch_failure'].append(acc_and_error)
-            else:
-                action_logs['patch_success'].append(hit['accession'])
+            tasks.append(('patch', hit['accession'], partial(patch_size, hit, head_info)))
+    patch_utils.bulk_patch(tasks, action_logs, kwargs['time_limit'], start=start)
     action.status = 'DONE'
     action.output = action_logs
     return action
@@ -1042,7 +1046,7 @@ def clean_up_webdev_wfrs(connection, **kwargs):
     return check
 
 
-def find_entrez_gene_status(report):
+def find_entrez_track_info(report):
     # Pattern for track-info block
     start_pattern = r"track-info\s*{"
 
@@ -1070,7 +1074,11 @@ def find_entrez_gene_status(report):
                 break
 
     # get content between the start and end indexes
-    track_info = report[start_index:end_index]
+    return report[start_index:end_index] or None
+
+
+def find_entrez_gene_status(report):
+    track_info = find_entrez_track_info(report)
     if not track_info:
         return
     # look for status in track_info
@@ -1081,10 +1089,80 @@ def find_entrez_gene_status(report):
     return None
 
 
-@check_function(add_to_ignore=None, rm_from_ignore=None)
+def find_entrez_geneid(report):
+    track_info = find_entrez_track_info(report)
+    if not track_info:
+        return None
+    geneid_match = re.search(r"geneid\s+(\d+)\s*,", track_info)
+    if geneid_match:
+        return geneid_match.group(1)
+    return None
+
+
+def split_entrez_gene_records(lines):
+    """ Split the lines of a multi gene efetch report into one report per gene,
+        each record starts with a 'Entrezgene ::= {' line """
+    record = []
+    for line in lines:
+        if line.startswith('Entrezgene ::=') and record:
+            yield '\n'.join(record)
+            record = []
+        record.append(line)
+    if record:
+        yield '\n'.join(record)
+
+
+def fetch_entrez_gene_statuses(geneids):
+    """ Get the status (i.e. live, discontinued, secondary) of many genes with one efetch request.
+        Only statuses read from a record of the response are returned. Geneids missing from a
+        multi gene response (unreadable record or response cut short) are fetched again one at a
+        time, and are 'invalid' only if ncbi has no record for the single id. Geneids whose single
+        request failed are left out. Raises an Exception if ncbi did not respond """
+    resp = requests.post('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi',
+                         data={'db': 'gene', 'id': ','.join(geneids)}, stream=True, timeout=60)
+    if resp.status_code != 200:
+        raise Exception('ncbi responded with status %s' % resp.status_code)
+    lines = resp.iter_lines(decode_unicode=True)
+    first_line = next(lines, '')
+    if first_line.startswith('Error'):
+        if len(geneids) == 1:
+            return {geneids[0]: 'invalid'}
+        # one bad id can fail a whole request, split it
+        half = len(geneids) // 2
+        statuses = fetch_entrez_gene_statuses(geneids[:half])
+        statuses.update(fetch_entrez_gene_statuses(geneids[half:]))
+        return statuses
+    statuses = {}
+    records_found = set()
+    for record in split_entrez_gene_records(itertools.chain([first_line], lines)):
+        gid = find_entrez_geneid(record)
+        if not gid:
+            continue
+        records_found.add(gid)
+        status = find_entrez_gene_status(record)
+        if status:
+            statuses[gid] = status
+    missing = [gid for gid in geneids if gid not in statuses]
+    if len(geneids) == 1:
+        if missing:
+            statuses[geneids[0]] = 'unknown' if geneids[0] in records_found else 'invalid'
+        return statuses
+    for gid in missing:
+        time.sleep(0.334)
+        try:
+            statuses.update(fetch_entrez_gene_statuses([gid]))
+        except Exception:
+            pass  # not checked, will be queried again on the next run
+    return statuses
+
+
+@check_function(add_to_ignore=None, rm_from_ignore=None, batch_size=200, revalidate_days=30, time_limit=240)
 def validate_entrez_geneids(connection, **kwargs):
     ''' query ncbi to see if geneids are valid
+    genes are queried batch_size at a time and their status is kept in full_output,
+    only genes that are new or were checked more than revalidate_days ago are queried again
     '''
+    t0 = time.time()
     check = CheckResult(connection, 'validate_entrez_geneids')
     # add random wait to stagger runs with other checks on this schedule
     wait = round(random.uniform(0.1, random_wait), 1)
@@ -1131,6 +1209,8 @@ def validate_entrez_geneids(connection, **kwargs):
             gids2ignore = []
         else:
             gids2ignore[:] = [gid for gid in gids2ignore if gid not in [rm.strip() for rm in rm_ignores.split(',')]]
+    # status of each gene from previous runs, as [status, date checked]
+    gene_status = last_result['full_output'].get('gene_status', {})
 
     problems = {}
     timeouts = 0
@@ -1141,37 +1221,53 @@ def validate_entrez_geneids(connection, **kwargs):
         check.description = "Could not retrieve gene records from fourfront"
         return check
     geneids = [g.get('geneid') for g in genes if g.get('geneid') not in gids2ignore]
-
-    query = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=gene&id={id}"
-    for gid in geneids:
+    # only keep the status of current genes
+    gene_status = {gid: gene_status[gid] for gid in geneids if gid in gene_status}
+
+    now = datetime.datetime.utcnow()
+    revalidate_date = (now - datetime.timedelta(days=kwargs.get('revalidate_days') or 0)).isoformat()
+    to_query = [gid for gid in geneids if gid not in gene_status or gene_status[gid][1] < revalidate_date]
+    batch_size = kwargs.get('batch_size') or 200
+    not_checked = []
+    for n in range(0, len(to_query), batch_size):
+        batch = to_query[n:n + batch_size]
         if timeouts > 5:
             check.status = "ERROR"
             check.description = "Too many ncbi timeouts. Maybe they're down."
             return check
-        gquery = query.format(id=gid)
-        # make 3 attempts to query gene at ncbi
+        if kwargs.get('time_limit') and time.time() - t0 > kwargs['time_limit']:
+            not_checked = to_query[n:]
+            break
+        # make 3 attempts to query the batch at ncbi
         for count in range(3):
-            resp = None
+            statuses = None
             try:
-                resp = requests.get(gquery)
+                statuses = fetch_entrez_gene_statuses(batch)
             except Exception:
                 pass  # after 3 times will hit conditional below
             time.sleep(0.334)
-            if resp and resp.status_code == 200:
+            if statuses is not None:
                 break
-            if count == 2:  # third try without 200
-                timeouts += 1
+        if statuses is None:  # third try failed
+            timeouts += 1
+            for gid in batch:
                 problems[gid] = 'ncbi timeout'
-        try:
-            rtxt = resp.text
-            if rtxt.startswith('Error'):
-                problems[gid] = 'not a valid geneid'
+            continue
+        for gid, status in statuses.items():
+            if status == 'unknown':
+                # record without a readable status, report it but do not keep it
+                problems[gid] = 'unknown geneid - needs update?'
             else:
-                status = find_entrez_gene_status(rtxt)
-                if status != 'live':
-                    problems[gid] = f'{status} geneid - needs update?'
-        except AttributeError:
-            problems[gid] = 'empty response'
+                gene_status[gid] = [status, now.isoformat()]
+
+    for gid in geneids:
+        if gid in problems or gid not in gene_status:
+            continue
+        status = gene_status[gid][0]
+        if status == 'invalid':
+            problems[gid] = 'not a valid geneid'
+        elif status != 'live':
+            problems[gid] = f'{status} geneid - needs update?'
     check.full_output = {}
     if problems:
         problems = dict(sorted(problems.items(), key=lambda item: int(item[0])))
@@ -1182,7 +1278,10 @@ def validate_entrez_geneids(connection, **kwargs):
         check.status = "WARN"
     else:
         check.description = "GENE IDs are all valid"
+    if not_checked:
+        check.description += ". {} gene ids not checked yet due to time limit".format(len(not_checked))
     check.full_output.setdefault('ignore', []).extend(gids2ignore)
+    check.full_output['gene_status'] = gene_status
     return check
 
 
@@ -1307,6 +1406,58 @@ def string_label_similarity(string1, string2):
     return SequenceMatcher(None, s1cmp, s2cmp).ratio()
 
 
+def find_similar_label_pairs(labels, min_score=85, ngram_size=2):
+    """ finds the pairs of labels with a string_label_similarity score above min_score (0-100)
+        without comparing all pairs - labels are only compared if their token strings
+        share enough ngrams and have close enough lengths to reach the score
+        returns (index1, index2, score) tuples sorted by index, index1 < index2
+    """
+    # labels with the same token string are scored once
+    indexes_by_key = OrderedDict()
+    for n, label in enumerate(labels):
+        indexes_by_key.setdefault(get_tokens_to_string(label), []).append(n)
+    keys = list(indexes_by_key)
+
+    def ngrams(key):
+        size = min(ngram_size, len(key))
+        return Counter(key[i:i + size] for i in range(len(key) - size + 1))
+
+    # inverted index of ngram -> (key, number of times the ngram is in the key)
+    key_ngrams = [ngrams(key) for key in keys]
+    keys_by_ngram = {}
+    for k, grams in enumerate(key_ngrams):
+        for gram, count in grams.items():
+            keys_by_ngram.setdefault(gram, []).append((k, count))
+
+    pairs = []
+    for k1, key1 in enumerate(keys):
+        # identical token strings
+        for pair in itertools.combinations(indexes_by_key[key1], 2):
+            pairs.append(pair + (100,))
+        shared = Counter()
+        for gram, count in key_ngrams[k1].items():
+            for k2, count2 in keys_by_ngram[gram]:
+                if k2 > k1:
+                    shared[k2] += min(count, count2)
+        for k2, n_shared in shared.items():
+            key2 = keys[k2]
+            # q-gram lemma: each inserted or deleted character removes at most ngram_size ngrams, and
+            # a score above min_score allows at most (100 - min_score)% of the characters to differ
+            max_edits = (len(key1) + len(key2)) * (100 - min_score) // 100
+            if n_shared < max(len(key1), len(key2)) - ngram_size + 1 - ngram_size * max_edits:
+                continue
+            matcher = SequenceMatcher(None, key1, key2)
+            # cheap upper bounds first
+            if matcher.real_quick_ratio() * 100 <= min_score or matcher.quick_ratio() * 100 <= min_score:
+                continue
+            score = round(matcher.ratio() * 100)
+            if score > min_score:
+                for n1 in indexes_by_key[key1]:
+                    for n2 in indexes_by_key[key2]:
+                        pairs.append((min(n1, n2), max(n1, n2), score))
+    return sorted(pairs)
+
+
 @check_function(emails=None, ignore_current=False, reset_ignore=False, find_similar=False)
 def users_with_doppelganger(connection, **kwargs):
     """ Find users that share emails or have very similar names
@@ -1316,9 +1467,8 @@ def users_with_doppelganger(connection, **kwargs):
                         they will not show up next time.
         if there are caught cases, which are not problematic, you can add them to ignore list
         reset_ignore: you can reset the ignore list, and restart it, useful if you added something by mistake
-        find_similar: if True does the very expensive (and possible timeout) operation to check all pairwise 
-                      combinations of users for name similarity - will suceeed locally but approaches or passes
-                      lambda limit (15 min) when run in aws
+        find_similar: if True also checks users for name similarity - only pairs of users whose names share
+                      enough letter ngrams are compared (see find_similar_label_pairs)
     Result:
      full_output : contains up to 3 lists, one for problematic cases, one for results to skip (ignore list)
                    and optional a list of similar names
@@ -1428,22 +1578,20 @@ def users_with_doppelganger(connection, **kwargs):
 
     iffy_cases = []
     if chk_all_combos:
-        # go through each combination
-        combs = itertools.combinations(all_users, 2)
-        for comb in combs:
-            us1 = comb[0]
-            us2 = comb[1]
-            score = round(string_label_similarity(us1['display_title'], us2['display_title']) * 100)
-            if score > 85:
-                msg = '{} and {} are similar-{}'.format(
-                    us1['display_title'],
-                    us2['display_title'],
-                    str(score))
-                log = {'user1': [us1['display_title'], us1['@id'], us1['email']],
-                       'user2': [us2['display_title'], us2['@id'], us2['email']],
-                       'log': 'has similar names ({}/100)'.format(str(score)),
-                       'brief': msg}
-                iffy_cases.append(log)
+        # only score the pairs with similar enough names
+        labels = [a_user['display_title'] for a_user in all_users]
+        for n1, n2, score in find_similar_label_pairs(labels, min_score=85):
+            us1 = all_users[n1]
+            us2 = all_users[n2]
+            msg = '{} and {} are similar-{}'.format(
+                us1['display_title'],
+                us2['display_title'],
+                str(score))
+            log = {'user1': [us1['display_title'], us1['@id'], us1['email']],
+                   'user2': [us2['display_title'], us2['@id'], us2['email']],
+                   'log': 'has similar names ({}/100)'.format(str(score)),
+                   'brief': msg}
+            iffy_cases.append(log)
 
     # remove ignored cases from all cases
     if ignored_cases:
@@ -1456,11 +1604,16 @@ def users_with_doppelganger(connection, **kwargs):
         cases = []
 
     if cases:
+        # get the number of items linked to each user, for all users at once
+        def get_item_count(user_uuid):
+            user_info = ff_utils.get_metadata('indexing-info?uuid=' + user_uuid, key=connection.ff_keys)
+            return len(user_info['uuids_invalidated'])
+        user_uuids = list(set(a_case[us][1][7:-1] for a_case in cases for us in ['user1', 'user2']))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            item_counts = dict(zip(user_uuids, executor.map(get_item_count, user_uuids)))
         for a_case in cases:
-            us1_info = ff_utils.get_metadata('indexing-info?uuid=' + a_case['user1'][1][7:-1], key=connection.ff_keys)
-            item_count_1 = len(us1_info['uuids_invalidated'])
-            us2_info = ff_utils.get_metadata('indexing-info?uuid=' + a_case['user2'][1][7:-1], key=connection.ff_keys)
-            item_count_2 = len(us2_info['uuids_invalidated'])
+            item_count_1 = item_counts[a_case['user1'][1][7:-1]]
+            item_count_2 = item_counts[a_case['user2'][1][7:-1]]
             add_on = ' ({}/{})'.format(item_count_1, item_count_2)
             a_case['log'] = a_case['log'] + add_on
             a_case['brief'] = a_case['brief'] + add_on
@@ -1887,6 +2040,28 @@ def patch_strandedness_consistency_info(connection, **kwargs):
     return action
 
 
+# facets with this many terms may have been truncated by the search
+max_facet_terms = 100
+
+
+def get_facet_counts(search_query, field, key):
+    """Return {value: number of items} for a field in the items of a search, from a facet on
+    the field (search/?<search_query>&additional_facet=<field>&limit=0), without fetching items.
+    Return None if the search has no facet for the field or its terms may be truncated"""
+    try:
+        res = ff_utils.get_metadata('search/', key=key,
+                                    add_on=search_query + '&additional_facet=' + field + '&limit=0')
+    except Exception:
+        return None
+    for facet in res.get('facets', []):
+        if facet.get('field') == field:
+            terms = facet.get('terms', [])
+            if len(terms) >= max_facet_terms:
+                return None
+            return {term['key']: term['doc_count'] for term in terms if term.get('doc_count')}
+    return None
+
+
 @check_function(action="add_suggested_enum_values")
 def check_suggested_enum_values(connection, **kwargs):
     """On our schemas we have have a list of suggested fields for
@@ -1913,6 +2088,10 @@ def check_suggested_enum_values(connection, **kwargs):
     (again for subembbeded items or lists) to extract the field value, and =
     count occurences of each new value. (i.e. val3:10, val4:15)
 
+    * values are counted with a facet on the field when the search can provide
+    one, and the searches above are only used for the other fields.
+    The suggested enum fields are cached until the portal version changes.
+
     *deleted items are not considered by this check
     """
     check = CheckResult(connection, 'check_suggested_enum_values')
@@ -2027,68 +2206,89 @@ def check_suggested_enum_values(connection, **kwargs):
         new_vals = [i for i in new_vals if i not in options]
         return new_vals
 
+    def find_new_values_by_search(item_type, field_name, field_option):
+        """Search items with values that are not in field_option, and extract them"""
+        # create queries - we might need multiple since there is a url length limit
+        # Experimental - limit seems to be between 5260-5340
+        # all queries are appended by filter for No value
+        character_limit = 2000
+        extensions = []
+        extension = ''
+        for case in field_option:
+            if len(extension) < character_limit:
+                extension += '&' + field_name + '!=' + case
+            else:
+                # time to finalize, add no value
+                extension += '&' + field_name + '!=' + 'No value'
+                extensions.append(extension)
+                # reset extension
+                extension = '&' + field_name + '!=' + case
+        # add the leftover extension - there should be always one
+        if extension:
+            extension += '&' + field_name + '!=' + 'No value'
+            extensions.append(extension)
+
+        # only return this field
+        f_ex = '&field=' + field_name
+
+        common_responses = None
+        for an_ext in extensions:
+            q = "/search/?type={it}{ex}{f_ex}".format(it=item_type, ex=an_ext, f_ex=f_ex)
+            responses = ff_utils.search_metadata(q, connection.ff_keys)
+            # keep the items returned by all queries (intersection)
+            if common_responses is None:
+                common_responses = responses
+            else:
+                filter_ids = {i['@id'] for i in responses}
+                common_responses = [i for i in common_responses if i['@id'] in filter_ids]
+            # let's check if we depleted common_responses
+            if not common_responses:
+                break
+
+        odds = []
+        for response in common_responses or []:
+            odds.extend(extract_value(field_name, response, field_option))
+        return odds
+
     outputs = []
-    # Get Schemas
-    schemas = ff_utils.get_metadata('/profiles/', key=connection.ff_keys)
-    sug_en_cases = {}
-    for an_item_type in schemas:
-        properties = schemas[an_item_type]['properties']
-        sug_en_fields = find_suggested_enum(properties)
-        if sug_en_fields:
-            sug_en_cases[an_item_type] = sug_en_fields
+    # Get suggested enum fields, walking the schemas again only if the portal version changed
+    fields_cache = cache_utils.get_cache(connection, 'check_suggested_enum_values', 'suggested_enum_fields')
+    try:
+        version = ff_utils.get_health_page(key=connection.ff_keys).get('project_version')
+    except Exception:
+        version = None
+    if version and fields_cache.get('version') == version:
+        sug_en_cases = fields_cache['fields']
+    else:
+        schemas = ff_utils.get_metadata('/profiles/', key=connection.ff_keys)
+        sug_en_cases = {}
+        for an_item_type in schemas:
+            properties = schemas[an_item_type]['properties']
+            sug_en_fields = find_suggested_enum(properties)
+            if sug_en_fields:
+                sug_en_cases[an_item_type] = sug_en_fields
+        if version:
+            cache_utils.put_cache(connection, 'check_suggested_enum_values', 'suggested_enum_fields',
+                                  {'version': version, 'fields': sug_en_cases})
 
     for item_type in sug_en_cases:
         for i in sug_en_cases[item_type]:
-            extension = ""
             field_name = i[0]
             field_option = i[1]
-            # create queries - we might need multiple since there is a url length limit
-            # Experimental - limit seems to be between 5260-5340
-            # all queries are appended by filter for No value
-            character_limit = 2000
-            extensions = []
-            extension = ''
-            for case in field_option:
-                if len(extension) < character_limit:
-                    extension += '&' + field_name + '!=' + case
-                else:
-                    # time to finalize, add no value
-                    extension += '&' + field_name + '!=' + 'No value'
-                    extensions.append(extension)
-                    # reset extension
-                    extension = '&' + field_name + '!=' + case
-            # add the leftover extension - there should be always one
-            if extension:
-                extension += '&' + field_name + '!=' + 'No value'
-                extensions.append(extension)
-
-            # only return this field
-            f_ex = '&field=' + field_name
-
-            common_responses = []
-            for an_ext in extensions:
-                q = "/search/?type={it}{ex}{f_ex}".format(it=item_type, ex=an_ext, f_ex=f_ex)
-                responses = ff_utils.search_metadata(q, connection.ff_keys)
-                # if this is the first response, assign this as the first common response
-                if not common_responses:
-                    common_responses = responses
-                # if it is the subsequent responses, filter the commons ones with the new requests (intersection)
-                else:
-                    filter_ids = [i['@id'] for i in responses]
-                    common_responses = [i for i in common_responses if i['@id'] in filter_ids]
-                # let's check if we depleted common_responses
-                if not common_responses:
-                    break
-
-            odds = []
-            for response in common_responses:
-                odds.extend(extract_value(field_name, response, field_option))
-            if len(odds) > 0:
+            # count the values of the field with a facet, values are only counted item by item
+            # below if there is no facet for the field (i.e. linkTo fields) or it may be truncated
+            counts = get_facet_counts('type=' + item_type, field_name, connection.ff_keys)
+            if counts is not None:
+                options = set(field_option + ['', 'No value'])
+                new_values = {val: n for val, n in counts.items() if val not in options}
+            else:
+                new_values = dict(Counter(find_new_values_by_search(item_type, field_name, field_option)))
+            if new_values:
                 outputs.append(
                     {
                         'item_type': item_type,
                         'field': field_name,
-                        'new_values': dict(Counter(odds))
+                        'new_values': new_values
                     })
     if not outputs:
         check.allow_action = False
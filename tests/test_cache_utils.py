@@ -0,0 +1,69 @@
+import datetime
+import json
+from chalicelib_fourfront.checks import audit_checks
+from chalicelib_fourfront.checks.helpers import cache_utils
+
+
+class MockS3(object):
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, key):
+        value = self.objects.get(key)
+        return json.loads(value) if value is not None else None
+
+    def put_object(self, key, value):
+        self.objects[key] = value
+
+
+class MockConnection(object):
+    ff_keys = {}
+
+    def __init__(self):
+        self.connections = {'s3': MockS3()}
+
+
+def test_cache_key():
+    key = cache_utils.cache_key('check_status_mismatch', 'status_table')
+    assert key == 'check_status_mismatch/cache/status_table.json'
+    assert cache_utils.is_cache_key(key)
+    assert not cache_utils.is_cache_key('check_status_mismatch/2018-10-15T19:08:32.734656.json')
+    assert not cache_utils.is_cache_key('check_status_mismatch/primary.json')
+
+
+def test_get_and_put_cache():
+    connection = MockConnection()
+    assert cache_utils.get_cache(connection, 'my_check', 'my_cache') == {}
+    cache_utils.put_cache(connection, 'my_check', 'my_cache', {'a': [1, 2]})
+    assert cache_utils.get_cache(connection, 'my_check', 'my_cache') == {'a': [1, 2]}
+
+
+def test_status_table_drops_modified_items(monkeypatch):
+    connection = MockConnection()
+    created = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).isoformat()
+    cache_utils.put_cache(connection, 'check_status_mismatch', 'status_table', {
+        'created': created, 'date': '2024-01-01 10:00',
+        'items': {'uuid1': ['released', 'file_fastq'], 'uuid2': ['released', 'biosample']}})
+    queries = []
+
+    def mock_search(query, key=None):
+        queries.append(query)
+        return [{'uuid': 'uuid2'}] if 'status=deleted' in query else []
+
+    monkeypatch.setattr(audit_checks.ff_utils, 'search_metadata', mock_search)
+    table = audit_checks._get_status_table(connection, 7)
+    assert table['items'] == {'uuid1': ['released', 'file_fastq']}
+    assert table['created'] == created
+    assert table['date'] != '2024-01-01 10:00'
+    assert all('last_modified.date_modified.from=2024-01-01 10:00' in q for q in queries)
+
+
+def test_status_table_rebuilt_when_old(monkeypatch):
+    connection = MockConnection()
+    created = (datetime.datetime.utcnow() - datetime.timedelta(days=8)).isoformat()
+    cache_utils.put_cache(connection, 'check_status_mismatch', 'status_table', {
+        'created': created, 'date': '2024-01-01 10:00', 'items': {'uuid1': ['released', 'file_fastq']}})
+    monkeypatch.setattr(audit_checks.ff_utils, 'search_metadata', lambda *args, **kwargs: [])
+    table = audit_checks._get_status_table(connection, 7)
+    assert table['items'] == {}
+    assert table['created'] > created
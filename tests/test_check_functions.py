@@ -1,7 +1,17 @@
 import pytest
+import bisect
+import datetime
 import difflib
+import itertools
+import random
+from types import SimpleNamespace
+from chalicelib_fourfront.checks import badge_checks, system_checks, wrangler_checks
 from chalicelib_fourfront.checks.wrangler_checks import (
+    find_entrez_gene_status,
+    find_entrez_geneid,
+    find_similar_label_pairs,
     get_tokens_to_string,
+    split_entrez_gene_records,
     string_label_similarity
 )
 
@@ -27,3 +37,170 @@ def test_get_tokens_to_string(in_out_cmp_score):
 def test_string_label_similarity(in_out_cmp_score):
     for tup in in_out_cmp_score:
         assert round(string_label_similarity(tup[0], tup[2]), 2) == tup[3]
+
+
+GENE_REPORT = """Entrezgene ::= {{
+  track-info {{
+    geneid {gid},
+    status {status},
+    create-date
+      std {{
+        year 1999
+      }}
+  }},
+  type protein-coding
+}}"""
+
+
+def test_split_entrez_gene_records():
+    report = '\n'.join([GENE_REPORT.format(gid='1', status='live'),
+                        GENE_REPORT.format(gid='2', status='discontinued')])
+    records = list(split_entrez_gene_records(report.split('\n')))
+    assert len(records) == 2
+    assert [find_entrez_geneid(r) for r in records] == ['1', '2']
+    assert [find_entrez_gene_status(r) for r in records] == ['live', 'discontinued']
+
+
+def test_fetch_entrez_gene_statuses(monkeypatch):
+    class MockResponse(object):
+        status_code = 200
+
+        def __init__(self, text):
+            self.text = text
+
+        def iter_lines(self, decode_unicode=False):
+            return iter(self.text.split('\n'))
+
+    requested = []
+
+    def mock_post(url, data=None, **kwargs):
+        ids = data['id'].split(',')
+        requested.append(ids)
+        if 'bad' in ids:
+            return MockResponse('Error: id is not valid')
+        return MockResponse('\n'.join(GENE_REPORT.format(gid=gid, status='live' if gid != '3' else 'secondary')
+                                      for gid in ids if gid != '4'))
+
+    monkeypatch.setattr(wrangler_checks.requests, 'post', mock_post)
+    statuses = wrangler_checks.fetch_entrez_gene_statuses(['1', '3', '4', 'bad'])
+    assert statuses == {'1': 'live', '3': 'secondary', '4': 'invalid', 'bad': 'invalid'}
+    assert requested == [['1', '3', '4', 'bad'], ['1', '3'], ['4', 'bad'], ['4'], ['bad']]
+
+
+def test_fetch_entrez_gene_statuses_refetches_missing_records(monkeypatch):
+    class MockResponse(object):
+        status_code = 200
+
+        def __init__(self, text):
+            self.text = text
+
+        def iter_lines(self, decode_unicode=False):
+            return iter(self.text.split('\n'))
+
+    requested = []
+
+    def mock_post(url, data=None, **kwargs):
+        ids = data['id'].split(',')
+        requested.append(ids)
+        # the multi gene response is cut short after the first record
+        return MockResponse('\n'.join(GENE_REPORT.format(gid=gid, status='live')
+                                      for gid in ids[:1] if gid != '9'))
+
+    monkeypatch.setattr(wrangler_checks.requests, 'post', mock_post)
+    monkeypatch.setattr(wrangler_checks.time, 'sleep', lambda seconds: None)
+    statuses = wrangler_checks.fetch_entrez_gene_statuses(['1', '2', '9'])
+    assert statuses == {'1': 'live', '2': 'live', '9': 'invalid'}
+    assert requested == [['1', '2', '9'], ['2'], ['9']]
+
+
+def test_find_similar_label_pairs_matches_all_pairs():
+    labels = ['John Smith', 'Jon Smith', 'Jon Smyth', 'Maria Garcia', 'Mario Garsia', 'Li Wang',
+              'Lee Wong', 'Anne-Marie Lee', 'Anne Marie Lee', 'john smith', 'Petra Kim', 'Peter Kim']
+    expected = []
+    for (n1, label1), (n2, label2) in itertools.combinations(enumerate(labels), 2):
+        score = round(string_label_similarity(label1, label2) * 100)
+        if score > 85:
+            expected.append((n1, n2, score))
+    assert find_similar_label_pairs(labels, min_score=85) == expected
+    assert (0, 9, 100) in expected
+
+
+def test_compare_badges_and_messages_replaces_at_ids_with_one_search(monkeypatch):
+    searches = []
+
+    def mock_search(query, key=None):
+        searches.append(query)
+        if query.startswith('search/?type=Item'):
+            return [{'@id': '/files/4DNFI1/', 'display_title': '4DNFI1.fastq.gz'},
+                    {'@id': '/labs/lab-a/', 'display_title': 'Lab A'}]
+        return [{'@id': '/sets/S1/', 'badges': [{'badge': '/badges/b/', 'messages': ['Files: 4DNFI1.fastq.gz']}]}]
+
+    def mock_get(at_id, key=None, add_on=''):
+        return {'@id': '/biosamples/B1/', 'display_title': 'Biosample 1'}
+
+    monkeypatch.setattr(badge_checks.ff_utils, 'search_metadata', mock_search)
+    monkeypatch.setattr(badge_checks.ff_utils, 'get_metadata', mock_get)
+    to_add, to_remove, to_edit, ok = badge_checks.compare_badges_and_messages(
+        {'/sets/S1/': ['Files: /files/4DNFI1/'],
+         '/sets/S2/': ['Lab: /labs/lab-a/ and /files/4DNFI1/', 'Biosample: /biosamples/B1/']},
+        'ExperimentSetReplicate', 'b', None, replace_messages=True)
+    assert ok == ['/sets/S1/']
+    assert to_add == {'/sets/S2/': ['Lab: Lab A and 4DNFI1.fastq.gz', 'Biosample: Biosample 1']}
+    assert len([q for q in searches if q.startswith('search/?type=Item')]) == 1
+
+
+def test_get_facet_counts(monkeypatch):
+    add_ons = []
+
+    def mock_get_metadata(obj_id, key=None, add_on=''):
+        add_ons.append(add_on)
+        return {'facets': [
+            {'field': 'type', 'terms': [{'key': 'Biosource', 'doc_count': 3}]},
+            {'field': 'cell_line_tier', 'terms': [{'key': 'Tier 1', 'doc_count': 2},
+                                                  {'key': 'Tier 9', 'doc_count': 1},
+                                                  {'key': 'Tier 2', 'doc_count': 0}]}
+        ]}
+
+    monkeypatch.setattr(wrangler_checks.ff_utils, 'get_metadata', mock_get_metadata)
+    assert wrangler_checks.get_facet_counts('type=Biosource', 'cell_line_tier', None) == {'Tier 1': 2, 'Tier 9': 1}
+    assert add_ons == ['type=Biosource&additional_facet=cell_line_tier&limit=0']
+    # no facet for the field
+    assert wrangler_checks.get_facet_counts('type=Biosource', 'modifications.modification_type', None) is None
+    # possibly truncated facet
+    monkeypatch.setattr(wrangler_checks, 'max_facet_terms', 2)
+    assert wrangler_checks.get_facet_counts('type=Biosource', 'cell_line_tier', None) is None
+
+
+def test_resolve_ip_geo(monkeypatch):
+    geos = {'1.1.1.1': SimpleNamespace(ok=True, country='US', city='Boston', state='Massachusetts'),
+            '2.2.2.2': SimpleNamespace(ok=True, country='France', city=None, state=None),
+            '3.3.3.3': SimpleNamespace(ok=False, country=None, city=None, state=None)}
+
+    def mock_ip(ip, session=None):
+        if ip not in geos:
+            raise ValueError('bad ip')
+        return geos[ip]
+
+    monkeypatch.setattr(system_checks.geocoder, 'ip', mock_ip)
+    assert system_checks.resolve_ip_geo(iter(['1.1.1.1', '2.2.2.2', '3.3.3.3', 'bad']), 60, workers=2) == {
+        '1.1.1.1': 'Boston, Massachusetts//US', '2.2.2.2': 'Unknown//France', '3.3.3.3': None, 'bad': None}
+    # no lookups after the time limit
+    assert system_checks.resolve_ip_geo(['1.1.1.1'], 60, start=0) == {'1.1.1.1': None}
+    # no lookups once rate limited
+    geos['3.3.3.3'].status_code = 429
+    assert system_checks.resolve_ip_geo(['1.1.1.1', '3.3.3.3', '2.2.2.2'], 60, workers=1) == {
+        '1.1.1.1': 'Boston, Massachusetts//US', '3.3.3.3': None, '2.2.2.2': None}
+
+
+def test_in_range_window_matches_linear_scan():
+    rand = random.Random(1)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    window = datetime.timedelta(hours=1)
+    dates = []
+    for _ in range(500):
+        date = start + datetime.timedelta(minutes=rand.randint(0, 3000))
+        expected = any(abs(date - ref) < window for ref in dates)
+        assert system_checks.in_range_window(dates, date, window) == expected
+        if not expected:
+            bisect.insort(dates, date)
+    assert not system_checks.in_range_window(dates, dates[0] - window, window)
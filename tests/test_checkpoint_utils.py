@@ -0,0 +1,60 @@
+from chalicelib_fourfront.checks.helpers.checkpoint_utils import (
+    checkpoint_scope,
+    get_checkpoint,
+    resume_after_checkpoint,
+    rotate_to_checkpoint,
+    set_checkpoint
+)
+
+
+class MockCheckResult(object):
+    def __init__(self, latest=None):
+        self.full_output = None
+        self.latest = latest
+
+    def get_latest_result(self):
+        return self.latest
+
+
+class MockActionResult(object):
+    def __init__(self, latest=None):
+        self.output = None
+        self.latest = latest
+
+    def get_latest_result(self):
+        return self.latest
+
+
+def test_set_and_get_checkpoint():
+    check = MockCheckResult()
+    set_checkpoint(check, '4DNESAAAAAAA')
+    assert check.full_output == {'checkpoint': {'cursor': '4DNESAAAAAAA', 'scope': None}}
+    next_check = MockCheckResult(latest={'full_output': check.full_output})
+    assert get_checkpoint(next_check) == '4DNESAAAAAAA'
+    set_checkpoint(check, None)
+    assert check.full_output == {}
+    assert get_checkpoint(MockCheckResult()) is None
+    assert get_checkpoint(MockCheckResult(latest={'full_output': ['not', 'a', 'dict']})) is None
+
+
+def test_checkpoint_scope():
+    action = MockActionResult()
+    scope = checkpoint_scope([{'a': 1}], None)
+    assert scope == checkpoint_scope([{'a': 1}], None)
+    assert scope != checkpoint_scope([{'a': 2}], None)
+    set_checkpoint(action, {'runs': 3}, scope)
+    next_action = MockActionResult(latest={'output': action.output})
+    assert get_checkpoint(next_action, scope) == {'runs': 3}
+    assert get_checkpoint(next_action, 'other') is None
+
+
+def test_rotate_and_resume():
+    items = ['a', 'b', 'c', 'd']
+    assert rotate_to_checkpoint(items, 'b') == ['c', 'd', 'a', 'b']
+    assert rotate_to_checkpoint(items, 'x') == items
+    assert rotate_to_checkpoint(items, None) == items
+    assert resume_after_checkpoint(items, 'b') == ['c', 'd']
+    assert resume_after_checkpoint(items, 'd') == []
+    assert resume_after_checkpoint(items, 'x') == items
+    sets = [{'accession': 'a'}, {'accession': 'b'}]
+    assert rotate_to_checkpoint(sets, 'a', key=lambda x: x['accession']) == [{'accession': 'b'}, {'accession': 'a'}]
@@ -0,0 +1,88 @@
+from chalicelib_fourfront.checks import es_checks
+
+
+class MockPaginator(object):
+    def __init__(self, keys):
+        self.keys = keys
+        self.kwargs = None
+
+    def paginate(self, **kwargs):
+        self.kwargs = kwargs
+        keys = [k for k in sorted(self.keys) if k.startswith(kwargs['Prefix']) and k > kwargs.get('StartAfter', '')]
+        for i in range(0, len(keys), 2):
+            yield {'Contents': [{'Key': k} for k in keys[i:i + 2]]}
+        if not keys:
+            yield {}
+
+
+class MockClient(object):
+    def __init__(self, keys):
+        self.paginator = MockPaginator(keys)
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return self.paginator
+
+
+class MockS3(object):
+    bucket = 'test-bucket'
+
+    def __init__(self, keys):
+        self.client = MockClient(keys)
+
+
+def test_iter_s3_keys_pages_and_resumes():
+    s3 = MockS3(['a/1', 'a/2', 'a/3', 'b/1', 'a/4'])
+    assert list(es_checks.iter_s3_keys(s3, 'a/')) == ['a/1', 'a/2', 'a/3', 'a/4']
+    assert list(es_checks.iter_s3_keys(s3, 'a/', start_after='a/2')) == ['a/3', 'a/4']
+    assert s3.client.paginator.kwargs == {'Bucket': 'test-bucket', 'Prefix': 'a/', 'StartAfter': 'a/2'}
+    assert list(es_checks.iter_s3_keys(s3, 'c/')) == []
+
+
+def test_iter_batches():
+    assert list(es_checks.iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(es_checks.iter_batches([], 2)) == []
+
+
+def test_bulk_put_objects(monkeypatch):
+    sent = []
+
+    def mock_streaming_bulk(client, actions, **kwargs):
+        for action in actions:
+            sent.append(action)
+            yield True, {'index': {'result': 'updated' if action['_id'] == 'b' else 'created'}}
+
+    class MockES(object):
+        es = 'client'
+        index = 'test-index'
+
+    monkeypatch.setattr(es_checks.es_helpers, 'streaming_bulk', mock_streaming_bulk)
+    n_created = es_checks.bulk_put_objects(MockES(), [('a', {'x': 1}), ('b', {'x': 2}), ('c', b'not json')])
+    assert n_created == 1
+    assert [action['_id'] for action in sent] == ['a', 'b']
+    assert sent[0] == {'_index': 'test-index', '_id': 'a', '_source': {'x': 1}}
+    # no es index configured
+    MockES.index = None
+    assert es_checks.bulk_put_objects(MockES(), [('d', {'x': 3})]) == 0
+    assert len(sent) == 2
+
+
+def test_list_old_result_keys():
+    s3 = MockS3(['my_check/2018-10-15T19:08:32.734656.json',
+                 'my_check/2018-10-16T19:08:32.734656.json',
+                 'my_check/2018-10-17T19:08:32.734656.json',
+                 'my_check/latest.json',
+                 'my_check/primary.json',
+                 'my_check_two/2018-10-15T19:08:32.734656.json'])
+    prior_date = es_checks.datetime.datetime(2018, 10, 16, 20)
+    assert es_checks.list_old_result_keys(s3, 'my_check', prior_date) == [
+        'my_check/2018-10-15T19:08:32.734656.json',
+        'my_check/2018-10-16T19:08:32.734656.json'
+    ]
+
+
+def test_is_not_primary_result():
+    assert es_checks.is_not_primary_result({'kwargs': {'primary': False}})
+    assert es_checks.is_not_primary_result({'kwargs': {}})
+    assert not es_checks.is_not_primary_result({'kwargs': {'primary': True}})
+    assert not es_checks.is_not_primary_result(None)
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+from chalicelib_fourfront.checks.helpers import google_utils
+from chalicelib_fourfront.checks.helpers.google_utils import DEFAULT_GOOGLE_API_CONFIG, GoogleAPISyncer
+
+
+def fake_report(dimensions, rows, row_count=None):
+    return SimpleNamespace(
+        dimension_headers=[SimpleNamespace(name=d) for d in dimensions],
+        metric_headers=[SimpleNamespace(name='sessions', type_=SimpleNamespace(name='TYPE_INTEGER'))],
+        rows=[SimpleNamespace(dimension_values=[SimpleNamespace(value=v) for v in dims],
+                              metric_values=[SimpleNamespace(value=str(metric))]) for dims, metric in rows],
+        row_count=len(rows) if row_count is None else row_count
+    )
+
+
+class FakeClient(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def batch_run_reports(self, batch_request):
+        self.requests.append(batch_request)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return SimpleNamespace(reports=response)
+
+
+@pytest.fixture
+def analytics():
+    owner = SimpleNamespace(extra_config=DEFAULT_GOOGLE_API_CONFIG, access_key={}, server='http://ff')
+    api = object.__new__(GoogleAPISyncer.AnalyticsAPI)
+    api.owner = owner
+    api.property_id = '1'
+    api._request_slots = google_utils.threading.BoundedSemaphore(1)
+    api.quota_wait = 0
+    return api
+
+
+def test_query_reports_by_date_splits_rows_by_day(analytics):
+    analytics._api = FakeClient([[
+        fake_report(['country', 'date'], [(['US', '20240101'], 3), (['FR', '20240103'], 1), (['US', '20240103'], 2)]),
+        fake_report(['country', 'date'], [(['US', '20240101'], 3)], row_count=2)
+    ]])
+    by_date, truncated = analytics.query_reports_by_date(['sessions_by_country', 'file_downloads_by_country'],
+                                                         '2024-01-01', '2024-01-03')
+    assert truncated == ['file_downloads_by_country']
+    assert by_date['2024-01-01'] == {'sessions_by_country': [{'ga:country': 'US', 'ga:sessions': 3}]}
+    assert by_date['2024-01-02'] == {'sessions_by_country': []}
+    assert by_date['2024-01-03']['sessions_by_country'] == [{'ga:country': 'FR', 'ga:sessions': 1},
+                                                            {'ga:country': 'US', 'ga:sessions': 2}]
+    request = analytics._api.requests[0].requests[0]
+    assert request.date_ranges[0].start_date == '2024-01-01'
+    assert [d.name for d in request.dimensions] == ['country', 'date']
+
+
+def test_batch_run_reports_retries_quota_errors(analytics):
+    analytics._api = FakeClient([ResourceExhausted('quota'), ['r1', 'r2', 'r3', 'r4', 'r5'], ['r6']])
+    requests = [analytics.format_report_request('sessions_by_country', start_date='2024-01-01',
+                                                 end_date='2024-01-01')] * 6
+    assert analytics.batch_run_reports(requests) == ['r1', 'r2', 'r3', 'r4', 'r5', 'r6']
+    assert [len(batch.requests) for batch in analytics._api.requests] == [5, 5, 1]
+
+
+def test_post_tracking_items_deletes_later_days_on_failure(analytics, monkeypatch):
+    names = analytics.get_report_provider_method_names()
+    report_data_list = [{'reports': {name: [] for name in names}, 'for_date': day, 'date_increment': 'daily'}
+                        for day in ['2024-01-01', '2024-01-02', '2024-01-03']]
+    deleted = []
+    posted = []
+
+    def mock_post(item, schema, key=None):
+        posted.append(item['google_analytics']['for_date'])
+        if item['google_analytics']['for_date'] == '2024-01-02':
+            raise Exception('Bad status code for POST request for /tracking-items: 503. Reason: busy')
+        return {'@graph': [{'uuid': item['google_analytics']['for_date'], 'google_analytics': item['google_analytics']}]}
+
+    def mock_patch(patch, obj_id, key=None):
+        deleted.append((obj_id, patch['status']))
+
+    monkeypatch.setattr(google_utils.ff_utils, 'post_metadata', mock_post)
+    monkeypatch.setattr(google_utils.ff_utils, 'patch_metadata', mock_patch)
+    with pytest.raises(Exception, match='503'):
+        analytics.post_tracking_items(report_data_list)
+    assert deleted == [('2024-01-03', 'deleted')]
+    # the failed POST is not repeated, since the item may have been created
+    assert sorted(posted) == ['2024-01-01', '2024-01-02', '2024-01-03']
+
+    # a failed delete does not hide the original error
+    def failing_patch(patch, obj_id, key=None):
+        raise Exception('Bad status code for PATCH request: 500')
+
+    monkeypatch.setattr(google_utils.ff_utils, 'patch_metadata', failing_patch)
+    with pytest.raises(Exception, match='503'):
+        analytics.post_tracking_items(report_data_list)
+    assert [item['uuid'] for item in analytics.post_tracking_items(report_data_list[:1])] == ['2024-01-01']
@@ -0,0 +1,96 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from chalicelib_fourfront.checks.helpers import higlass_utils
+
+
+class MockResponse(object):
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class MockSession(object):
+    def __init__(self, registered, fail_status=None):
+        self.registered = registered
+        self.fail_status = fail_status
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(params['d'])
+        if self.fail_status:
+            return MockResponse(self.fail_status)
+        info = {}
+        for uid in params['d']:
+            info[uid] = {'name': uid} if uid in self.registered else {'error': 'No such tileset'}
+        return MockResponse(200, info)
+
+    def head(self, url):
+        if url == 'raise':
+            raise Exception('connection error')
+        return MockResponse(200 if url in self.registered else 404)
+
+
+def test_find_unregistered_tilesets_batches_uids():
+    session = MockSession(registered=['a', 'c', 'e'])
+    unregistered = higlass_utils.find_unregistered_tilesets(
+        session, 'https://higlass', ['a', 'b', 'c', 'd', 'e', 'a'], workers=2, batch_size=2)
+    assert unregistered == {'b', 'd'}
+    assert sorted(session.requests) == [['a', 'b'], ['c', 'd'], ['e']]
+
+
+def test_find_unregistered_tilesets_failed_request():
+    session = MockSession(registered=['a'], fail_status=500)
+    assert higlass_utils.find_unregistered_tilesets(session, 'https://higlass', ['a', 'b']) == {'a', 'b'}
+
+
+def test_does_url_exist():
+    session = MockSession(registered=['https://found'])
+    assert higlass_utils.does_url_exist(session, 'https://found')
+    assert not higlass_utils.does_url_exist(session, 'https://missing')
+    assert not higlass_utils.does_url_exist(session, 'raise')
+
+
+class MockPostSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.n_posts = 0
+
+    def post(self, url, **kwargs):
+        self.n_posts += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def connect_error():
+    return requests.exceptions.ConnectionError(MaxRetryError(None, 'url', NewConnectionError(None, 'refused')))
+
+
+def test_post_with_backoff_retries_unprocessed_requests(monkeypatch):
+    waits = []
+    monkeypatch.setattr(higlass_utils.time, 'sleep', waits.append)
+    session = MockPostSession([connect_error(), MockResponse(503), MockResponse(429), MockResponse(201)])
+    res = higlass_utils.post_with_backoff(session, 'https://higlass/api/v1/link_tile/', wait=1)
+    assert res.status_code == 201
+    assert waits == [1, 2, 4]
+
+
+def test_post_with_backoff_gives_up(monkeypatch):
+    monkeypatch.setattr(higlass_utils.time, 'sleep', lambda x: None)
+    session = MockPostSession([MockResponse(503)] * 3)
+    assert higlass_utils.post_with_backoff(session, 'url', retries=2).status_code == 503
+    assert session.n_posts == 3
+    # the server may have processed the request: not retried
+    for response in [MockResponse(500), MockResponse(400)]:
+        session = MockPostSession([response])
+        assert higlass_utils.post_with_backoff(session, 'url').status_code == response.status_code
+        assert session.n_posts == 1
+    session = MockPostSession([requests.exceptions.ReadTimeout()])
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        higlass_utils.post_with_backoff(session, 'url')
+    assert session.n_posts == 1
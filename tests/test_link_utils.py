@@ -0,0 +1,64 @@
+import threading
+import time
+from chalicelib_fourfront.checks.helpers import link_utils
+
+
+class MockResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_request_url_falls_back_to_get():
+    class MockSession(object):
+        def head(self, url, **kwargs):
+            return MockResponse(405)
+
+        def get(self, url, **kwargs):
+            return MockResponse(200)
+
+    assert link_utils.request_url(MockSession(), 'https://example.org') == {'status': 200}
+
+
+def test_request_url_timeout():
+    class MockSession(object):
+        def head(self, url, **kwargs):
+            raise link_utils.requests.exceptions.Timeout()
+
+    assert link_utils.request_url(MockSession(), 'https://example.org') == {'timeout': True}
+
+
+def test_check_urls_dedupes_and_limits_per_host(monkeypatch):
+    requested = []
+    running = {}
+    max_running = {}
+    lock = threading.Lock()
+
+    def mock_request_url(session, url, timeout=2):
+        host = url.split('/')[2]
+        with lock:
+            requested.append(url)
+            running[host] = running.get(host, 0) + 1
+            max_running[host] = max(max_running.get(host, 0), running[host])
+        time.sleep(0.01)
+        with lock:
+            running[host] -= 1
+        return {'status': 200}
+
+    monkeypatch.setattr(link_utils, 'request_url', mock_request_url)
+    urls = ['https://a.org/%s' % i for i in range(10)] + ['https://b.org/1', 'https://a.org/1']
+    results = link_utils.check_urls(urls, workers=8, per_host=2)
+    assert len(requested) == 11
+    assert set(results) == set(urls)
+    assert max_running['a.org'] <= 2
+
+
+def test_link_cache_keeps_recent_working_links():
+    old = (link_utils.datetime.datetime.utcnow() - link_utils.datetime.timedelta(days=10)).isoformat()
+    recent = link_utils.datetime.datetime.utcnow().isoformat()
+    cache = link_utils.LinkCache({'https://old': [{'status': 200}, old],
+                                  'https://recent': [{'status': 200}, recent]}, ttl_days=7)
+    assert cache.get('https://old') is None
+    assert cache.get('https://recent') == {'status': 200}
+    cache.update({'https://broken': {'status': 404}, 'https://new': {'status': 200}})
+    assert cache.get('https://broken') is None
+    assert cache.get('https://new') == {'status': 200}
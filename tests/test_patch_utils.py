@@ -0,0 +1,37 @@
+from chalicelib_fourfront.checks.helpers import patch_utils
+
+
+CLIENT_ERROR = Exception('Bad status code for PATCH request for https://data.4dn/abc: 422. Reason: invalid')
+
+
+def test_bulk_patch_logs():
+    calls = []
+
+    def fail():
+        calls.append('b')
+        raise CLIENT_ERROR
+
+    tasks = [('patch', 'a', lambda: None), ('patch', 'b', fail),
+             ('add', 'c', lambda: 'c already patched'), ('patch', 'd', lambda: None)]
+    logs = {'patch_success': [], 'patch_failure': []}
+    assert patch_utils.bulk_patch(tasks, logs, None, workers=2)
+    assert logs == {'patch_success': ['a', 'd'], 'patch_failure': ['b\n' + str(CLIENT_ERROR)],
+                    'add_failure': ['c already patched']}
+    # failed tasks are not repeated, ff_utils already retries requests
+    assert calls == ['b']
+
+
+def test_bulk_patch_time_limit(monkeypatch):
+    clock = iter([0, 1, 10, 11])
+    monkeypatch.setattr(patch_utils.time, 'time', lambda: next(clock))
+    tasks = [('patch', label, lambda: None) for label in 'abc']
+    logs = {}
+    assert not patch_utils.bulk_patch(tasks, logs, 5, workers=1)
+    assert logs == {'patch_success': ['a'], 'not_attempted': ['b', 'c']}
+
+
+def test_bulk_patch_time_limit_from_start(monkeypatch):
+    monkeypatch.setattr(patch_utils.time, 'time', lambda: 100)
+    logs = {}
+    assert not patch_utils.bulk_patch([('patch', 'a', lambda: None)], logs, 30, start=60)
+    assert logs == {'not_attempted': ['a']}
@@ -0,0 +1,82 @@
+from chalicelib_fourfront.checks.helpers import pubmed_utils
+
+
+class MockResponse(object):
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.text = body if isinstance(body, str) else ''
+
+    def json(self):
+        return self.body
+
+
+class MockSession(object):
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def post(self, url, data=None):
+        utility = url.split('/')[-1]
+        self.requests.append((utility, data))
+        return MockResponse(self.responses[utility](data))
+
+
+class NoWait(object):
+    def acquire(self):
+        pass
+
+
+def test_token_bucket_spaces_requests(monkeypatch):
+    clock = [100.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(round(seconds, 3))
+        clock[0] += seconds
+
+    monkeypatch.setattr(pubmed_utils.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(pubmed_utils.time, 'sleep', sleep)
+    bucket = pubmed_utils.TokenBucket(rate=4)
+    for _ in range(3):
+        bucket.acquire()
+    assert waits == [0.25, 0.25]
+
+
+def test_search_titles_batches_and_matches():
+    titles = ['Loops in the Genome', 'A single-cell Hi-C map']
+    session = MockSession({
+        'esearch.fcgi': lambda data: {'esearchresult': {'count': '3', 'webenv': 'W', 'querykey': '1'}},
+        'esummary.fcgi': lambda data: {'result': {
+            'uids': ['11', '22', '33'],
+            '11': {'title': 'Loops in the human genome.'},
+            '22': {'title': 'A single-cell Hi-C map of the mouse brain.'},
+            '33': {'title': 'Unrelated loops.'}}}
+    })
+    client = pubmed_utils.PubMedClient(limiter=NoWait(), session=session)
+    assert client.search_titles(titles) == {'Loops in the Genome': ['11'], 'A single-cell Hi-C map': ['22']}
+    assert [r[0] for r in session.requests] == ['esearch.fcgi', 'esummary.fcgi']
+    term = session.requests[0][1]['term']
+    assert term.startswith('(loops[Title] AND in[Title] AND the[Title] AND genome[Title]) OR (a[Title]')
+    assert session.requests[1][1]['WebEnv'] == 'W'
+
+
+def test_search_titles_failed_request():
+    session = MockSession({'esearch.fcgi': lambda data: None})
+    session.post = lambda url, data=None: MockResponse({}, status_code=500)
+    client = pubmed_utils.PubMedClient(limiter=NoWait(), session=session)
+    assert client.search_titles(['Some title']) == {'Some title': None}
+    assert client.search_authors(['Smith J']) is None
+
+
+def test_find_geo_datasets():
+    session = MockSession({
+        'elink.fcgi': lambda data: {'linksets': [
+            {'ids': [11], 'linksetdbs': [{'links': ['200001', '200002']}]},
+            {'ids': [22], 'linksetdbs': []}]},
+        'efetch.fcgi': lambda data: '1. Series GSE1234 ... 2. Series GSE5678'
+    })
+    client = pubmed_utils.PubMedClient(limiter=NoWait(), session=session)
+    assert client.find_geo_datasets(['11', '22']) == {'11': ['GSE1234', 'GSE5678']}
+    assert session.requests[0][1]['id'] == ['11', '22']
+    assert session.requests[1][1]['id'] == '200001,200002'
@@ -0,0 +1,336 @@
+import pytest
+from datetime import datetime, timedelta
+from chalicelib_fourfront.checks.helpers import wfr_utils
+from chalicelib_fourfront.checks.helpers.wfr_utils import (
+    FileMetadataResolver,
+    MetadataLibrary,
+    find_item,
+    run_input_files
+)
+
+
+@pytest.fixture
+def all_items():
+    return {
+        'file_fastq': [{'@id': '/files-fastq/4DNFIAAAAAAA/', 'uuid': 'f1', 'accession': '4DNFIAAAAAAA'}],
+        'file_processed': [{'@id': '/files-processed/4DNFIBBBBBBB/', 'uuid': 'f2', 'accession': '4DNFIBBBBBBB'}],
+        'workflow_run_awsem': [{'@id': '/workflow-runs-awsem/w1/', 'uuid': 'w1'}],
+        'quality_metric_fastqc': [{'@id': '/quality-metrics-fastqc/q1/', 'uuid': 'q1'}],
+        'experiment_seq': [{'@id': '/experiments-seq/4DNEXCCCCCCC/', 'uuid': 'e1', 'accession': '4DNEXCCCCCCC'}]
+    }
+
+
+def test_metadata_library_indexes(all_items):
+    library = MetadataLibrary(all_items)
+    fastq = all_items['file_fastq'][0]
+    assert library.get('/files-fastq/4DNFIAAAAAAA/') is fastq
+    assert library.get('f1') is fastq
+    assert library.get('4DNEXCCCCCCC') is all_items['experiment_seq'][0]
+    assert len(library['files']) == 6
+    assert 'w1' in library['wfrs'] and 'q1' in library['qcs']
+    assert 'e1' not in library['files'] and 'e1' in library
+    assert library['file_fastq'] == all_items['file_fastq']
+    with pytest.raises(KeyError):
+        library.get('/files-fastq/missing/')
+
+
+def test_find_item_list_and_index(all_items):
+    library = MetadataLibrary(all_items)
+    processed = all_items['file_processed'][0]
+    assert find_item(all_items['file_processed'], '/files-processed/4DNFIBBBBBBB/') is processed
+    assert find_item(all_items['file_processed'], 'f2', 'uuid') is processed
+    assert find_item(library.files, 'f2', 'uuid') is processed
+    assert find_item(library.wfrs, 'w1', 'uuid') is all_items['workflow_run_awsem'][0]
+
+
+def test_prefetch_set_libraries_pages_sets(monkeypatch):
+    expanded = []
+
+    def mock_expand(uuids, key, **kwargs):
+        expanded.append(uuids)
+        return {'experiment_set_replicate': [{'@id': '/sets/%s/' % i, 'uuid': i} for i in uuids]}, uuids
+
+    monkeypatch.setattr(wfr_utils.ff_utils, 'expand_es_metadata', mock_expand)
+    sets = [{'uuid': str(i)} for i in range(5)]
+    result = list(wfr_utils.prefetch_set_libraries(sets, {}, page_size=2))
+    assert expanded == [['0', '1'], ['2', '3'], ['4']]
+    assert [a_set for a_set, _ in result] == sets
+    assert result[0][1] is result[1][1]
+    assert result[2][1].get('3')['uuid'] == '3'
+    assert list(wfr_utils.prefetch_set_libraries([], {})) == []
+
+
+def test_cached_metadata_ttl_and_clear():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'accepted_pipelines': ['HiC_Pipeline_0.2.6']}
+
+    wfr_utils.clear_metadata_cache()
+    first = wfr_utils.cached_metadata('etype', fetch)
+    first['accepted_pipelines'].append('mutated')
+    assert wfr_utils.cached_metadata('etype', fetch) == {'accepted_pipelines': ['HiC_Pipeline_0.2.6']}
+    assert len(calls) == 1
+    wfr_utils.cached_metadata('etype', fetch, ttl=-1)
+    assert len(calls) == 2
+    wfr_utils.clear_metadata_cache()
+    wfr_utils.cached_metadata('etype', fetch)
+    assert len(calls) == 3
+    wfr_utils.clear_metadata_cache()
+
+
+class MockAction(object):
+    description = None
+    output = None
+    status = None
+
+    def __init__(self, latest=None):
+        self.latest = latest
+
+    def get_latest_result(self):
+        return self.latest
+
+
+def test_start_tasks_logs_each_run(monkeypatch):
+    s3_utils = []
+
+    def mock_start_missing_run(run_info, auth, env, fs_env, resolver=None, s3_util=None):
+        s3_utils.append(s3_util)
+        if run_info[3] == 'bad':
+            raise ValueError('no attribution file')
+        return 'https://tibanna/' + run_info[3]
+
+    shared_s3_util = object()
+    monkeypatch.setattr(wfr_utils, 's3Utils', lambda env: shared_s3_util)
+    monkeypatch.setattr(wfr_utils, 'setup_default_boto3_session', lambda: None)
+    monkeypatch.setattr(wfr_utils.FileMetadataResolver, 'prefetch', lambda self, identifiers: None)
+    monkeypatch.setattr(wfr_utils, 'start_missing_run', mock_start_missing_run)
+    missing_runs = [{'4DNESAAAAAAA': [['step1', ['bwa-mem', 'human', {}], {}, 'good%s' % i] for i in range(5)]},
+                    {'4DNESBBBBBBB': [['step2', ['hi-c-processing-bam', 'human', {}], {}, 'bad']]}]
+    action = wfr_utils.start_tasks(missing_runs, [], MockAction(), {}, 'data', 'data',
+                                   datetime.utcnow(), max_workers=2)
+    assert sorted(i[1] for i in action.output['started_runs']) == ['https://tibanna/good%s' % i for i in range(5)]
+    assert action.output['failed_runs'] == [['4DNESBBBBBBB started running step2 with bad', 'no attribution file']]
+    assert action.status == 'DONE'
+    # the workers share the s3Utils created before they start
+    assert s3_utils == [shared_s3_util] * 6
+
+
+def test_start_tasks_stops_at_lambda_limit(monkeypatch):
+    monkeypatch.setattr(wfr_utils, 's3Utils', lambda env: None)
+    monkeypatch.setattr(wfr_utils, 'setup_default_boto3_session', lambda: None)
+    monkeypatch.setattr(wfr_utils.FileMetadataResolver, 'prefetch', lambda self, identifiers: None)
+    monkeypatch.setattr(wfr_utils, 'start_missing_run', lambda *args: pytest.fail('should not start'))
+    missing_runs = [{'4DNESAAAAAAA': [['step1', ['bwa-mem', 'human', {}], {}, 'tag']]}]
+    start = datetime.utcnow() - timedelta(seconds=wfr_utils.lambda_limit + 1)
+    action = wfr_utils.start_tasks(missing_runs, [], MockAction(), {}, 'data', 'data', start)
+    assert action.output['started_runs'] == []
+    assert action.description.startswith('Did not complete action due to time limitations.')
+    assert action.output['checkpoint']['cursor'] == {'runs': 0, 'patches': 0}
+
+
+def test_start_tasks_resumes_from_checkpoint(monkeypatch):
+    started = []
+
+    def mock_start_missing_run(run_info, auth, env, fs_env, resolver=None, s3_util=None):
+        started.append(run_info[3])
+        return 'https://tibanna/' + run_info[3]
+
+    monkeypatch.setattr(wfr_utils, 's3Utils', lambda env: None)
+    monkeypatch.setattr(wfr_utils, 'setup_default_boto3_session', lambda: None)
+    monkeypatch.setattr(wfr_utils.FileMetadataResolver, 'prefetch', lambda self, identifiers: None)
+    monkeypatch.setattr(wfr_utils, 'start_missing_run', mock_start_missing_run)
+    missing_runs = [{'4DNESAAAAAAA': [['step1', ['bwa-mem', 'human', {}], {}, 'tag%s' % i] for i in range(3)]}]
+    scope = wfr_utils.checkpoint_scope(missing_runs, [])
+    latest = {'output': {'checkpoint': {'cursor': {'runs': 2, 'patches': 0}, 'scope': scope}}}
+    action = wfr_utils.start_tasks(missing_runs, [], MockAction(latest), {}, 'data', 'data', datetime.utcnow())
+    assert started == ['tag2']
+    assert 'checkpoint' not in action.output
+
+
+def test_file_metadata_resolver_bulk_fetch(monkeypatch):
+    searches = []
+    gets = []
+
+    def mock_search(query, key=None):
+        searches.append(query)
+        accessions = [i.split('&')[0] for i in query.split('accession=')[1:]]
+        return [{'accession': acc, 'uuid': acc.lower()} for acc in accessions]
+
+    def mock_get(identifier, key=None):
+        gets.append(identifier)
+        return {'uuid': identifier}
+
+    monkeypatch.setattr(wfr_utils.ff_utils, 'search_metadata', mock_search)
+    monkeypatch.setattr(wfr_utils.ff_utils, 'get_metadata', mock_get)
+    run_info = ['step1', ['bwa-mem', 'human', {}],
+                {'fastq1': '/files-fastq/4DNFIAAAAAAA/', 'fastq2': '/files-fastq/4DNFIBBBBBBB/',
+                 'bwa_index': '4DNFIZQZ39L9', 'input_bams': [['/files-processed/4DNFICCCCCCC/']],
+                 'additional_file_parameters': {'fastq1': {'mount': True}}},
+                'name_tag']
+    assert run_input_files(run_info) == ['/files-fastq/4DNFIAAAAAAA/', '/files-fastq/4DNFIBBBBBBB/',
+                                         '4DNFIZQZ39L9', '/files-processed/4DNFICCCCCCC/']
+    resolver = FileMetadataResolver({})
+    resolver.chunk_size = 3
+    resolver.prefetch(run_input_files(run_info) + ['/files-fastq/4DNFIAAAAAAA/'])
+    assert len(searches) == 2
+    assert resolver.get('/files-fastq/4DNFIAAAAAAA/')['uuid'] == '4dnfiaaaaaaa'
+    assert resolver.get('4DNFICCCCCCC')['uuid'] == '4dnficcccccc'
+    assert gets == []
+    assert resolver.get('/files-reference/4DNFIDDDDDDD/') == {'uuid': '/files-reference/4DNFIDDDDDDD/'}
+    assert gets == ['/files-reference/4DNFIDDDDDDD/']
+
+
+class MockS3Util(object):
+    raw_file_bucket = 'raw-bucket'
+    outfile_bucket = 'out-bucket'
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.heads = []
+        self.lists = []
+        self.s3 = self
+
+    def does_key_exist(self, key, bucket, print_error=True):
+        self.heads.append(key)
+        return {'ContentLength': 1} if key in self.keys.get(bucket, []) else False
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket):
+        self.lists.append(Bucket)
+        yield {'Contents': [{'Key': k} for k in self.keys.get(Bucket, [])]}
+
+
+def test_s3_key_index_heads_small_sets():
+    s3_util = MockS3Util({'raw-bucket': ['a/1.fastq.gz']})
+    key_index = wfr_utils.S3KeyIndex(s3_util)
+    key_index.prepare(['a/1.fastq.gz', 'b/2.fastq.gz', 'a/1.fastq.gz'], 'raw-bucket')
+    assert sorted(s3_util.heads) == ['a/1.fastq.gz', 'b/2.fastq.gz']
+    assert key_index.exists('a/1.fastq.gz', 'raw-bucket')
+    assert not key_index.exists('b/2.fastq.gz', 'raw-bucket')
+    assert len(s3_util.heads) == 2
+    # not prepared, falls back to HEAD
+    assert not key_index.exists('c/3.fastq.gz', 'raw-bucket')
+    assert len(s3_util.heads) == 3
+    assert s3_util.lists == []
+
+
+def test_s3_key_index_lists_large_sets(monkeypatch):
+    monkeypatch.setattr(wfr_utils.S3KeyIndex, 'list_threshold', 1)
+    s3_util = MockS3Util({'raw-bucket': ['a/1.fastq.gz', 'c/3.fastq.gz']})
+    key_index = wfr_utils.S3KeyIndex(s3_util)
+    key_index.prepare(['a/1.fastq.gz', 'b/2.fastq.gz'], 'raw-bucket')
+    assert s3_util.lists == ['raw-bucket']
+    assert key_index.exists('a/1.fastq.gz', 'raw-bucket')
+    assert key_index.exists('c/3.fastq.gz', 'raw-bucket')
+    assert not key_index.exists('b/2.fastq.gz', 'raw-bucket')
+    assert s3_util.heads == []
+
+
+def test_remove_prereleased_and_not_uploaded():
+    class MockConnection(object):
+        ff_s3 = MockS3Util({'raw-bucket': ['a/1.fastq.gz']})
+
+    files = [{'status': 'pre-release', 'upload_key': 'a/1.fastq.gz'},
+             {'status': 'restricted', 'upload_key': 'b/2.fastq.gz'},
+             {'status': 'uploaded', 'upload_key': 'c/3.fastq.gz'}]
+    kept = wfr_utils.remove_prereleased_and_not_uploaded(MockConnection(), files)
+    assert kept == [files[0], files[2]]
+    assert sorted(MockConnection.ff_s3.heads) == ['a/1.fastq.gz', 'b/2.fastq.gz']
+
+
+class MockCheck(object):
+    def __init__(self, latest=None):
+        self.latest = latest
+        self.brief_output = []
+        self.full_output = {'skipped': [], 'running_runs': [], 'needs_runs': [],
+                            'completed_runs': [], 'problematic_runs': []}
+
+    def get_latest_result(self):
+        return self.latest
+
+
+def test_select_sets_to_check_incremental():
+    kwargs = {'incremental': True, 'full_refresh_hours': 24}
+    sets = [{'accession': acc, 'last_modified': {'date_modified': '2024-01-01'}} for acc in ['S1', 'S2', 'S3', 'S4']]
+    # first run evaluates all sets
+    first = MockCheck()
+    assert wfr_utils.select_sets_to_check(sets, first, kwargs) == sets
+    first.brief_output = ['S1 - human | skipped - no organism', 'S2 - human | running step 1/2',
+                          'S3 - human | problem in step3', 'S4 - human | missing step3']
+    first.full_output['skipped'].append({'S1': 'skipped - no organism'})
+    first.full_output['running_runs'].append({'S2': []})
+    first.full_output['problematic_runs'].append({'S3': []})
+    first.full_output['needs_runs'].append({'S4': []})
+    wfr_utils.save_set_states(first, sets)
+    assert set(first.full_output['set_states']['sets']) == {'S1', 'S2', 'S3', 'S4'}
+
+    # unchanged sets without pending runs are carried over, modified sets are evaluated
+    sets[2] = {'accession': 'S3', 'last_modified': {'date_modified': '2024-02-01'}}
+    second = MockCheck({'brief_output': first.brief_output, 'full_output': first.full_output})
+    to_check = wfr_utils.select_sets_to_check(sets, second, kwargs)
+    assert [s['accession'] for s in to_check] == ['S2', 'S3', 'S4']
+    assert second.brief_output == ['S1 - human | skipped - no organism']
+    assert second.full_output['skipped'] == [{'S1': 'skipped - no organism'}]
+    assert second.full_output['problematic_runs'] == []
+
+    # different kwargs or incremental=False evaluate all sets
+    third = MockCheck({'brief_output': first.brief_output, 'full_output': first.full_output})
+    assert wfr_utils.select_sets_to_check(sets, third, dict(kwargs, lab_title='Lab')) == sets
+    assert wfr_utils.select_sets_to_check(sets, third, dict(kwargs, incremental=False)) == sets
+
+    # sets not evaluated for full_refresh_hours are evaluated again
+    old = (datetime.utcnow() - timedelta(hours=25)).isoformat()
+    first.full_output['set_states']['sets']['S1'][1] = old
+    fourth = MockCheck({'brief_output': first.brief_output, 'full_output': first.full_output})
+    assert len(wfr_utils.select_sets_to_check(sets, fourth, kwargs)) == 4
+
+
+class MockSearchResponse(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def test_run_budget_counts_once_and_decrements(monkeypatch):
+    queries = []
+
+    def mock_authorized_request(url, auth=None, retry_fxn=None):
+        queries.append(url)
+        assert retry_fxn is wfr_utils.ff_utils.search_request_with_retries
+        return MockSearchResponse(200, {'@graph': [], 'total': 170})
+
+    monkeypatch.setattr(wfr_utils.ff_utils, 'authorized_request', mock_authorized_request)
+    monkeypatch.setattr(wfr_utils, '_run_budget', {})
+    auth = {'server': 'https://data.4dn'}
+    check = MockCheck()
+    check, n_runs = wfr_utils.limit_number_of_runs(check, auth)
+    assert n_runs == 10
+    assert len(queries) == 1 and queries[0].endswith('&limit=0')
+    wfr_utils.use_run_budget(auth, 4)
+    assert wfr_utils.get_run_budget(auth) == 6
+    wfr_utils.use_run_budget(auth, 10)
+    check, n_runs = wfr_utils.limit_number_of_runs(check, auth)
+    assert n_runs == 0 and check.brief_output == ['Waiting (max 6h) due to Docker Hub rate limit']
+    assert len(queries) == 1
+
+
+def test_run_budget_with_no_recent_runs(monkeypatch):
+    def mock_request(url, auth=None, **kwargs):
+        # fourfront returns 404 with an empty result for an empty search
+        return MockSearchResponse(404, {'@graph': [], 'total': 0, 'notification': 'No results found'})
+
+    # the retry function must accept the 404 of an empty search
+    def mock_authorized_request(url, auth=None, retry_fxn=None):
+        return retry_fxn(mock_request, url, auth, 'GET')
+
+    monkeypatch.setattr(wfr_utils.ff_utils, 'authorized_request', mock_authorized_request)
+    monkeypatch.setattr(wfr_utils, '_run_budget', {})
+    check, n_runs = wfr_utils.limit_number_of_runs(MockCheck(), {'server': 'https://data.4dn/'})
+    assert n_runs == wfr_utils.n_runs_max
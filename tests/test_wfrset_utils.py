@@ -0,0 +1,30 @@
+import pytest
+from chalicelib_fourfront.checks.helpers import wfrset_utils
+
+
+def test_step_settings_fills_organism_and_defaults():
+    settings = wfrset_utils.step_settings('imargi-processing-bam', 'mouse', {'lab': 'a-lab'})
+    assert settings['app_name'] == 'imargi-processing-bam'
+    assert settings['parameters']['assembly'] == 'mm10'
+    assert all(fields['genome_assembly'] == 'GRCm38' for fields in settings['custom_pf_fields'].values())
+    assert settings['config']['log_bucket'] == 'tibanna-output'
+    assert settings['common_fields'] == {'lab': 'a-lab'}
+
+
+def test_step_settings_returns_independent_copies():
+    overwrite = {'config': {'ebs_size': 99}, 'parameters': {'nThreads': 4}}
+    first = wfrset_utils.step_settings('bwa-mem', 'human', {}, overwrite)
+    second = wfrset_utils.step_settings('bwa-mem', 'human', {})
+    assert first['config']['ebs_size'] == 99 and first['parameters']['nThreads'] == 4
+    assert 'ebs_size' not in second['config'] and second['parameters']['nThreads'] == 16
+    assert wfrset_utils.step_templates['bwa-mem']['custom_pf_fields']['out_bam']['genome_assembly'] == wfrset_utils.GENOME
+
+
+def test_build_step_templates_validates():
+    with pytest.raises(ValueError):
+        wfrset_utils.build_step_templates([{'app_name': 'a'}])
+    with pytest.raises(ValueError):
+        wfrset_utils.build_step_templates([{'app_name': 'a', 'workflow_uuid': '1', 'config': []}])
+    with pytest.raises(ValueError):
+        wfrset_utils.build_step_templates([{'app_name': 'a', 'workflow_uuid': '1'},
+                                           {'app_name': 'a', 'workflow_uuid': '2'}])